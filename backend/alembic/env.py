@@ -0,0 +1,57 @@
+"""
+Alembic environment - dùng chung DATABASE_URL và metadata với app
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from app.database import engine, Base
+from app import models  # noqa: F401 - đăng ký tất cả models vào Base.metadata
+from app.search import is_search_object
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Bỏ qua index tìm kiếm (FTS5 / tsvector), tạo bằng DDL trong app/search.py chứ không qua ORM"""
+    return not is_search_object(name, type_)
+
+
+def run_migrations_offline() -> None:
+    """Generate SQL scripts without connecting to the database"""
+    context.configure(
+        url=str(engine.url),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
+        render_as_batch=engine.dialect.name == "sqlite",
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    """Run migrations against the app's engine"""
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+            # SQLite không hỗ trợ đầy đủ ALTER TABLE
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,57 @@
+"""Composite indexes for hot study tables and unique (user_id, flashcard_id) study records
+
+Database cũ được tạo bằng Base.metadata.create_all nên không có các index này.
+Database mới tạo bởi create_all đã có sẵn, vì vậy migration chỉ tạo những index còn thiếu.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns, unique)
+INDEXES = [
+    ("uq_study_records_user_flashcard", "study_records", ["user_id", "flashcard_id"], True),
+    ("ix_study_records_user_next_review", "study_records", ["user_id", "next_review_date"], False),
+    ("ix_study_sessions_user_started", "study_sessions", ["user_id", "started_at"], False),
+    ("ix_study_sessions_user_set_completed", "study_sessions", ["user_id", "set_id", "completed_at"], False),
+    ("ix_flashcards_set_id", "flashcards", ["set_id"], False),
+    ("ix_flashcard_sets_owner_id", "flashcard_sets", ["owner_id"], False),
+    ("ix_flashcard_sets_is_public", "flashcard_sets", ["is_public"], False),
+    ("ix_leaderboard_points", "leaderboard", ["points"], False),
+]
+
+
+def _existing_indexes(table: str) -> set:
+    inspector = sa.inspect(op.get_bind())
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    # Xóa study records trùng lặp trước khi tạo unique index (giữ record cũ nhất)
+    op.execute(
+        "DELETE FROM study_records WHERE id NOT IN ("
+        "SELECT MIN(id) FROM study_records GROUP BY user_id, flashcard_id)"
+    )
+
+    for name, table, columns, unique in INDEXES:
+        if name not in _existing_indexes(table):
+            op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade() -> None:
+    for name, table, columns, unique in reversed(INDEXES):
+        if name in _existing_indexes(table):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,45 @@
+"""study_progress: materialized per-(user, set) progress counters
+
+Bảng được điền dần khi user mở trang tiến độ (xem app/progress_summary.py),
+nên migration không cần backfill.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("study_progress"):
+        return
+    op.create_table(
+        "study_progress",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("set_id", sa.Integer(), sa.ForeignKey("flashcard_sets.id"), primary_key=True),
+        sa.Column("total_cards", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cards_studied", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cards_mastered", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cards_due", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("next_due_date", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("daily_progress", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("daily_progress_date", sa.Date(), nullable=True),
+        sa.Column("streak_days", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_index("ix_study_progress_set_id", "study_progress", ["set_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_study_progress_set_id", table_name="study_progress")
+    op.drop_table("study_progress")
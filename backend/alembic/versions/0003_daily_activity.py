@@ -0,0 +1,53 @@
+"""daily_activity: per-user daily rollup of completed study sessions
+
+Backfill từ study_sessions đã hoàn thành, gom theo ngày UTC của started_at.
+main.py có thể đã tạo bảng (create_all) trước migration: khi đó chỉ bỏ qua
+CREATE, còn backfill vẫn chạy nếu bảng còn trống.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table("daily_activity"):
+        op.create_table(
+            "daily_activity",
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column("cards_studied", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("cards_correct", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("sessions_count", sa.Integer(), nullable=False, server_default="0"),
+        )
+    elif bind.execute(sa.text("SELECT 1 FROM daily_activity LIMIT 1")).first() is not None:
+        return
+
+    if bind.dialect.name == "sqlite":
+        day = "date(started_at)"
+    else:
+        day = "CAST(started_at AT TIME ZONE 'UTC' AS DATE)"
+    op.execute(
+        "INSERT INTO daily_activity (user_id, day, cards_studied, cards_correct, sessions_count) "
+        f"SELECT user_id, {day}, SUM(COALESCE(cards_studied, 0)), SUM(COALESCE(cards_correct, 0)), COUNT(*) "
+        "FROM study_sessions "
+        "WHERE completed_at IS NOT NULL AND started_at IS NOT NULL "
+        f"GROUP BY user_id, {day}"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("daily_activity")
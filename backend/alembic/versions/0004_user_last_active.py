@@ -0,0 +1,37 @@
+"""users.last_active_at: denormalized last study activity
+
+Backfill bằng thời điểm hoạt động (completed_at hoặc started_at) gần nhất của mỗi user.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("users")}
+    if "last_active_at" not in columns:
+        op.add_column("users", sa.Column("last_active_at", sa.DateTime(timezone=True), nullable=True))
+    op.execute(
+        "UPDATE users SET last_active_at = ("
+        "SELECT MAX(COALESCE(study_sessions.completed_at, study_sessions.started_at)) "
+        "FROM study_sessions WHERE study_sessions.user_id = users.id"
+        ") WHERE last_active_at IS NULL"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("last_active_at")
@@ -0,0 +1,44 @@
+"""(created_at, id) indexes for keyset pagination of sets and users
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns)
+INDEXES = [
+    ("ix_flashcard_sets_owner_created", "flashcard_sets", ["owner_id", "created_at", "id"]),
+    ("ix_flashcard_sets_public_created", "flashcard_sets", ["is_public", "created_at", "id"]),
+    ("ix_flashcard_sets_created", "flashcard_sets", ["created_at", "id"]),
+    ("ix_users_created", "users", ["created_at", "id"]),
+]
+
+
+def _existing_indexes(table: str) -> set:
+    inspector = sa.inspect(op.get_bind())
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        if name not in _existing_indexes(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, columns in reversed(INDEXES):
+        if name in _existing_indexes(table):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,52 @@
+"""Full-text search index over flashcards.front/back
+
+SQLite: bảng FTS5 external-content flashcards_fts + trigger đồng bộ, rồi 'rebuild'
+để đánh index các thẻ đã có. PostgreSQL: cột tsvector generated + GIN index.
+(DDL lấy từ app/search.py, app cũng tự tạo khi khởi động.)
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from app.search import POSTGRES_DDL, SQLITE_DDL, SQLITE_REBUILD
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SQLITE_UPGRADE = [*SQLITE_DDL, SQLITE_REBUILD]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS flashcards_fts_update",
+    "DROP TRIGGER IF EXISTS flashcards_fts_delete",
+    "DROP TRIGGER IF EXISTS flashcards_fts_insert",
+    "DROP TABLE IF EXISTS flashcards_fts",
+]
+
+POSTGRES_UPGRADE = POSTGRES_DDL
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_flashcards_search_vector",
+    "ALTER TABLE flashcards DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    for statement in SQLITE_UPGRADE if dialect == "sqlite" else POSTGRES_UPGRADE:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    for statement in SQLITE_DOWNGRADE if dialect == "sqlite" else POSTGRES_DOWNGRADE:
+        op.execute(statement)
@@ -0,0 +1,47 @@
+"""card_signatures, card_signature_bands: MinHash/LSH data for duplicate detection
+
+Không backfill: app/dedup.py đánh index lười các thẻ chưa có signature
+trong lần kiểm tra trùng đầu tiên của mỗi set.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("card_signatures"):
+        op.create_table(
+            "card_signatures",
+            sa.Column("flashcard_id", sa.Integer(), sa.ForeignKey("flashcards.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("set_id", sa.Integer(), sa.ForeignKey("flashcard_sets.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("content_hash", sa.BigInteger(), nullable=False),
+            sa.Column("signature", sa.LargeBinary(), nullable=False),
+        )
+        op.create_index("ix_card_signatures_set_hash", "card_signatures", ["set_id", "content_hash"])
+    if not inspector.has_table("card_signature_bands"):
+        op.create_table(
+            "card_signature_bands",
+            sa.Column("set_id", sa.Integer(), sa.ForeignKey("flashcard_sets.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("bucket", sa.BigInteger(), primary_key=True),
+            sa.Column("flashcard_id", sa.Integer(), primary_key=True),
+            sqlite_with_rowid=False,
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("card_signature_bands")
+    op.drop_table("card_signatures")
@@ -0,0 +1,204 @@
+"""
+On-disk cache of AI generation results
+
+Results are stored as JSON files named by the sha256 of the normalized
+request (topic, number_of_cards, difficulty, model, PROMPT_VERSION), so a
+repeated topic is answered from disk instead of another LLM call. The
+cache is bounded by total bytes (least recently used files are evicted
+first) and entries expire after AI_CACHE_TTL seconds. Concurrent identical
+requests share one in-flight upstream call. Only well-formed results (a
+non-empty list of {"front", "back"} cards) are stored, so a failed or
+malformed LLM reply is retried on the next request instead of being served
+for the whole TTL.
+
+get/put/clear block on file I/O (and the first call scans the directory);
+async code calls them through run_in_threadpool, get_or_compute already does.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+from starlette.concurrency import run_in_threadpool
+
+AI_CACHE_DIR = Path(os.getenv("AI_CACHE_DIR", "cache/ai"))
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", str(7 * 24 * 3600)))
+
+def cache_key(topic: str, number_of_cards: int, difficulty: str, model: str, prompt_version: str) -> str:
+    normalized = [
+        prompt_version,
+        model,
+        " ".join(topic.split()).casefold(),
+        number_of_cards,
+        difficulty.strip().lower(),
+    ]
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode()).hexdigest()
+
+def is_cacheable(value) -> bool:
+    """A non-empty list of cards whose front and back are non-empty strings"""
+    return isinstance(value, list) and bool(value) and all(
+        isinstance(card, dict)
+        and isinstance(card.get("front"), str) and card["front"].strip()
+        and isinstance(card.get("back"), str) and card["back"].strip()
+        for card in value
+    )
+
+class AICache:
+    def __init__(self, directory: Path = AI_CACHE_DIR, max_bytes: int = AI_CACHE_MAX_BYTES, ttl: float = AI_CACHE_TTL):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (size in bytes, written at), theo thứ tự LRU (cũ nhất ở đầu)
+        self._index: "OrderedDict[str, tuple[int, float]]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # Requests served by another request's in-flight call
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _load_index(self):
+        """Rebuild the in-memory index from the files on disk (oldest access first)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        entries = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_atime, path.stem, stat.st_size, stat.st_mtime))
+        for _, key, size, written_at in sorted(entries):
+            self._index[key] = (size, written_at)
+            self._total_bytes += size
+
+    def _remove(self, key: str):
+        size, _ = self._index.pop(key)
+        self._total_bytes -= size
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[list]:
+        value = self._read(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _read(self, key: str) -> Optional[list]:
+        with self._lock:
+            self._load_index()
+            entry = self._index.get(key)
+            if entry is not None and entry[1] + self.ttl < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                return None
+            path = self._path(key)
+            try:
+                value = json.loads(path.read_bytes())
+            except (OSError, ValueError):
+                value = None
+            # File hỏng, hoặc kết quả lỗi được ghi trước khi có is_cacheable
+            if not is_cacheable(value):
+                self._remove(key)
+                return None
+            self._index.move_to_end(key)
+        # Ghi lại thời điểm truy cập để thứ tự LRU còn đúng sau khi restart
+        try:
+            os.utime(path, (time.time(), entry[1]))
+        except OSError:
+            pass
+        return value
+
+    def put(self, key: str, value: list):
+        if not is_cacheable(value):
+            return
+        data = json.dumps(value, ensure_ascii=False).encode()
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._load_index()
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)[0]
+            self._index[key] = (len(data), time.time())
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._index)))
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[list]]) -> list:
+        """Return the cached value or compute it; concurrent callers for one key share the computation.
+
+        Hit/miss counters are left to the caller's get(), so a lookup is not counted twice.
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+            # shield: một client hủy request không được hủy lời gọi dùng chung
+            return await asyncio.shield(future)
+
+        # Đăng ký future trước khi đọc đĩa: caller đến trong lúc đọc cũng dùng chung kết quả
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await run_in_threadpool(self._read, key)
+            if value is not None:
+                future.set_result(value)
+                return value
+            value = await compute()
+            if is_cacheable(value):
+                try:
+                    await run_in_threadpool(self.put, key, value)
+                except OSError as e:
+                    print(f"AI cache write failed: {e}")
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("Upstream call cancelled"))
+            # Không để "Future exception was never retrieved" khi không có ai chờ
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def clear(self):
+        with self._lock:
+            self._load_index()
+            for key in list(self._index):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "shared_inflight": self.shared,
+                "inflight": len(self._inflight),
+            }
+
+ai_cache = AICache()
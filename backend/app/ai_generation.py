@@ -0,0 +1,263 @@
+"""
+In-process job queue for AI flashcard generation
+
+POST /api/ai/jobs enqueues a request and returns immediately; a fixed
+number of asyncio workers (AI_CONCURRENCY) call the LLM backend with an
+async client, so a slow round trip holds neither a threadpool thread nor
+a DB session. When the queue is full new jobs are rejected with 503.
+AI_BACKEND=fake swaps in a local backend for offline load testing.
+With a set_id the generated cards are checked against that set and each
+one carries a "duplicate" field (see app/dedup.py).
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Dict, List, Optional
+from fastapi import HTTPException, status
+from openai import AsyncOpenAI
+from starlette.concurrency import run_in_threadpool
+from app import dedup
+from app.ai_cache import ai_cache, cache_key
+
+AI_BACKEND = os.getenv("AI_BACKEND", "openai")  # openai | fake
+AI_MODEL = os.getenv("AI_MODEL", "gpt-3.5-turbo")
+
+# Tăng khi đổi prompt để kết quả cũ trong ai_cache không còn được dùng
+PROMPT_VERSION = "1"
+
+# Số job chạy đồng thời và số job chờ tối đa trong hàng đợi
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "4"))
+AI_QUEUE_MAX_SIZE = int(os.getenv("AI_QUEUE_MAX_SIZE", "100"))
+
+# Thời gian tối đa cho một lần gọi LLM, và thời gian giữ kết quả job đã xong
+AI_JOB_TIMEOUT = float(os.getenv("AI_JOB_TIMEOUT", "120"))
+AI_JOB_TTL = float(os.getenv("AI_JOB_TTL", "3600"))
+
+# Độ trễ giả lập của fake backend (giây)
+AI_FAKE_LATENCY = float(os.getenv("AI_FAKE_LATENCY", "0.5"))
+
+class GenerationError(Exception):
+    pass
+
+def build_prompt(topic: str, number_of_cards: int, difficulty: str) -> str:
+    return f"""Generate {number_of_cards} flashcards about {topic} with {difficulty} difficulty level.
+Return the response as a JSON array with the following format:
+[
+  {{"front": "Question or term", "back": "Answer or definition"}},
+  ...
+]
+
+Make sure the flashcards are educational and cover important aspects of {topic}."""
+
+def parse_flashcards(content: str) -> list:
+    """Extract the JSON array of cards from the model's reply"""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        # Try to extract JSON from markdown code blocks
+        if "```json" in content:
+            content = content.split("```json")[1].split("```")[0]
+        elif "```" in content:
+            content = content.split("```")[1].split("```")[0]
+        return json.loads(content.strip())
+
+class OpenAIBackend:
+    def __init__(self):
+        api_key = os.getenv("OPENAI_API_KEY")
+        self.client = AsyncOpenAI(api_key=api_key) if api_key else None
+
+    @property
+    def configured(self) -> bool:
+        return self.client is not None
+
+    async def generate(self, topic: str, number_of_cards: int, difficulty: str) -> list:
+        if not self.client:
+            raise GenerationError("OpenAI API key not configured")
+        response = await self.client.chat.completions.create(
+            model=AI_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that creates educational flashcards. Always return valid JSON arrays."},
+                {"role": "user", "content": build_prompt(topic, number_of_cards, difficulty)}
+            ],
+            temperature=0.7
+        )
+        return parse_flashcards(response.choices[0].message.content)
+
+class FakeBackend:
+    """Local stand-in for the LLM: sleeps AI_FAKE_LATENCY (±50%) and returns numbered cards"""
+    configured = True
+
+    async def generate(self, topic: str, number_of_cards: int, difficulty: str) -> list:
+        await asyncio.sleep(AI_FAKE_LATENCY * random.uniform(0.5, 1.5))
+        return [
+            {"front": f"{topic} ({difficulty}) question {i + 1}", "back": f"{topic} answer {i + 1}"}
+            for i in range(number_of_cards)
+        ]
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "fake": FakeBackend,
+}
+
+class GenerationJob:
+    def __init__(self, user_id: int, params: dict, set_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.params = params
+        self.set_id = set_id  # Set to flag duplicates against (not part of the cache key)
+        self.status = "queued"  # queued | running | done | failed
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.cached = False
+        self.changed = asyncio.Event()  # Được set (và thay mới) mỗi khi trạng thái đổi
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def _set_status(self, new_status: str):
+        self.status = new_status
+        if self.finished:
+            self.finished_at = time.time()
+        # Đánh thức các client đang chờ (poll/SSE) rồi tạo event mới cho lần đổi tiếp theo
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self):
+        while not self.finished:
+            await self.changed.wait()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "cached": self.cached,
+        }
+
+class GenerationQueue:
+    def __init__(self, concurrency: int = AI_CONCURRENCY, max_size: int = AI_QUEUE_MAX_SIZE):
+        self.concurrency = concurrency
+        self.max_size = max_size
+        self.backend = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._jobs: Dict[str, GenerationJob] = {}
+
+    def start(self, backend_name: str = AI_BACKEND):
+        """Start the worker tasks on the running event loop"""
+        if self._workers:
+            return
+        if backend_name not in BACKENDS:
+            raise ValueError(f"Unknown AI_BACKEND: {backend_name}")
+        self.backend = BACKENDS[backend_name]()
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def submit(
+        self,
+        user_id: int,
+        topic: str,
+        number_of_cards: int,
+        difficulty: str,
+        set_id: Optional[int] = None
+    ) -> GenerationJob:
+        """Enqueue a job, 503 with Retry-After when the queue is full.
+
+        A request already in the result cache completes immediately without queueing
+        (unless it still needs the duplicate check against set_id, which reads the DB).
+        """
+        self.start()
+        self._prune()
+        job = GenerationJob(user_id, {
+            "topic": topic,
+            "number_of_cards": number_of_cards,
+            "difficulty": difficulty,
+        }, set_id=set_id)
+        flashcards = await run_in_threadpool(ai_cache.get, self._cache_key(job))
+        if flashcards is not None:
+            job.cached = True
+            if set_id is None:
+                job.result = {"flashcards": flashcards}
+                job._set_status("done")
+                self._jobs[job.id] = job
+                return job
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI generation queue is full, please retry later",
+                headers={"Retry-After": "5"}
+            )
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[GenerationJob]:
+        return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "concurrency": self.concurrency,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": sum(1 for job in self._jobs.values() if job.status == "running"),
+            "max_queue_size": self.max_size,
+        }
+
+    def _cache_key(self, job: GenerationJob) -> str:
+        # Mỗi backend có kết quả riêng (fake backend không được lẫn với model thật)
+        model = AI_MODEL if isinstance(self.backend, OpenAIBackend) else type(self.backend).__name__
+        return cache_key(model=model, prompt_version=PROMPT_VERSION, **job.params)
+
+    def _prune(self):
+        cutoff = time.time() - AI_JOB_TTL
+        for job_id in [job.id for job in self._jobs.values() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: GenerationJob):
+        job._set_status("running")
+        try:
+            flashcards = await ai_cache.get_or_compute(
+                self._cache_key(job),
+                lambda: asyncio.wait_for(self.backend.generate(**job.params), timeout=AI_JOB_TIMEOUT)
+            )
+            if job.set_id is not None and isinstance(flashcards, list):
+                flashcards = await run_in_threadpool(dedup.annotate_cards, job.set_id, flashcards)
+            job.result = {"flashcards": flashcards}
+            job._set_status("done")
+        except asyncio.CancelledError:
+            job.error = "Cancelled"
+            job._set_status("failed")
+            raise
+        except asyncio.TimeoutError:
+            job.error = "Timed out waiting for the AI backend"
+            job._set_status("failed")
+        except Exception as e:
+            job.error = str(e)
+            job._set_status("failed")
+
+generation_queue = GenerationQueue()
@@ -4,15 +4,28 @@ from jose import JWTError, jwt
 import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app import models, schemas
+from app.user_cache import user_cache
+from app.process_pool import BoundedProcessPool
 import os
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# Bcrypt cost; existing hashes with a different cost are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Bcrypt runs in a dedicated process pool so login bursts cannot starve the
+# request threadpool; when too many hashes are pending, requests fail fast with 503
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+password_pool = BoundedProcessPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -34,7 +47,7 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         print(f"Error verifying password: {e}")
         return False
 
-def get_password_hash(password: str) -> str:
+def get_password_hash(password: str, rounds: Optional[int] = None) -> str:
     """Hash a password using bcrypt"""
     # Bcrypt has a 72 byte limit
     # Truncate password to 72 bytes if it's too long
@@ -43,11 +56,28 @@ def get_password_hash(password: str) -> str:
         password_bytes = password_bytes[:72]
     
     # Generate salt and hash
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password_bytes, salt)
     # Return as string (bcrypt hash is always valid UTF-8)
     return hashed.decode('utf-8')
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True if the hash was made with a different bcrypt cost than BCRYPT_ROUNDS"""
+    try:
+        # Format: $2b$<cost>$<salt+hash>
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password in the password process pool"""
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash in the password process pool"""
+    # Truyền cost từ process chính để worker không phụ thuộc vào env của nó
+    return await password_pool.run(get_password_hash, password, BCRYPT_ROUNDS)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -72,9 +102,21 @@ def authenticate_user(db: Session, username: str, password: str):
         return False
     return user
 
+async def authenticate_user_async(db: AsyncSession, username: str, password: str):
+    """authenticate_user without blocking the event loop; rehashes if BCRYPT_ROUNDS changed"""
+    user = await db.scalar(select(models.User).where(models.User.username == username))
+    if not user:
+        return False
+    if not await verify_password_async(password, user.hashed_password):
+        return False
+    if password_needs_rehash(user.hashed_password):
+        user.hashed_password = await get_password_hash_async(password)
+        await db.commit()
+    return user
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -88,8 +130,14 @@ async def get_current_user(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = get_user_by_username(db, username=username)
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        result = await db.execute(select(models.User).where(models.User.username == username))
+        user = result.scalar_one_or_none()
+        if user is None:
+            raise credentials_exception
+        # Detach so the cached object can never lazy-load or be flushed through a session
+        db.expunge(user)
+        user_cache.put(username, user)
     return user
 
@@ -0,0 +1,200 @@
+"""
+Avatar storage
+
+Uploads are copied from the spooled multipart file to disk in chunks (one
+threadpool call, sha256 computed on the way, aborted as soon as the size
+limit is exceeded). The image is decoded and resized to AVATAR_SIZES square
+WebP thumbnails in a process pool, so Pillow never runs on the event loop
+or in the request threadpool.
+
+Files are content-addressed: uploads/avatars/<aa>/<sha256>-<size>.webp,
+so an image uploaded twice is stored once and a URL never changes content.
+A superseded avatar is deleted once no user references it any more, and a
+periodic sweep removes anything left unreferenced (legacy timestamped
+files, leftovers of failed uploads). Both skip files touched within
+AVATAR_GC_GRACE: an upload that reuses existing files refreshes their mtime
+before the DB commit that references them, and checks them again after it.
+"""
+import hashlib
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+from fastapi import HTTPException, status
+from PIL import Image, ImageOps
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from app import models
+from app.database import SessionLocal
+from app.process_pool import BoundedProcessPool
+
+AVATAR_DIR = Path("uploads/avatars")
+AVATAR_URL_PREFIX = "/uploads/avatars/"
+
+AVATAR_MAX_BYTES = 5 * 1024 * 1024
+# Ảnh quá nhiều pixel bị từ chối trước khi giải nén (decompression bomb)
+AVATAR_MAX_PIXELS = 40_000_000
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+ALLOWED_CONTENT_TYPES = ("image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp")
+ALLOWED_FORMATS = ("JPEG", "PNG", "GIF", "WEBP")
+
+# Kích thước thumbnail (px, vuông); avatar_url trỏ tới kích thước đầu tiên
+AVATAR_SIZES = (256, 64)
+WEBP_QUALITY = 85
+
+AVATAR_WORKERS = int(os.getenv("AVATAR_WORKERS", "2"))
+AVATAR_MAX_PENDING = int(os.getenv("AVATAR_MAX_PENDING", "16"))
+
+# Chu kỳ dọn file không còn ai dùng, và tuổi tối thiểu của file bị dọn (tránh xóa upload đang chạy)
+AVATAR_GC_INTERVAL = float(os.getenv("AVATAR_GC_INTERVAL", str(24 * 3600)))
+AVATAR_GC_GRACE = 3600
+
+avatar_pool = BoundedProcessPool(AVATAR_WORKERS, AVATAR_MAX_PENDING)
+
+def avatar_path(digest: str, size: int) -> Path:
+    return AVATAR_DIR / digest[:2] / f"{digest}-{size}.webp"
+
+def avatar_url(digest: str, size: int = AVATAR_SIZES[0]) -> str:
+    return f"{AVATAR_URL_PREFIX}{digest[:2]}/{digest}-{size}.webp"
+
+def _files_for_url(url: str) -> list:
+    """Files behind an avatar URL: every thumbnail size for content-addressed ones, else the single legacy file"""
+    if not url or not url.startswith(AVATAR_URL_PREFIX):
+        return []
+    relative = Path(url[len(AVATAR_URL_PREFIX):])
+    if ".." in relative.parts:
+        return []
+    digest, _, size = relative.stem.rpartition("-")
+    if relative.suffix == ".webp" and digest and size.isdigit():
+        return [avatar_path(digest, thumbnail_size) for thumbnail_size in AVATAR_SIZES]
+    return [AVATAR_DIR / relative]
+
+def spool_upload(file: BinaryIO) -> Tuple[Path, str]:
+    """Copy an upload to a temporary file in chunks; returns (path, sha256 hex). Blocking."""
+    AVATAR_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = AVATAR_DIR / f".upload-{uuid.uuid4().hex}.tmp"
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while chunk := file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > AVATAR_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="File size too large. Maximum size is 5MB."
+                    )
+                hasher.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return tmp_path, hasher.hexdigest()
+
+def make_thumbnails(source: str, targets: Dict[int, str]):
+    """Decode the image and write one square WebP per {size: path}. Runs in the avatar process pool."""
+    try:
+        with Image.open(source) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise ValueError(f"Unsupported image format: {image.format}")
+            if image.width * image.height > AVATAR_MAX_PIXELS:
+                raise ValueError("Image dimensions too large")
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+            for size, path in targets.items():
+                thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                thumbnail.save(tmp_path, "WEBP", quality=WEBP_QUALITY)
+                os.replace(tmp_path, path)
+    except Image.DecompressionBombError:
+        raise ValueError("Image dimensions too large")
+    except OSError:
+        # Không trả thông điệp gốc của Pillow (có đường dẫn file trên server)
+        raise ValueError("Cannot read image")
+
+def _claim(paths) -> bool:
+    """Refresh the mtime of existing files so release/collect_garbage keep them; False if one is missing. Blocking."""
+    try:
+        for path in paths:
+            os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+def _is_stored(digest: str) -> bool:
+    return all(avatar_path(digest, size).exists() for size in AVATAR_SIZES)
+
+async def store_avatar(file: BinaryIO) -> str:
+    """Store an uploaded image and return its sha256 (400 if it is too large or not an image)"""
+    tmp_path, digest = await run_in_threadpool(spool_upload, file)
+    try:
+        targets = {size: avatar_path(digest, size) for size in AVATAR_SIZES}
+        # Cùng nội dung đã được lưu (và kiểm tra) trước đó thì không cần xử lý lại
+        if not await run_in_threadpool(_claim, list(targets.values())):
+            try:
+                # Đường dẫn tuyệt đối: worker không phụ thuộc thư mục làm việc của nó
+                await avatar_pool.run(
+                    make_thumbnails,
+                    str(tmp_path.resolve()),
+                    {size: str(path.resolve()) for size, path in targets.items()}
+                )
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid image file: {e}"
+                )
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return digest
+
+async def ensure_stored(digest: str, file: BinaryIO):
+    """Call after the commit that references digest: store the upload again if its files were deleted meanwhile"""
+    if not await run_in_threadpool(_is_stored, digest):
+        await run_in_threadpool(file.seek, 0)
+        await store_avatar(file)
+
+def _is_recent(path: Path, cutoff: float) -> bool:
+    try:
+        return path.stat().st_mtime > cutoff
+    except FileNotFoundError:
+        return False
+
+def release(url: Optional[str]):
+    """Delete a superseded avatar's files if no user references the URL any more. Blocking."""
+    files = _files_for_url(url)
+    if not files:
+        return
+    db = SessionLocal()
+    try:
+        in_use = db.scalar(select(models.User.id).where(models.User.avatar_url == url).limit(1))
+    finally:
+        db.close()
+    if in_use is None:
+        # File vừa được ghi/claim có thể thuộc về upload cùng nội dung chưa commit
+        cutoff = time.time() - AVATAR_GC_GRACE
+        for path in files:
+            if not _is_recent(path, cutoff):
+                path.unlink(missing_ok=True)
+
+def collect_garbage(grace: float = AVATAR_GC_GRACE) -> int:
+    """Delete files under AVATAR_DIR that no user references and that are older than grace seconds"""
+    db = SessionLocal()
+    try:
+        urls = db.scalars(select(models.User.avatar_url).where(models.User.avatar_url.isnot(None)).distinct()).all()
+    finally:
+        db.close()
+    referenced = {path for url in urls for path in _files_for_url(url)}
+    cutoff = time.time() - grace
+    removed = 0
+    for path in AVATAR_DIR.rglob("*"):
+        try:
+            if not path.is_file() or path in referenced or path.stat().st_mtime > cutoff:
+                continue
+            path.unlink()
+            removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,82 @@
+"""
+Streaming flashcard export
+
+Cards are read with a server-side cursor (stream + yield_per) and encoded
+batch by batch, so exporting a very large set runs in constant memory. The
+generator opens its own AsyncSession because the request's session is
+closed before a StreamingResponse body is sent.
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator
+from sqlalchemy import and_, select
+from app import models
+from app.database import AsyncSessionLocal
+
+# Số dòng lấy từ cursor mỗi lần
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+CARD_COLUMNS = ("id", "front", "back", "created_at")
+PROGRESS_COLUMNS = (
+    "ease_factor", "interval", "repetitions", "next_review_date", "last_reviewed",
+    "total_reviews", "correct_count", "incorrect_count"
+)
+
+def _export_query(set_id: int, user_id: int, include_progress: bool):
+    columns = [getattr(models.Flashcard, name) for name in CARD_COLUMNS]
+    query = select(*columns)
+    if include_progress:
+        record = models.StudyRecord
+        query = select(*columns, *[getattr(record, name) for name in PROGRESS_COLUMNS]).outerjoin(
+            record,
+            and_(record.flashcard_id == models.Flashcard.id, record.user_id == user_id)
+        )
+    return query.where(models.Flashcard.set_id == set_id).order_by(models.Flashcard.id)
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+async def stream_export(set_id: int, user_id: int, file_format: str, include_progress: bool = False) -> AsyncIterator[bytes]:
+    """Yield the encoded export of one set, one cursor batch at a time"""
+    columns = CARD_COLUMNS + (PROGRESS_COLUMNS if include_progress else ())
+    query = _export_query(set_id, user_id, include_progress).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    first = True
+
+    if file_format == "csv":
+        writer.writerow(columns)
+    elif file_format == "json":
+        buffer.write("[")
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            for row in rows:
+                values = [_plain(value) for value in row]
+                if file_format == "csv":
+                    writer.writerow(values)
+                    continue
+                line = json.dumps(dict(zip(columns, values)), ensure_ascii=False)
+                if file_format == "ndjson":
+                    buffer.write(line + "\n")
+                else:
+                    buffer.write(line if first else "," + line)
+                    first = False
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if file_format == "json":
+        buffer.write("]")
+    if buffer.tell():
+        yield buffer.getvalue().encode()
@@ -0,0 +1,236 @@
+"""
+Streaming flashcard import
+
+The uploaded file is parsed incrementally (CSV rows via csv.DictReader over
+a TextIOWrapper, JSON arrays one element at a time with raw_decode) and the
+cards are written with one executemany INSERT per chunk, so memory stays
+bounded by the chunk size instead of the file size. stream_import() yields
+NDJSON progress/error events for a StreamingResponse.
+"""
+import codecs
+import csv
+import io
+import json
+import os
+from typing import BinaryIO, Iterator, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app import models, progress_summary, etags, dedup
+from app.database import SessionLocal
+
+# Số thẻ ghi trong một lần INSERT executemany
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+# Kích thước mỗi lần đọc file upload
+READ_SIZE = 64 * 1024
+
+# Chỉ báo chi tiết tối đa chừng này dòng lỗi, phần còn lại chỉ đếm
+MAX_REPORTED_ERRORS = 100
+
+# Tương tự cho các thẻ trùng
+MAX_REPORTED_DUPLICATES = 100
+
+# Một phần tử JSON lớn hơn mức này được coi là lỗi (tránh đọc cả file vào buffer)
+MAX_JSON_ELEMENT_SIZE = 1024 * 1024
+
+FRONT_KEYS = ("front", "Front", "question", "Question")
+BACK_KEYS = ("back", "Back", "answer", "Answer")
+
+class ImportFormatError(ValueError):
+    """The file itself is malformed; no further rows can be read"""
+
+def detect_format(file: BinaryIO, filename: Optional[str] = None) -> str:
+    """'json' if the file is a JSON array, otherwise 'csv'"""
+    if filename:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in (".json", ".csv"):
+            return extension[1:]
+    head = file.read(READ_SIZE)
+    file.seek(0)
+    return "json" if head.lstrip(codecs.BOM_UTF8).lstrip().startswith(b"[") else "csv"
+
+def iter_csv_rows(file: BinaryIO) -> Iterator[Tuple[int, dict]]:
+    """Yield (row number, row dict) from a CSV file with a header line"""
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        for row_number, row in enumerate(csv.DictReader(text), start=1):
+            yield row_number, row
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ImportFormatError(str(e))
+    finally:
+        # Không để TextIOWrapper đóng file upload gốc
+        text.detach()
+
+def iter_json_rows(file: BinaryIO) -> Iterator[Tuple[int, object]]:
+    """Yield (row number, element) from a top-level JSON array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    reader = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        chunk = file.read(READ_SIZE)
+        eof = not chunk
+        try:
+            buffer = buffer[pos:] + reader.decode(chunk, final=eof)
+        except UnicodeDecodeError as e:
+            raise ImportFormatError(str(e))
+        pos = 0
+        return bool(chunk)
+
+    def skip_whitespace() -> bool:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer):
+                return True
+            if not fill():
+                return False
+
+    if not skip_whitespace() or buffer[pos] != "[":
+        raise ImportFormatError("Expected a JSON array")
+    pos += 1
+    row_number = 0
+    expect_value = True
+    while True:
+        if not skip_whitespace():
+            raise ImportFormatError("Unexpected end of JSON array")
+        char = buffer[pos]
+        if char == "]":
+            return
+        if char == ",":
+            if expect_value:
+                raise ImportFormatError(f"Unexpected ',' after element {row_number}")
+            pos += 1
+            expect_value = True
+            continue
+        if not expect_value:
+            raise ImportFormatError(f"Expected ',' after element {row_number}")
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # Phần tử có thể bị cắt ngang ở cuối buffer: đọc thêm rồi thử lại
+                if len(buffer) - pos <= MAX_JSON_ELEMENT_SIZE and fill():
+                    continue
+                raise ImportFormatError(f"Invalid JSON at element {row_number + 1}: {e.msg}")
+            # Một số ở cuối buffer có thể còn chữ số chưa đọc
+            if end == len(buffer) and not eof and fill():
+                continue
+            break
+        pos = end
+        row_number += 1
+        expect_value = False
+        yield row_number, value
+
+def card_from_row(row) -> Tuple[str, str]:
+    """(front, back) of one imported row, ValueError if it is not a usable card"""
+    if not isinstance(row, dict):
+        raise ValueError("Row is not an object")
+    front = next((row[key] for key in FRONT_KEYS if row.get(key)), None)
+    back = next((row[key] for key in BACK_KEYS if row.get(key)), None)
+    if not isinstance(front, str) or not isinstance(back, str) or not front.strip() or not back.strip():
+        raise ValueError("Missing front or back")
+    return front, back
+
+def insert_cards(db: Session, set_id: int, cards: list, duplicates: str = "allow") -> Tuple[int, list]:
+    """Insert (front, back) pairs with one executemany INSERT; returns (inserted, [(index, match)]).
+
+    duplicates="skip" leaves out cards that duplicate the set or an earlier card of
+    the batch, "flag" inserts them anyway, "allow" skips the check (see app/dedup.py).
+    """
+    if not cards:
+        return 0, []
+    if duplicates == "allow":
+        matches = [None] * len(cards)
+        hashes, sigs = dedup.signatures(cards)
+    else:
+        matches, hashes, sigs = dedup.check(db, set_id, cards)
+    found = [(i, match) for i, match in enumerate(matches) if match is not None]
+    keep = [i for i, match in enumerate(matches) if match is None or duplicates != "skip"]
+    if not keep:
+        return 0, found
+    card_ids = db.execute(
+        insert(models.Flashcard).returning(models.Flashcard.id, sort_by_parameter_order=True),
+        [{"set_id": set_id, "front": cards[i][0], "back": cards[i][1]} for i in keep]
+    ).scalars().all()
+    dedup.store(db, set_id, card_ids, [hashes[i] for i in keep], sigs[keep])
+    progress_summary.on_cards_created(db, set_id, len(keep))
+    db.execute(etags.bump_set_version(set_id))
+    return len(keep), found
+
+def _event(event: str, **fields) -> bytes:
+    return (json.dumps({"event": event, **fields}) + "\n").encode()
+
+def stream_import(
+    set_id: int,
+    file: BinaryIO,
+    file_format: str,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    duplicates: str = "skip"
+) -> Iterator[bytes]:
+    """Import the file chunk by chunk, yielding NDJSON events.
+
+    Mỗi chunk được commit riêng nên nếu file hỏng giữa chừng thì các thẻ đã
+    báo trong event "progress" vẫn được giữ lại. Thẻ trùng với các chunk trước
+    cũng được phát hiện vì signature của chúng đã được lưu cùng chunk.
+    """
+    rows = iter_json_rows(file) if file_format == "json" else iter_csv_rows(file)
+    db = SessionLocal()
+    counts = {"imported": 0, "errors": 0, "duplicates": 0}
+    row_number = 0
+    chunk = []
+    chunk_rows = []
+
+    def flush() -> Iterator[bytes]:
+        inserted, found = insert_cards(db, set_id, chunk, duplicates)
+        db.commit()
+        counts["imported"] += inserted
+        for index, match in found:
+            counts["duplicates"] += 1
+            if counts["duplicates"] <= MAX_REPORTED_DUPLICATES:
+                batch_index = match.pop("batch_index")
+                yield _event(
+                    "duplicate",
+                    row=chunk_rows[index],
+                    skipped=duplicates == "skip",
+                    duplicate_of_row=chunk_rows[batch_index] if batch_index is not None else None,
+                    **match
+                )
+        chunk.clear()
+        chunk_rows.clear()
+
+    try:
+        try:
+            for row_number, row in rows:
+                try:
+                    chunk.append(card_from_row(row))
+                    chunk_rows.append(row_number)
+                except ValueError as e:
+                    counts["errors"] += 1
+                    if counts["errors"] <= MAX_REPORTED_ERRORS:
+                        yield _event("error", row=row_number, error=str(e))
+                if len(chunk) >= chunk_size:
+                    yield from flush()
+                    yield _event("progress", rows=row_number, **counts)
+        except ImportFormatError as e:
+            yield from flush()
+            yield _event("failed", error=str(e), rows=row_number, **counts)
+            return
+        yield from flush()
+        yield _event(
+            "done",
+            message=f"Successfully imported {counts['imported']} flashcards",
+            rows=row_number,
+            **counts
+        )
+    except Exception as e:
+        db.rollback()
+        yield _event("failed", error=str(e), rows=row_number, **counts)
+    finally:
+        db.close()
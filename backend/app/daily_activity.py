@@ -0,0 +1,66 @@
+"""
+Daily study activity rollup
+
+GET /api/study/sessions/history and /activity read the daily_activity
+table with one primary-key range scan instead of grouping a user's raw
+study_sessions by date. complete_study_session() keeps it current by
+adding the session's deltas to the row for the day the session started.
+"""
+from datetime import date, datetime, timezone
+from typing import Optional
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from app import models
+
+def activity_day(started_at: Optional[datetime]) -> date:
+    """UTC calendar day a session is counted on"""
+    if started_at is None:
+        return datetime.now(timezone.utc).date()
+    if started_at.tzinfo is not None:
+        started_at = started_at.astimezone(timezone.utc)
+    return started_at.date()
+
+def _upsert(db: Session, table):
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(table)
+
+def on_session_completed(
+    db: Session,
+    user_id: int,
+    day: date,
+    cards_studied_delta: int,
+    cards_correct_delta: int,
+    sessions_delta: int
+):
+    """Add a completed session to its day's row (a re-completion passes the differences only)"""
+    table = models.DailyActivity.__table__
+    stmt = _upsert(db, table).values(
+        user_id=user_id,
+        day=day,
+        cards_studied=cards_studied_delta,
+        cards_correct=cards_correct_delta,
+        sessions_count=sessions_delta
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day],
+        set_={
+            "cards_studied": table.c.cards_studied + stmt.excluded.cards_studied,
+            "cards_correct": table.c.cards_correct + stmt.excluded.cards_correct,
+            "sessions_count": table.c.sessions_count + stmt.excluded.sessions_count,
+        }
+    ))
+
+def get_range(db: Session, user_id: int, start_date: date, end_date: date) -> list:
+    """Rollup rows of one user between two days (inclusive), ordered by day"""
+    activity = models.DailyActivity
+    return db.execute(
+        select(activity.day, activity.cards_studied, activity.cards_correct, activity.sessions_count)
+        .where(activity.user_id == user_id, activity.day >= start_date, activity.day <= end_date)
+        .order_by(activity.day)
+    ).all()
+
+def on_user_deleted(db: Session, user_id: int):
+    db.execute(delete(models.DailyActivity).where(models.DailyActivity.user_id == user_id))
@@ -0,0 +1,321 @@
+"""
+Near-duplicate detection for imported and AI-generated cards
+
+Each card's front/back is normalized (Unicode NFKD without accents,
+casefolded, punctuation collapsed) and cut into 4-byte shingles. A MinHash
+signature of NUM_PERM hashes estimates the Jaccard similarity of two cards;
+the signature is split into BANDS bands whose hashes are the LSH buckets,
+so a new card is only compared with the cards sharing at least one bucket.
+Exact duplicates are found by a hash of the normalized text.
+
+Signatures and buckets are stored per set (card_signatures,
+card_signature_bands), so checking a batch against a 100k-card set reads a
+few index entries instead of the set's text. Cards without a signature
+(created before this table existed) are indexed lazily on the first check.
+"""
+import hashlib
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+from app import models
+from app.database import SessionLocal
+
+# 16 band x 8 hàng: cặp có Jaccard 0.8 thành ứng viên với xác suất ~95%, cặp 0.5 chỉ ~6%
+# (band ngắn hơn làm các thẻ cùng khuôn "What is the capital of X?" dồn vào vài bucket khổng lồ)
+NUM_PERM = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 4
+
+# Ngưỡng Jaccard (ước lượng từ signature) để coi là gần trùng
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+
+# skip: không thêm thẻ trùng, flag: vẫn thêm nhưng báo lại, allow: không kiểm tra
+DUPLICATE_MODES = ("skip", "flag", "allow")
+
+# Số shingle mỗi lần tính: ma trận NUM_PERM x shingle uint64 ~4MB vừa cache CPU
+# (lô lớn hơn chậm hơn rõ rệt)
+MAX_BATCH_SHINGLES = 4096
+
+# Bucket có nhiều thẻ hơn mức này là "stop bucket" (các thẻ cùng khuôn), không dùng để
+# sinh ứng viên; thẻ trùng hẳn vẫn bắt được qua content_hash
+MAX_BUCKET_SIZE = 256
+
+# Số thẻ mỗi lần đánh index lười và số tham số trong một mệnh đề IN
+INDEX_BATCH_SIZE = 5000
+IN_CHUNK_SIZE = 5000
+
+_MAX_INT64 = (1 << 63) - 1
+
+# Hệ số cố định: signature đã lưu phải tính ra giống nhau ở mọi process
+_rng = np.random.default_rng(0x5EED_D00D)
+_PERM_A = _rng.integers(1, 1 << 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 1 << 63, NUM_PERM, dtype=np.uint64)
+_BAND_MIX = _rng.integers(1, 1 << 63, ROWS_PER_BAND + 1, dtype=np.uint64) | np.uint64(1)
+
+_COMBINING_MARKS = re.compile(r"[\u0300-\u036f]+")
+_NON_WORD = re.compile(r"[\W_]+")
+# "đ" không tách dấu được bằng NFKD
+_EXTRA_LETTERS = str.maketrans({"đ": "d"})
+
+def normalize(text: str) -> str:
+    """Casefolded text without accents, punctuation or repeated whitespace"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold().translate(_EXTRA_LETTERS))
+    return _NON_WORD.sub(" ", _COMBINING_MARKS.sub("", decomposed)).strip()
+
+def card_text(front: str, back: str) -> str:
+    return f"{normalize(front)}\n{normalize(back)}"
+
+def content_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little") & _MAX_INT64
+
+def _minhash(encoded: List[bytes]) -> np.ndarray:
+    """(len(encoded), NUM_PERM) uint32 signatures, vectorized over all shingles of the batch"""
+    lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+    counts = lengths - SHINGLE_SIZE + 1
+    buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    # Mỗi cửa sổ 4 byte liên tiếp thành một số 32-bit
+    windows = buffer[:-3] << np.uint64(24) | buffer[1:-2] << np.uint64(16) | buffer[2:-1] << np.uint64(8) | buffer[3:]
+    # Bỏ các cửa sổ nằm vắt qua ranh giới giữa hai thẻ
+    card_starts = np.cumsum(lengths) - lengths
+    segment_starts = np.cumsum(counts) - counts
+    offsets = np.arange(counts.sum()) - np.repeat(segment_starts, counts)
+    shingles = windows[np.repeat(card_starts, counts) + offsets]
+    # Multiply-add-shift hashing; phép nhân uint64 tràn số theo modulo 2^64 là chủ đích
+    hashed = (_PERM_A[:, None] * shingles[None, :] + _PERM_B[:, None]) >> np.uint64(32)
+    return np.minimum.reduceat(hashed, segment_starts, axis=1).T.astype(np.uint32)
+
+def signatures(cards: Sequence[Tuple[str, str]]) -> Tuple[List[int], np.ndarray]:
+    """Content hashes and MinHash signatures of (front, back) pairs"""
+    texts = [card_text(front, back) for front, back in cards]
+    hashes = [content_hash(text) for text in texts]
+    # Thẻ ngắn hơn một shingle vẫn phải có ít nhất một shingle
+    encoded = [text.encode().ljust(SHINGLE_SIZE) for text in texts]
+    parts = []
+    batch: List[bytes] = []
+    batch_shingles = 0
+    for data in encoded:
+        batch.append(data)
+        batch_shingles += len(data) - SHINGLE_SIZE + 1
+        if batch_shingles >= MAX_BATCH_SHINGLES:
+            parts.append(_minhash(batch))
+            batch, batch_shingles = [], 0
+    if batch:
+        parts.append(_minhash(batch))
+    sigs = np.concatenate(parts) if parts else np.empty((0, NUM_PERM), dtype=np.uint32)
+    return hashes, sigs
+
+def band_buckets(sigs: np.ndarray) -> np.ndarray:
+    """(n, BANDS) int64 bucket ids; the band number is mixed in so buckets of different bands never collide"""
+    bands = sigs.reshape(len(sigs), BANDS, ROWS_PER_BAND).astype(np.uint64)
+    mixed = np.arange(BANDS, dtype=np.uint64)[None, :] * _BAND_MIX[0]
+    for row in range(ROWS_PER_BAND):
+        mixed = (mixed ^ bands[:, :, row]) * _BAND_MIX[row + 1]
+    mixed ^= mixed >> np.uint64(29)
+    return (mixed >> np.uint64(1)).astype(np.int64)
+
+def _chunks(values: list, size: int = IN_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def store(db: Session, set_id: int, card_ids: Sequence[int], hashes: Sequence[int], sigs: np.ndarray):
+    """Persist the signatures and LSH buckets of cards that were just inserted"""
+    if not len(card_ids):
+        return
+    db.execute(insert(models.CardSignature.__table__), [
+        {
+            "flashcard_id": card_id,
+            "set_id": set_id,
+            "content_hash": hashes[i],
+            "signature": sigs[i].astype("<u4").tobytes(),
+        }
+        for i, card_id in enumerate(card_ids)
+    ])
+    buckets = band_buckets(sigs)
+    # Ghi theo thứ tự khóa chính để B-tree không phải tách trang ngẫu nhiên
+    ids = np.repeat(np.asarray(card_ids, dtype=np.int64), BANDS)
+    order = np.lexsort((ids, buckets.ravel()))
+    db.execute(insert(models.CardSignatureBand.__table__), [
+        {"set_id": set_id, "bucket": bucket, "flashcard_id": card_id}
+        for bucket, card_id in zip(buckets.ravel()[order].tolist(), ids[order].tolist())
+    ])
+
+def ensure_indexed(db: Session, set_id: int) -> int:
+    """Compute signatures for the set's cards that have none yet (anti-join); returns how many"""
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(models.Flashcard.id, models.Flashcard.front, models.Flashcard.back)
+            .outerjoin(models.CardSignature, models.CardSignature.flashcard_id == models.Flashcard.id)
+            .where(
+                models.Flashcard.set_id == set_id,
+                models.Flashcard.id > last_id,
+                models.CardSignature.flashcard_id.is_(None)
+            )
+            .order_by(models.Flashcard.id)
+            .limit(INDEX_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return indexed
+        hashes, sigs = signatures([(row.front, row.back) for row in rows])
+        store(db, set_id, [row.id for row in rows], hashes, sigs)
+        indexed += len(rows)
+        last_id = rows[-1].id
+
+def _match(kind: str, similarity: float, flashcard_id: Optional[int] = None, batch_index: Optional[int] = None) -> dict:
+    return {
+        "kind": kind,  # exact | near
+        "flashcard_id": flashcard_id,  # Existing card in the set
+        "batch_index": batch_index,  # Earlier card of the same batch
+        "similarity": round(similarity, 3),
+    }
+
+def check(
+    db: Session,
+    set_id: int,
+    cards: Sequence[Tuple[str, str]],
+    threshold: float = DEDUP_THRESHOLD
+) -> Tuple[List[Optional[dict]], List[int], np.ndarray]:
+    """Find duplicates of (front, back) pairs among the set's cards and earlier cards of the batch.
+
+    Returns (matches, hashes, sigs): matches[i] is None for a new card, otherwise
+    a dict from _match(). hashes/sigs can be passed to store() after inserting.
+    Within the batch a duplicate always points at a card that is not itself one.
+    """
+    hashes, sigs = signatures(cards)
+    if not cards:
+        return [], hashes, sigs
+    buckets = band_buckets(sigs)
+    ensure_indexed(db, set_id)
+
+    existing_exact: Dict[int, int] = {}
+    for chunk in _chunks(sorted(set(hashes))):
+        for row in db.execute(
+            select(models.CardSignature.content_hash, models.CardSignature.flashcard_id)
+            .where(models.CardSignature.set_id == set_id, models.CardSignature.content_hash.in_(chunk))
+            .order_by(models.CardSignature.flashcard_id)
+        ):
+            existing_exact.setdefault(row.content_hash, row.flashcard_id)
+
+    bands = models.CardSignatureBand
+    bucket_ids: Dict[int, List[int]] = defaultdict(list)
+    for chunk in _chunks(sorted(set(buckets.ravel().tolist()))):
+        stop_buckets = (
+            select(bands.bucket)
+            .where(bands.set_id == set_id, bands.bucket.in_(chunk))
+            .group_by(bands.bucket)
+            .having(func.count() > MAX_BUCKET_SIZE)
+        )
+        for row in db.execute(
+            select(bands.bucket, bands.flashcard_id)
+            .where(bands.set_id == set_id, bands.bucket.in_(chunk), bands.bucket.not_in(stop_buckets))
+        ):
+            bucket_ids[row.bucket].append(row.flashcard_id)
+
+    # Signature của mọi ứng viên gom vào một ma trận; bucket trỏ tới chỉ số dòng
+    candidate_ids = sorted({card_id for ids in bucket_ids.values() for card_id in ids})
+    existing_sigs = np.zeros((len(candidate_ids), NUM_PERM), dtype=np.uint32)
+    position = {card_id: i for i, card_id in enumerate(candidate_ids)}
+    for chunk in _chunks(candidate_ids):
+        for row in db.execute(
+            select(models.CardSignature.flashcard_id, models.CardSignature.signature)
+            .where(models.CardSignature.flashcard_id.in_(chunk))
+        ):
+            existing_sigs[position[row.flashcard_id]] = np.frombuffer(row.signature, dtype="<u4")
+    bucket_rows = {
+        bucket: np.array([position[card_id] for card_id in ids], dtype=np.int64)
+        for bucket, ids in bucket_ids.items()
+    }
+    no_rows = np.empty(0, dtype=np.int64)
+
+    matches: List[Optional[dict]] = []
+    batch_exact: Dict[int, int] = {}
+    batch_buckets: Dict[int, List[int]] = defaultdict(list)
+    for i, card_buckets in enumerate(buckets.tolist()):
+        if hashes[i] in existing_exact:
+            matches.append(_match("exact", 1.0, flashcard_id=existing_exact[hashes[i]]))
+            continue
+        if hashes[i] in batch_exact:
+            matches.append(_match("exact", 1.0, batch_index=batch_exact[hashes[i]]))
+            continue
+
+        best = None
+        candidates = np.unique(np.concatenate([bucket_rows.get(bucket, no_rows) for bucket in card_buckets]))
+        if len(candidates):
+            similarity = (existing_sigs[candidates] == sigs[i]).mean(axis=1)
+            top = int(similarity.argmax())
+            if similarity[top] >= threshold:
+                best = _match("near", float(similarity[top]), flashcard_id=candidate_ids[candidates[top]])
+        batch_candidates = sorted({
+            j for bucket in card_buckets
+            if len(batch_buckets.get(bucket, ())) <= MAX_BUCKET_SIZE
+            for j in batch_buckets.get(bucket, ())
+        })
+        if batch_candidates:
+            similarity = (sigs[batch_candidates] == sigs[i]).mean(axis=1)
+            top = int(similarity.argmax())
+            if similarity[top] >= threshold and (best is None or similarity[top] > best["similarity"]):
+                best = _match("near", float(similarity[top]), batch_index=batch_candidates[top])
+        matches.append(best)
+        if best is None:
+            batch_exact[hashes[i]] = i
+            for bucket in card_buckets:
+                batch_buckets[bucket].append(i)
+    return matches, hashes, sigs
+
+def annotate_cards(set_id: int, cards: list, threshold: float = DEDUP_THRESHOLD) -> list:
+    """Copy of AI-generated cards with a "duplicate" key (None or a match) against the set"""
+    valid = [
+        i for i, card in enumerate(cards)
+        if isinstance(card, dict) and isinstance(card.get("front"), str) and isinstance(card.get("back"), str)
+    ]
+    db = SessionLocal()
+    try:
+        matches, _, _ = check(db, set_id, [(cards[i]["front"], cards[i]["back"]) for i in valid], threshold)
+        # Lưu các signature vừa đánh index lười
+        db.commit()
+    finally:
+        db.close()
+    annotated = [dict(card) if isinstance(card, dict) else card for card in cards]
+    for i, match in zip(valid, matches):
+        if match is not None and match["batch_index"] is not None:
+            match["batch_index"] = valid[match["batch_index"]]
+        annotated[i]["duplicate"] = match
+    return annotated
+
+def on_card_saved(db: Session, card_id: int, set_id: int, front: str, back: str):
+    """Replace the signature of a card that was created or edited"""
+    on_card_deleted(db, card_id)
+    hashes, sigs = signatures([(front, back)])
+    store(db, set_id, [card_id], hashes, sigs)
+
+def on_card_deleted(db: Session, card_id: int):
+    row = db.execute(
+        select(models.CardSignature.set_id, models.CardSignature.signature)
+        .where(models.CardSignature.flashcard_id == card_id)
+    ).first()
+    if row is None:
+        return
+    # Tính lại bucket từ signature đã lưu để xóa theo khóa chính (set_id, bucket, flashcard_id)
+    buckets = band_buckets(np.frombuffer(row.signature, dtype="<u4")[None, :])[0].tolist()
+    db.execute(delete(models.CardSignatureBand).where(
+        models.CardSignatureBand.set_id == row.set_id,
+        models.CardSignatureBand.bucket.in_(buckets),
+        models.CardSignatureBand.flashcard_id == card_id
+    ))
+    db.execute(delete(models.CardSignature).where(models.CardSignature.flashcard_id == card_id))
+
+def on_set_deleted(db: Session, set_id: int):
+    db.execute(delete(models.CardSignatureBand).where(models.CardSignatureBand.set_id == set_id))
+    db.execute(delete(models.CardSignature).where(models.CardSignature.set_id == set_id))
+
+def on_user_deleted(db: Session, user_id: int):
+    owned = select(models.FlashcardSet.id).where(models.FlashcardSet.owner_id == user_id)
+    db.execute(delete(models.CardSignatureBand).where(models.CardSignatureBand.set_id.in_(owned)))
+    db.execute(delete(models.CardSignature).where(models.CardSignature.set_id.in_(owned)))
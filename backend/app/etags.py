@@ -0,0 +1,44 @@
+"""
+ETags for flashcard sets
+
+Every set carries a version counter that is bumped by each mutation of the
+set or its cards (bump_set_version). The ETag of a set representation is
+derived from (set id, version), so a conditional GET can answer 304 after
+reading just the version and the ACL columns, without loading any cards.
+"""
+from typing import Optional
+from sqlalchemy import update
+from app import models
+
+# Client phải xác thực lại mỗi lần dùng (nội dung phụ thuộc quyền truy cập)
+CACHE_CONTROL = "private, no-cache"
+
+def set_etag(set_id: int, version: int, representation: str) -> str:
+    """Strong ETag of one representation ("set", "cards", ...) of a set version"""
+    return f'"set-{set_id}-v{version}-{representation}"'
+
+def if_none_match(header: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header matches the ETag (weak comparison, RFC 9110)"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def bump_set_version(set_id: int):
+    """UPDATE statement incrementing a set's version (run it in the mutating transaction)"""
+    return update(models.FlashcardSet).where(models.FlashcardSet.id == set_id).values(
+        version=models.FlashcardSet.version + 1
+    )
+
+def bump_owner_set_versions(owner_id: int):
+    """Sets embed the owner's username, so renaming a user changes all of their sets"""
+    return update(models.FlashcardSet).where(models.FlashcardSet.owner_id == owner_id).values(
+        version=models.FlashcardSet.version + 1
+    )
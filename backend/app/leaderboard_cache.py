@@ -0,0 +1,79 @@
+"""
+Top-N leaderboard cache
+
+Caches the serialized JSON body of GET /api/leaderboard/ per limit, so
+hot requests skip the database, the ORM and Pydantic entirely. Entries
+are invalidated when points change (session completion) and never served
+older than LEADERBOARD_CACHE_MAX_AGE seconds.
+"""
+import json
+import os
+import threading
+import time
+from sqlalchemy import desc, select
+from app.database import AsyncSessionLocal
+from app import models
+
+LEADERBOARD_CACHE_MAX_AGE = float(os.getenv("LEADERBOARD_CACHE_MAX_AGE", "30"))
+# Chỉ cache các limit nhỏ để số key trong cache có giới hạn
+MAX_CACHED_LIMIT = 100
+
+def load_top_entries(db, limit: int) -> list[dict]:
+    """Top users by points, selecting only the columns the response needs"""
+    rows = db.execute(
+        select(
+            models.User.username,
+            models.Leaderboard.points,
+            models.Leaderboard.total_study_time,
+            models.Leaderboard.total_cards_studied,
+            models.Leaderboard.streak_days
+        ).join(
+            models.User, models.User.id == models.Leaderboard.user_id
+        ).order_by(
+            desc(models.Leaderboard.points)
+        ).limit(limit)
+    ).all()
+    return [
+        {
+            "username": row.username,
+            "points": row.points or 0,
+            "total_study_time": row.total_study_time or 0,
+            "total_cards_studied": row.total_cards_studied or 0,
+            "streak_days": row.streak_days or 0
+        }
+        for row in rows
+    ]
+
+class LeaderboardCache:
+    def __init__(self, max_age: float = LEADERBOARD_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries: dict[int, tuple[bytes, float]] = {}
+        self._generation = 0
+
+    async def get(self, limit: int) -> bytes:
+        """Serialized top-`limit` leaderboard, from cache when fresh"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(limit)
+            generation = self._generation
+        if entry is not None and now - entry[1] < self.max_age:
+            return entry[0]
+
+        async with AsyncSessionLocal() as db:
+            entries = await db.run_sync(load_top_entries, limit)
+        payload = json.dumps(entries).encode("utf-8")
+
+        if limit <= MAX_CACHED_LIMIT:
+            with self._lock:
+                # Bỏ qua nếu cache đã bị invalidate trong lúc đang query
+                if generation == self._generation:
+                    self._entries[limit] = (payload, now)
+        return payload
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+leaderboard_cache = LeaderboardCache()
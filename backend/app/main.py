@@ -1,21 +1,95 @@
-from fastapi import FastAPI
+import asyncio
+import os
+import secrets
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from app.database import engine, Base
+from app.database import engine, async_engine, Base, SessionLocal
+from app.rank_index import rank_index, RANK_INDEX_REFRESH_INTERVAL
+from app.auth import password_pool
+from app.ai_generation import generation_queue
+from app.search import ensure_search_index
+from app.static_files import CachedStaticFiles
+from app import progress_summary, avatars, metrics, query_budget
 from app.routers import auth, flashcards, study, leaderboard, ai, admin
-from pathlib import Path
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+# Full-text search index (FTS5 trên SQLite, tsvector + GIN trên PostgreSQL)
+ensure_search_index(engine)
+
+# Đếm truy vấn / thời gian DB / chờ pool cho /api/metrics
+metrics.instrument_engine(engine, "sync")
+metrics.instrument_engine(async_engine.sync_engine, "async")
+
+# Bearer token bảo vệ /api/metrics (để trống: không yêu cầu)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
 # Create uploads directory if it doesn't exist
-uploads_dir = Path("uploads/avatars")
-uploads_dir.mkdir(parents=True, exist_ok=True)
+avatars.AVATAR_DIR.mkdir(parents=True, exist_ok=True)
+
+# Chu kỳ (giây) đối soát lại bảng study_progress với dữ liệu gốc
+PROGRESS_RECONCILE_INTERVAL = float(os.getenv("PROGRESS_RECONCILE_INTERVAL", "3600"))
+
+async def reconcile_progress_periodically():
+    while True:
+        await asyncio.sleep(PROGRESS_RECONCILE_INTERVAL)
+        try:
+            fixed = await run_in_threadpool(progress_summary.run_reconcile)
+            if fixed:
+                print(f"Progress reconcile: corrected {fixed} study_progress rows")
+        except Exception as e:
+            print(f"Progress reconcile failed: {e}")
+
+async def collect_avatar_garbage_periodically():
+    while True:
+        await asyncio.sleep(avatars.AVATAR_GC_INTERVAL)
+        try:
+            removed = await run_in_threadpool(avatars.collect_garbage)
+            if removed:
+                print(f"Avatar GC: removed {removed} unreferenced files")
+        except Exception as e:
+            print(f"Avatar GC failed: {e}")
+
+def rebuild_rank_index():
+    db = SessionLocal()
+    try:
+        rank_index.rebuild(db)
+    finally:
+        db.close()
+
+async def refresh_rank_index_periodically():
+    # Mỗi worker có index riêng: nạp lại để thấy điểm do worker khác cập nhật
+    while True:
+        await asyncio.sleep(RANK_INDEX_REFRESH_INTERVAL)
+        try:
+            await run_in_threadpool(rebuild_rank_index)
+        except Exception as e:
+            print(f"Rank index refresh failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the in-process leaderboard rank index from the database
+    rebuild_rank_index()
+    rank_index_task = asyncio.create_task(refresh_rank_index_periodically())
+    reconcile_task = asyncio.create_task(reconcile_progress_periodically())
+    avatar_gc_task = asyncio.create_task(collect_avatar_garbage_periodically())
+    generation_queue.start()
+    yield
+    rank_index_task.cancel()
+    reconcile_task.cancel()
+    avatar_gc_task.cancel()
+    await generation_queue.stop()
+    password_pool.shutdown()
+    avatars.avatar_pool.shutdown()
 
 app = FastAPI(
     title="Flashcard Study App API",
     description="API for flashcard study application with spaced repetition",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -35,8 +109,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Dev/test: kiểm tra số truy vấn mỗi request theo @query_budget (QUERY_BUDGET_MODE=log|raise)
+if query_budget.QUERY_BUDGET_MODE != "off":
+    app.add_middleware(query_budget.QueryBudgetMiddleware)
+
+# Added last = outermost: latency includes every other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(flashcards.router, prefix="/api/flashcards", tags=["Flashcards"])
@@ -45,8 +127,8 @@ app.include_router(leaderboard.router, prefix="/api/leaderboard", tags=["Leaderb
 app.include_router(ai.router, prefix="/api/ai", tags=["AI"])
 app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
 
-# Mount static files for avatar uploads
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Mount static files for avatar uploads (content-hashed names are cached as immutable)
+app.mount("/uploads", CachedStaticFiles(directory="uploads"), name="uploads")
 
 @app.get("/")
 async def root():
@@ -56,3 +138,11 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+
+@app.get("/api/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    if METRICS_TOKEN and not secrets.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {METRICS_TOKEN}".encode()
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
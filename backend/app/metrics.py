@@ -0,0 +1,296 @@
+"""
+Prometheus metrics
+
+MetricsMiddleware (pure ASGI, no per-request allocations beyond a small
+stats object) records request latency per route template, in-flight
+requests and status codes. SQLAlchemy event listeners on both engines count
+queries and DB time, globally and for the request that issued them (a
+contextvar carries the request's stats into the threadpool and into the
+async driver's greenlet). Pool gauges are read at scrape time. The time a
+Session waits for its connection is measured with public events only: the
+session stamps the start of each execute/flush (do_orm_execute,
+before_flush) and after_begin, which fires once the connection has been
+checked out, observes the difference.
+
+render() produces the text exposition format served at /api/metrics.
+"""
+import bisect
+import collections
+import contextvars
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _labels(self.label_names, labels), value
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, labels: Tuple, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [count per bucket (+Inf cuối), sum]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, labels: Tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(self.label_names, labels, f'le="{_number(float(bound))}"'), cumulative
+            yield f"{self.name}_sum", _labels(self.label_names, labels), total
+            yield f"{self.name}_count", _labels(self.label_names, labels), cumulative
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests by route template and status code", ("method", "route", "status")
+)
+http_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency (until the response body is sent)", ("method", "route")
+)
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being handled")
+http_db_queries = Histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+http_db_duration = Histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per HTTP request", ("method", "route")
+)
+db_queries = Counter("db_queries_total", "SQL statements executed", ("engine",))
+db_duration = Counter("db_query_seconds_total", "Time spent executing SQL statements", ("engine",))
+db_pool_wait = Histogram(
+    "db_pool_wait_seconds", "Time a session waited for a pooled connection", ("engine",), POOL_WAIT_BUCKETS
+)
+db_pool_checked_out = Gauge("db_pool_checked_out", "Connections currently checked out", ("engine",))
+db_pool_overflow = Gauge("db_pool_overflow", "Connections open beyond pool_size", ("engine",))
+db_pool_size = Gauge("db_pool_size", "Configured pool size", ("engine",))
+cache_stat = Gauge("app_cache_stat", "In-process cache and queue statistics", ("cache", "stat"))
+
+REGISTRY = [
+    http_requests, http_duration, http_in_flight, http_db_queries, http_db_duration,
+    db_queries, db_duration, db_pool_wait, db_pool_checked_out, db_pool_overflow, db_pool_size,
+    cache_stat,
+]
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # SQL -> số lần chạy; chỉ ghi khi có người cần (app/query_budget.py)
+        self.statements: Optional[collections.Counter] = None
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+def current_request_stats() -> Optional[RequestStats]:
+    """Stats of the request being handled in this context (None outside a request)"""
+    return _request_stats.get()
+
+# ----- SQLAlchemy -----
+
+_instrumented: Dict[str, Engine] = {}
+_engine_labels: Dict[Engine, Tuple[str]] = {}
+
+def instrument_engine(engine: Engine, name: str):
+    """Attach query/pool listeners to a (sync) Engine; for an AsyncEngine pass .sync_engine"""
+    if name in _instrumented:
+        return
+    _instrumented[name] = engine
+    labels = (name,)
+    _engine_labels[engine] = labels
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        db_queries.inc(labels)
+        db_duration.inc(labels, elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+            if stats.statements is not None:
+                stats.statements[statement] += 1
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # Câu lệnh lỗi không có after_cursor_execute: bỏ mốc thời gian của nó
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("metrics_start"):
+            conn.info["metrics_start"].pop()
+
+
+# Session lấy connection lười, ngay trong execute/flush đầu tiên của transaction:
+# mốc được ghi đè trước mỗi execute/flush và after_begin chỉ chạy khi vừa lấy connection
+_CHECKOUT_START = "metrics_checkout_start"
+
+@event.listens_for(Session, "do_orm_execute")
+def _stamp_execute(orm_execute_state):
+    orm_execute_state.session.info[_CHECKOUT_START] = time.perf_counter()
+
+@event.listens_for(Session, "before_flush")
+def _stamp_flush(session, flush_context, instances):
+    session.info[_CHECKOUT_START] = time.perf_counter()
+
+@event.listens_for(Session, "after_begin")
+def _observe_checkout(session, transaction, connection):
+    start = session.info.pop(_CHECKOUT_START, None)
+    labels = _engine_labels.get(connection.engine)
+    if start is not None and labels is not None:
+        db_pool_wait.observe(labels, time.perf_counter() - start)
+
+def _collect_pools():
+    for name, engine in _instrumented.items():
+        pool = engine.pool
+        labels = (name,)
+        if hasattr(pool, "checkedout"):
+            db_pool_checked_out.set(labels, pool.checkedout())
+        if hasattr(pool, "overflow"):
+            db_pool_overflow.set(labels, max(pool.overflow(), 0))
+        if hasattr(pool, "size"):
+            db_pool_size.set(labels, pool.size())
+
+def _collect_caches():
+    from app.user_cache import user_cache
+    from app.ai_cache import ai_cache
+    from app.ai_generation import generation_queue
+    for cache, stats in (
+        ("user_cache", user_cache.stats()),
+        ("ai_cache", ai_cache.stats()),
+        ("generation_queue", generation_queue.stats()),
+    ):
+        for stat, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                cache_stat.set((cache, stat), value)
+
+def render() -> str:
+    _collect_pools()
+    _collect_caches()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+# ----- ASGI -----
+
+def route_template(scope) -> str:
+    """Matched route template with its router prefix, e.g. /api/study/sets/{set_id}/due"""
+    # Không dùng path thật làm label (id trong URL làm số series tăng vô hạn)
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    regex = getattr(route, "path_regex", None)
+    if not template or regex is None:
+        # Mount (static files): Starlette chỉ ghi lại root_path của mount
+        if "app_root_path" in scope:
+            return scope.get("root_path", "")[len(scope["app_root_path"]):] or "unmatched"
+        return "unmatched"
+    # Tùy phiên bản FastAPI, route.path có hoặc không kèm prefix của include_router:
+    # phần đầu của path thật mà route không khớp chính là prefix đó
+    path = scope.get("path", "")
+    start = 0
+    while start != -1 and not regex.match(path[start:]):
+        start = path.find("/", start + 1)
+    return path[:start] + template if start > 0 else template
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_flight.inc(amount=-1)
+            _request_stats.reset(token)
+            labels = (scope["method"], route_template(scope))
+            http_requests.inc(labels + (status_code,))
+            http_duration.observe(labels, elapsed)
+            http_db_queries.observe(labels, stats.queries)
+            http_db_duration.observe(labels, stats.db_seconds)
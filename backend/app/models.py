@@ -1,10 +1,13 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Date, ForeignKey, Float, Text, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_created", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True, nullable=False)
@@ -14,6 +17,7 @@ class User(Base):
     is_admin = Column(Boolean, default=False)  # Admin flag
     avatar_url = Column(String, nullable=True)  # URL to avatar image
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_active_at = Column(DateTime(timezone=True), nullable=True)  # Set when a study session starts or completes
     
     # Relationships
     flashcard_sets = relationship("FlashcardSet", back_populates="owner", cascade="all, delete-orphan")
@@ -22,14 +26,21 @@ class User(Base):
 
 class FlashcardSet(Base):
     __tablename__ = "flashcard_sets"
+    __table_args__ = (
+        # Keyset pagination, xem app/pagination.py
+        Index("ix_flashcard_sets_owner_created", "owner_id", "created_at", "id"),
+        Index("ix_flashcard_sets_public_created", "is_public", "created_at", "id"),
+        Index("ix_flashcard_sets_created", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     description = Column(Text)
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    is_public = Column(Boolean, default=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    is_public = Column(Boolean, default=False, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped on every set/card change, see app/etags.py
     
     # Relationships
     owner = relationship("User", back_populates="flashcard_sets")
@@ -39,7 +50,7 @@ class Flashcard(Base):
     __tablename__ = "flashcards"
     
     id = Column(Integer, primary_key=True, index=True)
-    set_id = Column(Integer, ForeignKey("flashcard_sets.id"), nullable=False)
+    set_id = Column(Integer, ForeignKey("flashcard_sets.id"), nullable=False, index=True)
     front = Column(Text, nullable=False)
     back = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -50,6 +61,11 @@ class Flashcard(Base):
 
 class StudyRecord(Base):
     __tablename__ = "study_records"
+    __table_args__ = (
+        # Mỗi user chỉ có một record cho mỗi flashcard (cần cho INSERT ... ON CONFLICT)
+        Index("uq_study_records_user_flashcard", "user_id", "flashcard_id", unique=True),
+        Index("ix_study_records_user_next_review", "user_id", "next_review_date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     flashcard_id = Column(Integer, ForeignKey("flashcards.id"), nullable=False)
@@ -73,6 +89,10 @@ class StudyRecord(Base):
 
 class StudySession(Base):
     __tablename__ = "study_sessions"
+    __table_args__ = (
+        Index("ix_study_sessions_user_started", "user_id", "started_at"),
+        Index("ix_study_sessions_user_set_completed", "user_id", "set_id", "completed_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -97,8 +117,59 @@ class Leaderboard(Base):
     total_correct = Column(Integer, default=0)
     streak_days = Column(Integer, default=0)
     last_study_date = Column(DateTime(timezone=True))
-    points = Column(Integer, default=0)  # Calculated score
+    points = Column(Integer, default=0, index=True)  # Calculated score
     
     # Relationships
     user = relationship("User", back_populates="leaderboard_entry")
 
+
+class StudyProgressSummary(Base):
+    """Materialized study progress per (user, set), see app/progress_summary.py"""
+    __tablename__ = "study_progress"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    set_id = Column(Integer, ForeignKey("flashcard_sets.id"), primary_key=True, index=True)
+    total_cards = Column(Integer, nullable=False, default=0)
+    cards_studied = Column(Integer, nullable=False, default=0)
+    cards_mastered = Column(Integer, nullable=False, default=0)
+    cards_due = Column(Integer, nullable=False, default=0)
+    next_due_date = Column(DateTime(timezone=True))  # Earliest upcoming review; cards_due is recomputed after it
+    daily_progress = Column(Integer, nullable=False, default=0)
+    daily_progress_date = Column(Date)
+    streak_days = Column(Integer, nullable=False, default=0)
+
+
+class DailyActivity(Base):
+    """Per-user daily rollup of completed study sessions, see app/daily_activity.py"""
+    __tablename__ = "daily_activity"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC date of the session's started_at
+    cards_studied = Column(Integer, nullable=False, default=0)
+    cards_correct = Column(Integer, nullable=False, default=0)
+    sessions_count = Column(Integer, nullable=False, default=0)
+
+
+class CardSignature(Base):
+    """MinHash signature of a card's normalized text, see app/dedup.py"""
+    __tablename__ = "card_signatures"
+    __table_args__ = (
+        Index("ix_card_signatures_set_hash", "set_id", "content_hash"),
+    )
+    
+    flashcard_id = Column(Integer, ForeignKey("flashcards.id", ondelete="CASCADE"), primary_key=True)
+    set_id = Column(Integer, ForeignKey("flashcard_sets.id", ondelete="CASCADE"), nullable=False)
+    content_hash = Column(BigInteger, nullable=False)  # Exact-duplicate key
+    signature = Column(LargeBinary, nullable=False)  # dedup.NUM_PERM little-endian uint32
+
+
+class CardSignatureBand(Base):
+    """LSH buckets of a card's signature (one row per band), see app/dedup.py"""
+    __tablename__ = "card_signature_bands"
+    # Khóa chính cũng là index tra cứu (set_id, bucket) -> flashcard_id; không có FK tới
+    # flashcards để xóa thẻ không phải quét bảng này (dedup xóa theo bucket tính lại)
+    __table_args__ = {"sqlite_with_rowid": False}
+    
+    set_id = Column(Integer, ForeignKey("flashcard_sets.id", ondelete="CASCADE"), primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)  # Hash of (band, band rows), band included so one IN lookup suffices
+    flashcard_id = Column(Integer, primary_key=True)
@@ -0,0 +1,83 @@
+"""
+Keyset (cursor) pagination for list endpoints
+
+Lists are ordered newest first by (created_at, id). A page ends with an
+opaque cursor encoding the last row's key; the next page continues with
+WHERE (created_at, id) < cursor, which the composite indexes answer
+without scanning the preceding rows. skip/limit is still accepted as a
+compatibility mode when no cursor is given.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import String, literal, tuple_
+
+# Header mang cursor của trang kế tiếp cho các endpoint trả về list
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_values(*values) -> str:
+    """Opaque cursor for any tuple of JSON-serializable sort key values"""
+    raw = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_values(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return values
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    return encode_values(created_at.isoformat(), row_id)
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, row_id = decode_values(cursor)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def _bind_timestamp(db, value: datetime):
+    if db.get_bind().dialect.name != "sqlite":
+        return value
+    # SQLite lưu CURRENT_TIMESTAMP dạng chuỗi 'YYYY-MM-DD HH:MM:SS' và so sánh theo chuỗi;
+    # bind datetime sẽ thêm '.000000' nên phải bind đúng định dạng đã lưu
+    text = value.strftime("%Y-%m-%d %H:%M:%S")
+    if value.microsecond:
+        text += f".{value.microsecond:06d}"
+    return literal(text, String)
+
+def paginate(db, stmt, model, cursor: Optional[str] = None, skip: int = 0, limit: int = 100):
+    """Order stmt by (created_at, id) DESC and apply the cursor (or the legacy offset).
+
+    One extra row is fetched so split_page() can tell whether a next page exists.
+    """
+    stmt = stmt.order_by(model.created_at.desc(), model.id.desc())
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        stmt = stmt.where(
+            tuple_(model.created_at, model.id) < tuple_(_bind_timestamp(db, created_at), row_id)
+        )
+    elif skip:
+        stmt = stmt.offset(skip)
+    return stmt.limit(limit + 1)
+
+def sort_key(row):
+    return (row.created_at, row.id)
+
+def split_page(rows: list, limit: int):
+    """Drop the look-ahead row and return (page, next_cursor)"""
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(page[-1].created_at, page[-1].id)
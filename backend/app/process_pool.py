@@ -0,0 +1,64 @@
+"""
+Bounded process pool for CPU-heavy request work (bcrypt, image resizing)
+
+The executor is created lazily with the spawn start method (forking a
+process that runs many threads is unsafe). At most max_pending jobs may be
+queued or running; beyond that run() fails fast with 503 + Retry-After
+instead of letting requests pile up behind the pool. A worker that dies
+(OOM kill, crash in a C extension) breaks the whole executor: run() then
+replaces it and retries the job once, and answers 503 if that fails too.
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from fastapi import HTTPException, status
+
+class BoundedProcessPool:
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def run(self, func, *args):
+        """Run func(*args) in a worker process (503 if max_pending jobs are already pending)"""
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    return await loop.run_in_executor(executor, func, *args)
+                except BrokenProcessPool:
+                    print("Process pool broken (worker died), restarting it")
+                    # Job khác có thể đã thay executor trong lúc chờ
+                    if self._executor is executor:
+                        self.shutdown()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+                headers={"Retry-After": "1"},
+            )
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
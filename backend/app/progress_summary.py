@@ -0,0 +1,301 @@
+"""
+Materialized per-(user, set) study progress
+
+GET /api/study/progress/{set_id} reads one study_progress row by primary
+key instead of scanning the set's cards and records. The counters are
+kept up to date incrementally by answer submission, card create/delete
+and session completion; a row is (re)built from the source tables when it
+is missing, when its due count may have changed because a scheduled
+review came due, and by the periodic reconcile() job that corrects drift.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import and_, case, func, select, update, delete, bindparam, or_
+from sqlalchemy.orm import Session
+from app import models
+from app.database import SessionLocal
+
+DAILY_GOAL = 20  # Default daily goal
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # SQLite trả về datetime không có timezone (đã lưu theo UTC)
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)
+
+def is_due(next_review_date: Optional[datetime], now: datetime) -> bool:
+    next_review_date = _as_utc(next_review_date)
+    return next_review_date is None or next_review_date <= now
+
+def is_mastered(interval: Optional[int], correct_count: Optional[int]) -> bool:
+    # Mastered: interval > 30 days and correct_count > 5
+    return (interval or 0) > 30 and (correct_count or 0) > 5
+
+def compute(db: Session, user_id: int, set_id: int) -> dict:
+    """Recompute every counter of a (user, set) row from the source tables"""
+    now = datetime.now(timezone.utc)
+    record = models.StudyRecord
+    counts = db.execute(
+        select(
+            func.count(models.Flashcard.id).label("total_cards"),
+            func.sum(case(
+                (or_(
+                    record.id.is_(None),
+                    record.next_review_date.is_(None),
+                    record.next_review_date <= now
+                ), 1),
+                else_=0
+            )).label("cards_due"),
+            func.sum(case((record.total_reviews > 0, 1), else_=0)).label("cards_studied"),
+            func.sum(case(
+                (and_(record.interval > 30, record.correct_count > 5), 1),
+                else_=0
+            )).label("cards_mastered"),
+            func.min(case((record.next_review_date > now, record.next_review_date))).label("next_due_date")
+        ).select_from(models.Flashcard).outerjoin(
+            record,
+            and_(record.flashcard_id == models.Flashcard.id, record.user_id == user_id)
+        ).where(models.Flashcard.set_id == set_id)
+    ).one()
+
+    today = now.date()
+    daily_progress = db.scalar(select(func.sum(models.StudySession.cards_studied)).where(
+        models.StudySession.user_id == user_id,
+        models.StudySession.set_id == set_id,
+        models.StudySession.started_at >= datetime.combine(today, datetime.min.time())
+    )) or 0
+    streak_days = db.scalar(select(models.Leaderboard.streak_days).where(
+        models.Leaderboard.user_id == user_id
+    )) or 0
+
+    return {
+        "user_id": user_id,
+        "set_id": set_id,
+        "total_cards": counts.total_cards or 0,
+        "cards_due": counts.cards_due or 0,
+        "cards_studied": counts.cards_studied or 0,
+        "cards_mastered": counts.cards_mastered or 0,
+        "next_due_date": counts.next_due_date,
+        "daily_progress": daily_progress,
+        "daily_progress_date": today,
+        "streak_days": streak_days,
+    }
+
+def _upsert(db: Session, table):
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(table)
+
+def _store(db: Session, values: dict):
+    """Write a computed row; an upsert, so two requests building the same row do not conflict"""
+    table = models.StudyProgressSummary.__table__
+    stmt = _upsert(db, table).values(**values)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.set_id],
+        set_={key: stmt.excluded[key] for key in values if key not in ("user_id", "set_id")}
+    ))
+
+def get_progress(db: Session, user_id: int, set_id: int) -> Optional[dict]:
+    """
+    Progress for GET /progress: a single primary-key lookup in the common case.
+    Returns None if the set does not exist.
+    """
+    summary = db.get(models.StudyProgressSummary, (user_id, set_id))
+    now = datetime.now(timezone.utc)
+    next_due_date = _as_utc(summary.next_due_date) if summary is not None else None
+    if summary is None or (next_due_date is not None and next_due_date <= now):
+        if summary is None and db.get(models.FlashcardSet, set_id) is None:
+            return None
+        values = compute(db, user_id, set_id)
+        _store(db, values)
+        db.commit()
+    else:
+        values = {
+            key: getattr(summary, key)
+            for key in ("total_cards", "cards_due", "cards_mastered", "cards_studied",
+                        "daily_progress", "daily_progress_date", "streak_days")
+        }
+
+    daily_progress = values["daily_progress"] or 0
+    if values["daily_progress_date"] != now.date():
+        daily_progress = 0
+
+    return {
+        "total_cards": values["total_cards"] or 0,
+        "cards_to_review": values["cards_due"] or 0,
+        "cards_mastered": values["cards_mastered"] or 0,
+        "cards_studied": values["cards_studied"] or 0,
+        "daily_goal": DAILY_GOAL,
+        "daily_progress": daily_progress,
+        "streak_days": values["streak_days"] or 0,
+    }
+
+def record_changed(set_id: int, before: dict, after: dict, now: datetime) -> dict:
+    """Counter deltas for one study record going from `before` to `after`"""
+    return {
+        "set_id": set_id,
+        "d_studied": int((after["total_reviews"] or 0) > 0) - int((before["total_reviews"] or 0) > 0),
+        "d_mastered": int(is_mastered(after["interval"], after["correct_count"]))
+            - int(is_mastered(before["interval"], before["correct_count"])),
+        "d_due": int(is_due(after["next_review_date"], now)) - int(is_due(before["next_review_date"], now)),
+        "next_review_date": after["next_review_date"],
+    }
+
+def apply_record_changes(db: Session, user_id: int, changes: list[dict]):
+    """Apply record_changed() deltas to the user's rows (one executemany UPDATE, no commit)"""
+    per_set: dict[int, dict] = {}
+    for change in changes:
+        agg = per_set.setdefault(change["set_id"], {
+            "b_user_id": user_id, "b_set_id": change["set_id"],
+            "d_studied": 0, "d_mastered": 0, "d_due": 0, "next_review_date": None
+        })
+        agg["d_studied"] += change["d_studied"]
+        agg["d_mastered"] += change["d_mastered"]
+        agg["d_due"] += change["d_due"]
+        if change["next_review_date"] is not None and (
+            agg["next_review_date"] is None or change["next_review_date"] < agg["next_review_date"]
+        ):
+            agg["next_review_date"] = change["next_review_date"]
+    if not per_set:
+        return
+
+    table = models.StudyProgressSummary.__table__
+    next_review = bindparam("next_review_date", type_=table.c.next_due_date.type)
+    db.execute(
+        update(table).where(
+            table.c.user_id == bindparam("b_user_id"),
+            table.c.set_id == bindparam("b_set_id")
+        ).values(
+            cards_studied=table.c.cards_studied + bindparam("d_studied"),
+            cards_mastered=table.c.cards_mastered + bindparam("d_mastered"),
+            cards_due=table.c.cards_due + bindparam("d_due"),
+            # Mốc sớm nhất mà số card due có thể thay đổi
+            next_due_date=case(
+                (next_review.is_(None), table.c.next_due_date),
+                (or_(table.c.next_due_date.is_(None), table.c.next_due_date > next_review), next_review),
+                else_=table.c.next_due_date
+            )
+        ),
+        list(per_set.values())
+    )
+
+def on_cards_created(db: Session, set_id: int, count: int):
+    """New cards have no study records, so they count as due for every user"""
+    if count <= 0:
+        return
+    table = models.StudyProgressSummary.__table__
+    db.execute(
+        update(table).where(table.c.set_id == set_id).values(
+            total_cards=table.c.total_cards + count,
+            cards_due=table.c.cards_due + count
+        )
+    )
+
+def on_card_deleted(db: Session, flashcard_id: int, set_id: int):
+    """Remove a card from every user's counters (call before deleting the card)"""
+    now = datetime.now(timezone.utc)
+    table = models.StudyProgressSummary.__table__
+    # Users without a record for this card counted it as due
+    db.execute(
+        update(table).where(table.c.set_id == set_id).values(
+            total_cards=table.c.total_cards - 1,
+            cards_due=table.c.cards_due - 1
+        )
+    )
+    records = db.execute(
+        select(
+            models.StudyRecord.user_id,
+            models.StudyRecord.next_review_date,
+            models.StudyRecord.total_reviews,
+            models.StudyRecord.interval,
+            models.StudyRecord.correct_count
+        ).where(models.StudyRecord.flashcard_id == flashcard_id)
+    ).all()
+    adjustments = [
+        {
+            "b_user_id": record.user_id,
+            "d_studied": -int((record.total_reviews or 0) > 0),
+            "d_mastered": -int(is_mastered(record.interval, record.correct_count)),
+            # Bù lại phần đã trừ ở trên nếu card này không due với user đó
+            "d_due": int(not is_due(record.next_review_date, now)),
+        }
+        for record in records
+    ]
+    if adjustments:
+        db.execute(
+            update(table).where(
+                table.c.user_id == bindparam("b_user_id"),
+                table.c.set_id == set_id
+            ).values(
+                cards_studied=table.c.cards_studied + bindparam("d_studied"),
+                cards_mastered=table.c.cards_mastered + bindparam("d_mastered"),
+                cards_due=table.c.cards_due + bindparam("d_due")
+            ),
+            adjustments
+        )
+
+def on_set_deleted(db: Session, set_id: int):
+    db.execute(delete(models.StudyProgressSummary).where(models.StudyProgressSummary.set_id == set_id))
+
+def on_user_deleted(db: Session, user_id: int):
+    """Drop the user's own rows and every user's rows for the sets the user owns"""
+    owned = select(models.FlashcardSet.id).where(models.FlashcardSet.owner_id == user_id)
+    db.execute(delete(models.StudyProgressSummary).where(or_(
+        models.StudyProgressSummary.user_id == user_id,
+        models.StudyProgressSummary.set_id.in_(owned)
+    )))
+
+def on_session_completed(db: Session, user_id: int, set_id: int, cards_studied_delta: int, streak_days: int):
+    """Add a completed session's cards to today's progress and refresh the user's streak"""
+    today = datetime.now(timezone.utc).date()
+    table = models.StudyProgressSummary.__table__
+    db.execute(
+        update(table).where(table.c.user_id == user_id, table.c.set_id == set_id).values(
+            daily_progress=case(
+                (table.c.daily_progress_date == today, table.c.daily_progress + cards_studied_delta),
+                else_=cards_studied_delta
+            ),
+            daily_progress_date=today
+        )
+    )
+    db.execute(update(table).where(table.c.user_id == user_id).values(streak_days=streak_days))
+
+def reconcile(db: Session, batch_size: int = 500) -> int:
+    """Recompute every stored row from the source tables; returns the number of rows fixed"""
+    fixed = 0
+    last_key = (0, 0)
+    table = models.StudyProgressSummary.__table__
+    while True:
+        keys = db.execute(
+            select(table.c.user_id, table.c.set_id).where(
+                or_(
+                    table.c.user_id > last_key[0],
+                    and_(table.c.user_id == last_key[0], table.c.set_id > last_key[1])
+                )
+            ).order_by(table.c.user_id, table.c.set_id).limit(batch_size)
+        ).all()
+        if not keys:
+            return fixed
+        for user_id, set_id in keys:
+            values = compute(db, user_id, set_id)
+            summary = db.get(models.StudyProgressSummary, (user_id, set_id))
+            changed = any(
+                getattr(summary, key) != value
+                for key, value in values.items()
+                if key not in ("next_due_date", "daily_progress", "daily_progress_date")
+            )
+            if changed:
+                fixed += 1
+            _store(db, values)
+        db.commit()
+        last_key = tuple(keys[-1])
+
+def run_reconcile() -> int:
+    """reconcile() in its own session, for the periodic background job"""
+    db = SessionLocal()
+    try:
+        return reconcile(db)
+    finally:
+        db.close()
@@ -0,0 +1,105 @@
+"""
+Per-endpoint SQL query budgets (N+1 detector)
+
+@query_budget(n) declares how many SQL statements one request to a route may
+run, dependencies (auth) and response serialization included. The endpoint
+function is returned unchanged, so FastAPI sees the same signature and sync
+and async routes both work.
+
+QueryBudgetMiddleware counts statements through the request stats of
+app/metrics.py and checks the budget when the response starts:
+QUERY_BUDGET_MODE=log prints the overrun, raise fails the request with
+QueryBudgetExceeded (500; the test client re-raises it), off (default,
+production) does not install the middleware. The report names the most
+repeated SQL fingerprint, which for an N+1 is the per-row query.
+
+check_query_budgets.py runs every budgeted route against seeded data.
+"""
+import collections
+import os
+import re
+from app import metrics
+
+QUERY_BUDGET_MODES = ("off", "log", "raise")
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "off").lower()
+if QUERY_BUDGET_MODE not in QUERY_BUDGET_MODES:
+    raise ValueError(f"QUERY_BUDGET_MODE must be one of {', '.join(QUERY_BUDGET_MODES)}")
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+def query_budget(max_queries: int):
+    """Declare the maximum number of SQL statements per request for a route"""
+    def decorate(endpoint):
+        endpoint.__query_budget__ = max_queries
+        return endpoint
+    return decorate
+
+def budget_for(endpoint):
+    return getattr(endpoint, "__query_budget__", None)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+# Tham số bind của các driver: ?, $1, %(name)s, :name
+_PARAMETER = re.compile(r"\$\d+|%\(\w+\)s|(?<![:\w]):\w+")
+# IN (?, ?, ?) có độ dài tùy dữ liệu: gộp về một dạng
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+def fingerprint(statement: str) -> str:
+    """SQL with literals and parameters replaced by ? so repeated queries compare equal"""
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _STRING.sub("?", statement)
+    statement = _PARAMETER.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    return _PARAMETER_LIST.sub("(?, ...)", statement)
+
+def top_fingerprints(statements: collections.Counter, n: int = 3) -> list:
+    """[(fingerprint, count)] most repeated first"""
+    counts = collections.Counter()
+    for statement, count in statements.items():
+        counts[fingerprint(statement)] += count
+    return counts.most_common(n)
+
+def report(scope, queries: int, budget: int, statements: collections.Counter) -> str:
+    lines = [f"Query budget exceeded: {scope['method']} {metrics.route_template(scope)} ran {queries} queries (budget {budget})"]
+    for sql, count in top_fingerprints(statements):
+        lines.append(f"  {count}x {sql}")
+    return "\n".join(lines)
+
+class QueryBudgetMiddleware:
+    """Must run inside MetricsMiddleware, which sets up the request stats"""
+
+    def __init__(self, app, mode: str = QUERY_BUDGET_MODE):
+        self.app = app
+        self.mode = mode
+
+    async def __call__(self, scope, receive, send):
+        stats = metrics.current_request_stats() if scope["type"] == "http" else None
+        if stats is None:
+            await self.app(scope, receive, send)
+            return
+        stats.statements = collections.Counter()
+        reported = False
+
+        def check():
+            nonlocal reported
+            route = scope.get("route")
+            budget = budget_for(getattr(route, "endpoint", None) or scope.get("endpoint"))
+            if reported or budget is None or stats.queries <= budget:
+                return
+            reported = True
+            message = report(scope, stats.queries, budget, stats.statements)
+            if self.mode == "raise":
+                raise QueryBudgetExceeded(message)
+            print(message)
+
+        async def send_checked(message):
+            # Trước khi gửi header: ở chế độ raise request vẫn trả về được 500
+            if message["type"] == "http.response.start":
+                check()
+            await send(message)
+
+        await self.app(scope, receive, send_checked)
+        # StreamingResponse còn truy vấn sau khi gửi header
+        check()
@@ -0,0 +1,219 @@
+"""
+In-process leaderboard rank index
+
+Keeps (points, user_id) pairs sorted so a user's rank and the users
+around them are found in O(log n) instead of a COUNT(*) over the whole
+leaderboard table. Built at startup from the Leaderboard table and updated
+whenever a user's points change.
+
+The index lives in each worker process and a worker only sees the point
+changes it handled itself (plus the caller's own points, synced by
+/my-rank). With several uvicorn workers the other users' points drift, so
+main.py rebuilds the index from the Leaderboard table every
+RANK_INDEX_REFRESH_INTERVAL seconds: ranks may be that much out of date,
+the same bound leaderboard_cache puts on the top-N list.
+
+The pairs live in a bucketed sorted list (buckets of at most 2 * LOAD keys,
+a Fenwick tree over bucket sizes for positions), so an update moves O(LOAD)
+elements instead of shifting the whole list like bisect.insort would.
+"""
+import bisect
+import os
+import threading
+from typing import Optional
+from sqlalchemy.orm import Session
+from app import models
+
+LOAD = 512
+
+RANK_INDEX_REFRESH_INTERVAL = float(os.getenv("RANK_INDEX_REFRESH_INTERVAL", "30"))
+
+class _SortedKeys:
+    """Sorted list of keys: add/discard O(log n + LOAD), position lookups O(log n)"""
+
+    def __init__(self, keys: list = ()):
+        keys = list(keys)
+        self._buckets = [keys[i:i + LOAD] for i in range(0, len(keys), LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(keys)
+        self._build_tree()
+
+    def _build_tree(self):
+        # Fenwick tree (1-based) over len(bucket)
+        tree = [0] + [len(bucket) for bucket in self._buckets]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, j: int, delta: int):
+        j += 1
+        while j < len(self._tree):
+            self._tree[j] += delta
+            j += j & -j
+
+    def _prefix(self, j: int) -> int:
+        """Number of keys in buckets[:j]"""
+        total = 0
+        while j > 0:
+            total += self._tree[j]
+            j -= j & -j
+        return total
+
+    def _locate(self, position: int) -> tuple:
+        """(bucket, offset) of the key at a global position < len"""
+        j = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            if j + step < len(self._tree) and self._tree[j + step] <= position:
+                j += step
+                position -= self._tree[j]
+            step >>= 1
+        return j, position
+
+    def add(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            self._build_tree()
+            return
+        j = bisect.bisect_left(self._maxes, key)
+        if j == len(self._maxes):
+            j -= 1
+            self._buckets[j].append(key)
+            self._maxes[j] = key
+        else:
+            bisect.insort(self._buckets[j], key)
+        self._len += 1
+        bucket = self._buckets[j]
+        if len(bucket) > 2 * LOAD:
+            # Tách bucket đầy; dựng lại Fenwick (O(n / LOAD), hiếm)
+            self._buckets[j:j + 1] = [bucket[:LOAD], bucket[LOAD:]]
+            self._maxes[j:j + 1] = [bucket[LOAD - 1], bucket[-1]]
+            self._build_tree()
+        else:
+            self._tree_add(j, 1)
+
+    def discard(self, key):
+        j = bisect.bisect_left(self._maxes, key)
+        if j == len(self._maxes):
+            return
+        bucket = self._buckets[j]
+        i = bisect.bisect_left(bucket, key)
+        if bucket[i] != key:
+            return
+        del bucket[i]
+        self._len -= 1
+        if bucket:
+            self._maxes[j] = bucket[-1]
+            self._tree_add(j, -1)
+        else:
+            del self._buckets[j]
+            del self._maxes[j]
+            self._build_tree()
+
+    def bisect_left(self, key) -> int:
+        j = bisect.bisect_left(self._maxes, key)
+        if j == len(self._maxes):
+            return self._len
+        return self._prefix(j) + bisect.bisect_left(self._buckets[j], key)
+
+    def slice(self, start: int, stop: int) -> list:
+        start, stop = max(start, 0), min(stop, self._len)
+        if start >= stop:
+            return []
+        j, i = self._locate(start)
+        result = []
+        while len(result) < stop - start:
+            result.extend(self._buckets[j][i:i + stop - start - len(result)])
+            j, i = j + 1, 0
+        return result
+
+    def __len__(self) -> int:
+        return self._len
+
+class RankIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Sắp xếp tăng dần theo (-points, user_id): điểm cao nhất đứng đầu
+        self._keys = _SortedKeys()
+        self._points: dict[int, int] = {}
+        # user_id -> points (None: đã xóa) trong lúc rebuild đang chạy
+        self._changes: Optional[dict] = None
+
+    def rebuild(self, db: Session):
+        """Reload the whole index from the Leaderboard table"""
+        with self._lock:
+            # Thay đổi đến trong lúc query có thể không có trong snapshot: ghi lại để áp dụng sau
+            self._changes = {}
+        try:
+            rows = db.query(models.Leaderboard.user_id, models.Leaderboard.points).all()
+        except BaseException:
+            with self._lock:
+                self._changes = None
+            raise
+        points = {user_id: points or 0 for user_id, points in rows}
+        keys = _SortedKeys(sorted((-p, user_id) for user_id, p in points.items()))
+        with self._lock:
+            changes, self._changes = self._changes, None
+            self._points = points
+            self._keys = keys
+            for user_id, new_points in changes.items():
+                self._set(user_id, new_points)
+
+    def update(self, user_id: int, points: int):
+        """Insert or move a user after their points changed"""
+        with self._lock:
+            self._set(user_id, points or 0)
+
+    def remove(self, user_id: int):
+        with self._lock:
+            self._set(user_id, None)
+
+    def _set(self, user_id: int, points: Optional[int]):
+        """Move (or remove, points=None) a user; caller holds the lock"""
+        if self._changes is not None:
+            self._changes[user_id] = points
+        old = self._points.get(user_id)
+        if old == points:
+            return
+        if old is not None:
+            self._keys.discard((-old, user_id))
+            del self._points[user_id]
+        if points is not None:
+            self._points[user_id] = points
+            self._keys.add((-points, user_id))
+
+    def _rank_of_points(self, points: int) -> int:
+        # Số user có điểm cao hơn + 1 (đồng điểm thì cùng hạng)
+        return self._keys.bisect_left((-points,)) + 1
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._points
+
+    def rank(self, user_id: int) -> Optional[int]:
+        with self._lock:
+            points = self._points.get(user_id)
+            if points is None:
+                return None
+            return self._rank_of_points(points)
+
+    def neighbors(self, user_id: int, k: int) -> list[dict]:
+        """Entries ranked just above and below the user (k on each side, user included)"""
+        with self._lock:
+            points = self._points.get(user_id)
+            if points is None:
+                return []
+            i = self._keys.bisect_left((-points, user_id))
+            window = self._keys.slice(i - k, i + k + 1)
+            return [
+                {"user_id": uid, "points": -neg_points, "rank": self._rank_of_points(-neg_points)}
+                for neg_points, uid in window
+            ]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+rank_index = RankIndex()
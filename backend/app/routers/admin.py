@@ -1,8 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import func, text
 from sqlalchemy.orm import Session, joinedload
-from typing import List
+from typing import List, Optional
 from app.database import get_db
-from app import models, schemas, auth
+from app import models, schemas, auth, progress_summary, daily_activity, dedup, avatars, pagination, etags
+from app.query_budget import query_budget
+from app.rank_index import rank_index
+from app.leaderboard_cache import leaderboard_cache
+from app.user_cache import user_cache
+from app.ai_cache import ai_cache
+from app.ai_generation import generation_queue
 from app.schemas import UserResponse
 
 router = APIRouter()
@@ -16,43 +23,68 @@ def require_admin(current_user: models.User = Depends(auth.get_current_user)):
         )
     return current_user
 
+# Dưới ngưỡng này thì đếm chính xác, vì COUNT(*) trên bảng nhỏ vẫn rẻ
+APPROXIMATE_COUNT_THRESHOLD = 10000
+
+def count_users(db: Session, exact: bool = False):
+    """Return (total, is_exact) in one query.
+
+    On Postgres the planner estimate (pg_class.reltuples) is used for large
+    tables unless an exact count is requested.
+    """
+    if exact or db.get_bind().dialect.name != "postgresql":
+        return db.query(func.count(models.User.id)).scalar(), True
+    row = db.execute(text(
+        "SELECT CASE WHEN c.reltuples < :threshold THEN (SELECT count(*) FROM users) "
+        "ELSE c.reltuples::bigint END AS total, c.reltuples < :threshold AS is_exact "
+        "FROM pg_class c WHERE c.oid = 'users'::regclass"
+    ), {"threshold": APPROXIMATE_COUNT_THRESHOLD}).one()
+    return int(row.total), bool(row.is_exact)
+
 @router.get("/users", response_model=dict)
+@query_budget(4)
 def get_users(
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    exact_count: bool = False,
     current_user: models.User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Get all users (admin only)"""
-    users = db.query(models.User).offset(skip).limit(limit).all()
-    total = db.query(models.User).count()
-    
-    # Get last active date for each user from study_sessions
-    from sqlalchemy import func
-    from app.models import StudySession
+    query = db.query(
+        models.User.id,
+        models.User.username,
+        models.User.email,
+        models.User.is_active,
+        models.User.is_admin,
+        models.User.created_at,
+        models.User.last_active_at
+    )
+    users, next_cursor = pagination.split_page(
+        pagination.paginate(db, query, models.User, cursor, skip, limit).all(), limit
+    )
+    total, total_exact = count_users(db, exact_count)
     
-    users_with_activity = []
-    for user in users:
-        # Get most recent study session
-        last_session = db.query(StudySession).filter(
-            StudySession.user_id == user.id
-        ).order_by(StudySession.started_at.desc()).first()
-        
-        user_dict = {
+    users_with_activity = [
+        {
             "id": user.id,
             "username": user.username,
             "email": user.email,
             "is_active": user.is_active,
             "is_admin": user.is_admin,
             "created_at": user.created_at,
-            "last_active": last_session.started_at if last_session else None
+            "last_active": user.last_active_at
         }
-        users_with_activity.append(user_dict)
+        for user in users
+    ]
     
     return {
         "users": users_with_activity,
         "total": total,
-        "count": len(users_with_activity)
+        "total_exact": total_exact,
+        "count": len(users_with_activity),
+        "next_cursor": next_cursor
     }
 
 @router.get("/users/{user_id}", response_model=UserResponse)
@@ -90,8 +122,16 @@ def delete_user(
             detail="Cannot delete yourself"
         )
     
+    progress_summary.on_user_deleted(db, user_id)
+    daily_activity.on_user_deleted(db, user_id)
+    dedup.on_user_deleted(db, user_id)
+    avatar_url = user.avatar_url
     db.delete(user)
     db.commit()
+    avatars.release(avatar_url)
+    user_cache.invalidate(user_id)
+    rank_index.remove(user_id)
+    leaderboard_cache.invalidate()
     return {"message": "User deleted successfully"}
 
 @router.put("/users/{user_id}", response_model=UserResponse)
@@ -127,6 +167,9 @@ def update_user(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already exists"
             )
+        if new_username != user.username:
+            # owner_username nằm trong response của các set, nên ETag của chúng phải đổi
+            db.execute(etags.bump_owner_set_versions(user.id))
         user.username = new_username
     
     # Update email if provided
@@ -164,18 +207,27 @@ def update_user(
     
     db.commit()
     db.refresh(user)
+    # Username, email, is_active or is_admin may have changed
+    user_cache.invalidate(user_id)
     return user
 
 @router.get("/sets", response_model=List[schemas.FlashcardSetResponse])
+@query_budget(2)
 def get_all_sets(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Get all flashcard sets (admin only) - for management purposes"""
     query = db.query(models.FlashcardSet).options(joinedload(models.FlashcardSet.owner))
-    sets = query.offset(skip).limit(limit).all()
+    sets, next_cursor = pagination.split_page(
+        pagination.paginate(db, query, models.FlashcardSet, cursor, skip, limit).all(), limit
+    )
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
     
     # Add username to each set
     for set_item in sets:
@@ -184,3 +236,14 @@ def get_all_sets(
     
     return sets
 
+
+@router.get("/cache-stats")
+def get_cache_stats(
+    current_user: models.User = Depends(require_admin)
+):
+    """Hit/miss counters of the in-process caches (admin only)"""
+    return {
+        "user_cache": user_cache.stats(),
+        "ai_cache": ai_cache.stats(),
+        "ai_queue": generation_queue.stats()
+    }
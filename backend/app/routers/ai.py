@@ -1,71 +1,111 @@
 import json
 import csv
 import io
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import get_db
-from app import models, schemas, auth
+from app.database import get_db, get_async_db
+from app import models, schemas, auth, card_import, ai_generation, dedup
+from app.ai_generation import generation_queue
 from app.schemas import AIGenerateRequest, ImportRequest
-import os
-from openai import OpenAI
 
 router = APIRouter()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY")) if os.getenv("OPENAI_API_KEY") else None
+async def _submit_job(request: AIGenerateRequest, user: models.User) -> ai_generation.GenerationJob:
+    generation_queue.start()
+    if not generation_queue.backend.configured:
+        raise HTTPException(
+            status_code=500,
+            detail="OpenAI API key not configured"
+        )
+    return await generation_queue.submit(
+        user.id, request.topic, request.number_of_cards, request.difficulty, set_id=request.set_id
+    )
+
+async def _check_dedup_set(request: AIGenerateRequest, user: models.User, db: AsyncSession):
+    """The set used for duplicate flagging must be the user's own (or any set for admins)"""
+    if request.set_id is None:
+        return
+    owner_id = await db.scalar(
+        select(models.FlashcardSet.owner_id).where(models.FlashcardSet.id == request.set_id)
+    )
+    if owner_id is None:
+        raise HTTPException(status_code=404, detail="Flashcard set not found")
+    if owner_id != user.id and not user.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+def _check_duplicates_mode(duplicates: str):
+    if duplicates not in dedup.DUPLICATE_MODES:
+        raise HTTPException(status_code=400, detail="duplicates must be one of: skip, flag, allow")
+
+def _get_own_job(job_id: str, user: models.User) -> ai_generation.GenerationJob:
+    job = generation_queue.get(job_id)
+    if not job or (job.user_id != user.id and not user.is_admin):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @router.post("/generate")
-def generate_flashcards(
+async def generate_flashcards(
     request: AIGenerateRequest,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Generate flashcards using AI"""
-    if not client:
+    """Generate flashcards using AI (waits for the queued job)"""
+    await _check_dedup_set(request, current_user, db)
+    # Trả connection về pool trước khi chờ LLM (có thể hàng chục giây)
+    await db.close()
+    job = await _submit_job(request, current_user)
+    await job.wait()
+    if job.status == "failed":
         raise HTTPException(
             status_code=500,
-            detail="OpenAI API key not configured"
+            detail=f"Error generating flashcards: {job.error}"
         )
-    
-    try:
-        prompt = f"""Generate {request.number_of_cards} flashcards about {request.topic} with {request.difficulty} difficulty level.
-Return the response as a JSON array with the following format:
-[
-  {{"front": "Question or term", "back": "Answer or definition"}},
-  ...
-]
+    return job.result
 
-Make sure the flashcards are educational and cover important aspects of {request.topic}."""
-        
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that creates educational flashcards. Always return valid JSON arrays."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7
-        )
-        
-        content = response.choices[0].message.content
-        # Try to extract JSON from the response
-        try:
-            flashcards_data = json.loads(content)
-        except json.JSONDecodeError:
-            # Try to extract JSON from markdown code blocks
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0]
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0]
-            flashcards_data = json.loads(content.strip())
-        
-        return {"flashcards": flashcards_data}
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_generation_job(
+    request: AIGenerateRequest,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Queue an AI generation job; poll GET /jobs/{job_id} or stream /jobs/{job_id}/events"""
+    await _check_dedup_set(request, current_user, db)
+    job = await _submit_job(request, current_user)
+    return {"job_id": job.id, "status": job.status}
+
+@router.get("/jobs/{job_id}")
+async def get_generation_job(
+    job_id: str,
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    return _get_own_job(job_id, current_user).to_dict()
+
+@router.get("/jobs/{job_id}/events")
+async def stream_generation_job(
+    job_id: str,
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Server-Sent Events: one "status" event per state change, ending with done/failed"""
+    job = _get_own_job(job_id, current_user)
     
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error generating flashcards: {str(e)}"
-        )
+    async def events():
+        while True:
+            # Lấy event chờ trước khi đọc trạng thái để không bỏ lỡ lần đổi trạng thái nào
+            changed = job.changed
+            yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+            if job.finished:
+                return
+            await changed.wait()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.post("/import")
 def import_flashcards(
@@ -73,7 +113,7 @@ def import_flashcards(
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Import flashcards from CSV or JSON file content"""
+    """Import flashcards from CSV or JSON file content (duplicates defaults to allow: every card is inserted)"""
     db_set = db.query(models.FlashcardSet).filter(models.FlashcardSet.id == request.set_id).first()
     if not db_set:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
@@ -81,6 +121,7 @@ def import_flashcards(
     if db_set.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
+    _check_duplicates_mode(request.duplicates)
     flashcards_created = []
     
     try:
@@ -89,14 +130,8 @@ def import_flashcards(
             data = json.loads(request.file_content)
             if isinstance(data, list):
                 for item in data:
-                    if "front" in item and "back" in item:
-                        card = models.Flashcard(
-                            set_id=request.set_id,
-                            front=item["front"],
-                            back=item["back"]
-                        )
-                        db.add(card)
-                        flashcards_created.append(card)
+                    if isinstance(item, dict) and "front" in item and "back" in item:
+                        flashcards_created.append((item["front"], item["back"]))
         except json.JSONDecodeError:
             # Try to parse as CSV
             csv_reader = csv.DictReader(io.StringIO(request.file_content))
@@ -105,19 +140,29 @@ def import_flashcards(
                 back = row.get("back") or row.get("Back") or row.get("answer") or row.get("Answer")
                 
                 if front and back:
-                    card = models.Flashcard(
-                        set_id=request.set_id,
-                        front=front,
-                        back=back
-                    )
-                    db.add(card)
-                    flashcards_created.append(card)
+                    flashcards_created.append((front, back))
         
+        imported = 0
+        duplicates = []
+        for start in range(0, len(flashcards_created), card_import.IMPORT_CHUNK_SIZE):
+            inserted, found = card_import.insert_cards(
+                db,
+                request.set_id,
+                flashcards_created[start:start + card_import.IMPORT_CHUNK_SIZE],
+                request.duplicates
+            )
+            imported += inserted
+            for index, match in found:
+                if match["batch_index"] is not None:
+                    match["batch_index"] += start
+                duplicates.append({"index": start + index, **match})
         db.commit()
         
         return {
-            "message": f"Successfully imported {len(flashcards_created)} flashcards",
-            "count": len(flashcards_created)
+            "message": f"Successfully imported {imported} flashcards",
+            "count": imported,
+            "duplicates": duplicates[:card_import.MAX_REPORTED_DUPLICATES],
+            "duplicates_count": len(duplicates),
         }
     
     except Exception as e:
@@ -127,3 +172,35 @@ def import_flashcards(
             detail=f"Error importing flashcards: {str(e)}"
         )
 
+@router.post("/import/upload")
+def import_flashcards_upload(
+    set_id: int = Form(...),
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    duplicates: str = Form("skip"),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Import flashcards from an uploaded CSV or JSON-array file (multipart).
+
+    Trả về NDJSON: các event "error" (từng dòng lỗi), "duplicate" (thẻ trùng,
+    bị bỏ qua khi duplicates=skip), "progress" (sau mỗi chunk) và cuối cùng là
+    "done" hoặc "failed".
+    """
+    db_set = db.query(models.FlashcardSet).filter(models.FlashcardSet.id == set_id).first()
+    if not db_set:
+        raise HTTPException(status_code=404, detail="Flashcard set not found")
+    
+    if db_set.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    if format is not None and format not in ("csv", "json"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'json'")
+    _check_duplicates_mode(duplicates)
+    
+    # Starlette đã spool file upload ra đĩa, ở đây chỉ đọc tuần tự từng đoạn
+    file_format = format or card_import.detect_format(file.file, file.filename)
+    return StreamingResponse(
+        card_import.stream_import(set_id, file.file, file_format, duplicates=duplicates),
+        media_type="application/x-ndjson"
+    )
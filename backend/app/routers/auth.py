@@ -1,70 +1,73 @@
-from datetime import timedelta, datetime
+from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.database import get_db
-from app import models, schemas, auth
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db, get_async_db
+from starlette.concurrency import run_in_threadpool
+from app import models, schemas, auth, etags, avatars
+from app.rank_index import rank_index
+from app.user_cache import user_cache
+from app.leaderboard_cache import leaderboard_cache
 from app.schemas import LoginRequest, Token, UserResponse, UserCreate
-import os
-import shutil
-from pathlib import Path
-import time
 
 router = APIRouter()
 
 @router.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     try:
         # Check if username exists
-        if auth.get_user_by_username(db, user.username):
+        if await db.scalar(select(models.User.id).where(models.User.username == user.username)):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already registered"
             )
         
         # Check if email exists
-        if auth.get_user_by_email(db, user.email):
+        if await db.scalar(select(models.User.id).where(models.User.email == user.email)):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already registered"
             )
         
         # Create new user
-        hashed_password = auth.get_password_hash(user.password)
+        hashed_password = await auth.get_password_hash_async(user.password)
         db_user = models.User(
             username=user.username,
             email=user.email,
             hashed_password=hashed_password
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         
         # Create leaderboard entry
         try:
             leaderboard_entry = models.Leaderboard(user_id=db_user.id)
             db.add(leaderboard_entry)
-            db.commit()
+            await db.commit()
+            rank_index.update(db_user.id, 0)
+            leaderboard_cache.invalidate()
         except Exception as e:
             # Nếu leaderboard đã tồn tại, bỏ qua
-            db.rollback()
+            await db.rollback()
         
         return db_user
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error creating user: {str(e)}"
         )
 
 @router.post("/login", response_model=Token)
-def login(
+async def login(
     login_data: LoginRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = auth.authenticate_user(db, login_data.username, login_data.password)
+    user = await auth.authenticate_user_async(db, login_data.username, login_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -89,6 +92,9 @@ def update_profile(
     db: Session = Depends(get_db)
 ):
     """Update current user's profile"""
+    # current_user is a cached read-only snapshot; modify a fresh copy
+    user = db.query(models.User).filter(models.User.id == current_user.id).first()
+    
     # Update username if provided
     if user_update.username is not None:
         new_username = user_update.username.strip()
@@ -107,7 +113,10 @@ def update_profile(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already exists"
             )
-        current_user.username = new_username
+        if new_username != user.username:
+            # owner_username nằm trong response của các set, nên ETag của chúng phải đổi
+            db.execute(etags.bump_owner_set_versions(user.id))
+        user.username = new_username
     
     # Update email if provided
     if user_update.email is not None:
@@ -132,29 +141,32 @@ def update_profile(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already exists"
             )
-        current_user.email = new_email
+        user.email = new_email
     
     db.commit()
-    db.refresh(current_user)
-    return current_user
+    db.refresh(user)
+    user_cache.invalidate(user.id)
+    return user
 
 @router.post("/change-password")
-def change_password(
+async def change_password(
     password_data: schemas.ChangePasswordRequest,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Change user password"""
     # Verify old password
-    if not auth.verify_password(password_data.old_password, current_user.hashed_password):
+    if not await auth.verify_password_async(password_data.old_password, current_user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect old password"
         )
     
     # Update password
-    current_user.hashed_password = auth.get_password_hash(password_data.new_password)
-    db.commit()
+    user = await db.get(models.User, current_user.id)
+    user.hashed_password = await auth.get_password_hash_async(password_data.new_password)
+    await db.commit()
+    user_cache.invalidate(user.id)
     
     return {"message": "Password changed successfully"}
 
@@ -162,43 +174,38 @@ def change_password(
 async def upload_avatar(
     file: UploadFile = File(...),
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload user avatar"""
     # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
-    if file.content_type not in allowed_types:
+    if file.content_type not in avatars.ALLOWED_CONTENT_TYPES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid file type. Only images are allowed."
         )
     
-    # Validate file size (max 5MB)
-    file_content = await file.read()
-    if len(file_content) > 5 * 1024 * 1024:
+    # Validate file size (max 5MB); spool_upload cũng dừng ngay khi vượt giới hạn
+    if file.size is not None and file.size > avatars.AVATAR_MAX_BYTES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="File size too large. Maximum size is 5MB."
         )
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = Path("uploads/avatars")
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Generate unique filename
-    file_extension = Path(file.filename).suffix
-    timestamp = int(time.time() * 1000)  # Use milliseconds for better uniqueness
-    filename = f"avatar_{current_user.id}_{timestamp}{file_extension}"
-    file_path = upload_dir / filename
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        buffer.write(file_content)
+    digest = await avatars.store_avatar(file.file)
+    avatar_url = avatars.avatar_url(digest)
     
     # Update user avatar URL
-    avatar_url = f"/uploads/avatars/{filename}"
-    current_user.avatar_url = avatar_url
-    db.commit()
-    db.refresh(current_user)
+    user = await db.get(models.User, current_user.id)
+    old_avatar_url = user.avatar_url
+    user.avatar_url = avatar_url
+    await db.commit()
+    user_cache.invalidate(user.id)
+    await avatars.ensure_stored(digest, file.file)
+    if old_avatar_url and old_avatar_url != avatar_url:
+        await run_in_threadpool(avatars.release, old_avatar_url)
     
-    return {"avatar_url": avatar_url, "message": "Avatar uploaded successfully"}
+    return {
+        "avatar_url": avatar_url,
+        "thumbnails": {str(size): avatars.avatar_url(digest, size) for size in avatars.AVATAR_SIZES},
+        "message": "Avatar uploaded successfully"
+    }
@@ -1,50 +1,93 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import or_, and_
-from app.database import get_db
-from app import models, schemas, auth
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy import or_, and_, select
+from app.database import get_async_db
+from app import models, schemas, auth, progress_summary, pagination, card_export, etags, search, dedup
+from app.query_budget import query_budget
 from app.schemas import (
     FlashcardSetResponse, FlashcardSetCreate, FlashcardSetUpdate, FlashcardSetWithCards,
-    FlashcardResponse, FlashcardCreate, FlashcardBase
+    FlashcardResponse, FlashcardCreate, FlashcardBase, FlashcardSearchResponse
 )
 
 router = APIRouter()
 
+async def _check_set_etag(
+    db: AsyncSession, set_id: int, user: models.User, representation: str, request: Request, response: Response
+):
+    """Check existence and read access from the set's own columns and compute its ETag.
+
+    Returns a 304 response when If-None-Match matches, otherwise sets the ETag on response.
+    """
+    db_set = (await db.execute(
+        select(models.FlashcardSet.owner_id, models.FlashcardSet.is_public, models.FlashcardSet.version)
+        .where(models.FlashcardSet.id == set_id)
+    )).first()
+    if not db_set:
+        raise HTTPException(status_code=404, detail="Flashcard set not found")
+    
+    # Admin can access any set, regular users can only access their own or public sets
+    if not user.is_admin:
+        if db_set.owner_id != user.id and not db_set.is_public:
+            raise HTTPException(status_code=403, detail="Not authorized")
+    
+    etag = etags.set_etag(set_id, db_set.version, representation)
+    headers = {"ETag": etag, "Cache-Control": etags.CACHE_CONTROL}
+    if etags.if_none_match(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
+async def _get_set_with_owner(db: AsyncSession, set_id: int, with_cards: bool = False):
+    """Load a set with its owner (and optionally its cards) eagerly; async sessions cannot lazy-load"""
+    options = [joinedload(models.FlashcardSet.owner)]
+    if with_cards:
+        options.append(selectinload(models.FlashcardSet.flashcards))
+    return await db.scalar(
+        select(models.FlashcardSet).options(*options).where(models.FlashcardSet.id == set_id)
+    )
+
 @router.post("/sets", response_model=FlashcardSetResponse)
-def create_flashcard_set(
+async def create_flashcard_set(
     set_data: FlashcardSetCreate,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     db_set = models.FlashcardSet(
         **set_data.dict(),
         owner_id=current_user.id
     )
     db.add(db_set)
-    db.commit()
-    db.refresh(db_set)
+    await db.commit()
     # Reload with owner relationship
-    db_set = db.query(models.FlashcardSet).options(joinedload(models.FlashcardSet.owner)).filter(models.FlashcardSet.id == db_set.id).first()
+    db_set = await _get_set_with_owner(db, db_set.id)
     # Add username
     if db_set.owner:
         db_set.owner_username = db_set.owner.username
     return db_set
 
 @router.get("/sets", response_model=List[FlashcardSetResponse])
-def get_flashcard_sets(
+@query_budget(2)
+async def get_flashcard_sets(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # All users (including admin) see only their own sets
     # "My Decks" should only show sets owned by the user
     # Admin can use /api/admin/sets endpoint to see all sets for management
-    query = db.query(models.FlashcardSet).options(joinedload(models.FlashcardSet.owner))
-    sets = query.filter(
+    query = select(models.FlashcardSet).options(joinedload(models.FlashcardSet.owner)).where(
         models.FlashcardSet.owner_id == current_user.id
-    ).offset(skip).limit(limit).all()
+    )
+    rows = (await db.scalars(pagination.paginate(db, query, models.FlashcardSet, cursor, skip, limit))).all()
+    sets, next_cursor = pagination.split_page(rows, limit)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
     
     # Add username to each set
     for set_item in sets:
@@ -54,25 +97,43 @@ def get_flashcard_sets(
     return sets
 
 @router.get("/sets/my", response_model=List[FlashcardSetResponse])
-def get_my_flashcard_sets(
+@query_budget(3)
+async def get_my_flashcard_sets(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get current user's flashcard sets + public sets from other users (for 'My Decks' page)"""
     try:
-        query = db.query(models.FlashcardSet).options(joinedload(models.FlashcardSet.owner))
-        # Get user's own sets OR public sets from other users
-        sets = query.filter(
-            or_(
-                models.FlashcardSet.owner_id == current_user.id,
-                and_(
-                    models.FlashcardSet.is_public == True,
-                    models.FlashcardSet.owner_id != current_user.id
+        query = select(models.FlashcardSet).options(joinedload(models.FlashcardSet.owner))
+        if skip and not cursor:
+            # Chế độ tương thích skip/limit
+            rows = (await db.scalars(pagination.paginate(db, query.where(
+                or_(
+                    models.FlashcardSet.owner_id == current_user.id,
+                    and_(
+                        models.FlashcardSet.is_public == True,
+                        models.FlashcardSet.owner_id != current_user.id
+                    )
                 )
-            )
-        ).offset(skip).limit(limit).all()
+            ), models.FlashcardSet, skip=skip, limit=limit))).all()
+        else:
+            # Get user's own sets OR public sets from other users: mỗi nhánh dùng index
+            # (owner_id, created_at, id) / (is_public, created_at, id) riêng rồi gộp lại
+            own = (await db.scalars(pagination.paginate(db, query.where(
+                models.FlashcardSet.owner_id == current_user.id
+            ), models.FlashcardSet, cursor, limit=limit))).all()
+            public = (await db.scalars(pagination.paginate(db, query.where(
+                models.FlashcardSet.is_public == True,
+                models.FlashcardSet.owner_id != current_user.id
+            ), models.FlashcardSet, cursor, limit=limit))).all()
+            rows = sorted([*own, *public], key=pagination.sort_key, reverse=True)[:limit + 1]
+        sets, next_cursor = pagination.split_page(rows, limit)
+        if next_cursor:
+            response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
         
         # Add username to each set
         for set_item in sets:
@@ -80,27 +141,43 @@ def get_my_flashcard_sets(
                 set_item.owner_username = set_item.owner.username
         
         return sets
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching flashcard sets: {str(e)}"
         )
 
+@router.get("/search", response_model=FlashcardSearchResponse)
+async def search_flashcards(
+    q: str = Query(..., min_length=1, max_length=200),
+    set_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Full-text search over the cards of the user's own and public sets (best matches first)"""
+    return await search.search_cards(db, q, current_user.id, current_user.is_admin, set_id, cursor, limit)
+
 @router.get("/sets/{set_id}", response_model=FlashcardSetWithCards)
-def get_flashcard_set(
+@query_budget(4)
+async def get_flashcard_set(
     set_id: int,
+    request: Request,
+    response: Response,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_set = db.query(models.FlashcardSet).options(joinedload(models.FlashcardSet.owner)).filter(models.FlashcardSet.id == set_id).first()
+    not_modified = await _check_set_etag(db, set_id, current_user, "set", request, response)
+    if not_modified:
+        return not_modified
+    
+    db_set = await _get_set_with_owner(db, set_id, with_cards=True)
     if not db_set:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
     
-    # Admin can access any set, regular users can only access their own or public sets
-    if not current_user.is_admin:
-        if db_set.owner_id != current_user.id and not db_set.is_public:
-            raise HTTPException(status_code=403, detail="Not authorized")
-    
     # Add username
     if db_set.owner:
         db_set.owner_username = db_set.owner.username
@@ -108,13 +185,13 @@ def get_flashcard_set(
     return db_set
 
 @router.put("/sets/{set_id}", response_model=FlashcardSetResponse)
-def update_flashcard_set(
+async def update_flashcard_set(
     set_id: int,
     set_data: FlashcardSetUpdate,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_set = db.query(models.FlashcardSet).options(joinedload(models.FlashcardSet.owner)).filter(models.FlashcardSet.id == set_id).first()
+    db_set = await _get_set_with_owner(db, set_id)
     if not db_set:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
     
@@ -128,40 +205,42 @@ def update_flashcard_set(
     for key, value in update_data.items():
         setattr(db_set, key, value)
     
-    db.commit()
-    db.refresh(db_set)
-    # Reload with owner relationship
-    db_set = db.query(models.FlashcardSet).options(joinedload(models.FlashcardSet.owner)).filter(models.FlashcardSet.id == set_id).first()
+    await db.execute(etags.bump_set_version(set_id))
+    await db.commit()
+    # Reload (updated_at is set by the database)
+    await db.refresh(db_set, ["updated_at"])
     # Add username
     if db_set.owner:
         db_set.owner_username = db_set.owner.username
     return db_set
 
 @router.delete("/sets/{set_id}")
-def delete_flashcard_set(
+async def delete_flashcard_set(
     set_id: int,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_set = db.query(models.FlashcardSet).filter(models.FlashcardSet.id == set_id).first()
+    db_set = await db.get(models.FlashcardSet, set_id)
     if not db_set:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
     
     if db_set.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    db.delete(db_set)
-    db.commit()
+    await db.run_sync(progress_summary.on_set_deleted, set_id)
+    await db.run_sync(dedup.on_set_deleted, set_id)
+    await db.delete(db_set)
+    await db.commit()
     return {"message": "Flashcard set deleted"}
 
 @router.post("/sets/{set_id}/cards", response_model=FlashcardResponse)
-def create_flashcard(
+async def create_flashcard(
     set_id: int,
     card: FlashcardCreate,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_set = db.query(models.FlashcardSet).filter(models.FlashcardSet.id == set_id).first()
+    db_set = await db.get(models.FlashcardSet, set_id)
     if not db_set:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
     
@@ -170,35 +249,68 @@ def create_flashcard(
     
     db_card = models.Flashcard(**card.dict(), set_id=set_id)
     db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
+    await db.flush()
+    await db.run_sync(dedup.on_card_saved, db_card.id, set_id, db_card.front, db_card.back)
+    await db.run_sync(progress_summary.on_cards_created, set_id, 1)
+    await db.execute(etags.bump_set_version(set_id))
+    await db.commit()
+    await db.refresh(db_card)
     return db_card
 
 @router.get("/sets/{set_id}/cards", response_model=List[FlashcardResponse])
-def get_flashcards(
+@query_budget(3)
+async def get_flashcards(
+    set_id: int,
+    request: Request,
+    response: Response,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    not_modified = await _check_set_etag(db, set_id, current_user, "cards", request, response)
+    if not_modified:
+        return not_modified
+    
+    return (await db.scalars(
+        select(models.Flashcard).where(models.Flashcard.set_id == set_id).order_by(models.Flashcard.id)
+    )).all()
+
+@router.get("/sets/{set_id}/export")
+async def export_flashcard_set(
     set_id: int,
+    format: str = "csv",
+    include_progress: bool = False,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_set = db.query(models.FlashcardSet).filter(models.FlashcardSet.id == set_id).first()
+    """Export a set's cards as CSV, NDJSON or a JSON array (streamed)"""
+    if format not in card_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be one of: csv, ndjson, json")
+    
+    db_set = await db.get(models.FlashcardSet, set_id)
     if not db_set:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
     
-    # Admin can access any set, regular users can only access their own or public sets
+    # Admin can export any set, regular users can only export their own or public sets
     if not current_user.is_admin:
         if db_set.owner_id != current_user.id and not db_set.is_public:
             raise HTTPException(status_code=403, detail="Not authorized")
     
-    return db_set.flashcards
+    return StreamingResponse(
+        card_export.stream_export(set_id, current_user.id, format, include_progress),
+        media_type=card_export.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="set-{set_id}.{format}"'}
+    )
 
 @router.put("/cards/{card_id}", response_model=FlashcardResponse)
-def update_flashcard(
+async def update_flashcard(
     card_id: int,
     card: FlashcardBase,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_card = db.query(models.Flashcard).filter(models.Flashcard.id == card_id).first()
+    db_card = await db.scalar(
+        select(models.Flashcard).options(joinedload(models.Flashcard.set)).where(models.Flashcard.id == card_id)
+    )
     if not db_card:
         raise HTTPException(status_code=404, detail="Flashcard not found")
     
@@ -208,24 +320,29 @@ def update_flashcard(
     for key, value in card.dict().items():
         setattr(db_card, key, value)
     
-    db.commit()
-    db.refresh(db_card)
+    await db.run_sync(dedup.on_card_saved, db_card.id, db_card.set_id, db_card.front, db_card.back)
+    await db.execute(etags.bump_set_version(db_card.set_id))
+    await db.commit()
     return db_card
 
 @router.delete("/cards/{card_id}")
-def delete_flashcard(
+async def delete_flashcard(
     card_id: int,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_card = db.query(models.Flashcard).filter(models.Flashcard.id == card_id).first()
+    db_card = await db.scalar(
+        select(models.Flashcard).options(joinedload(models.Flashcard.set)).where(models.Flashcard.id == card_id)
+    )
     if not db_card:
         raise HTTPException(status_code=404, detail="Flashcard not found")
     
     if db_card.set.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    db.delete(db_card)
-    db.commit()
+    await db.run_sync(progress_summary.on_card_deleted, db_card.id, db_card.set_id)
+    await db.run_sync(dedup.on_card_deleted, db_card.id)
+    await db.execute(etags.bump_set_version(db_card.set_id))
+    await db.delete(db_card)
+    await db.commit()
     return {"message": "Flashcard deleted"}
-
@@ -1,44 +1,37 @@
 from typing import List
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from app.database import get_db
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app import models, schemas, auth
+from app.query_budget import query_budget
+from app.rank_index import rank_index
+from app.leaderboard_cache import leaderboard_cache
 from app.schemas import LeaderboardEntry
 
 router = APIRouter()
 
+# Số user tối đa mỗi phía khi lấy neighbors trong /my-rank
+MAX_NEIGHBORS = 50
+
 @router.get("/", response_model=List[LeaderboardEntry])
-def get_leaderboard(
-    limit: int = 10,
-    db: Session = Depends(get_db)
-):
+@query_budget(2)
+async def get_leaderboard(limit: int = 10):
     """Get top users from leaderboard"""
-    entries = db.query(models.Leaderboard).join(models.User).order_by(
-        desc(models.Leaderboard.points)
-    ).limit(limit).all()
-    
-    result = []
-    for entry in entries:
-        result.append(LeaderboardEntry(
-            username=entry.user.username,
-            points=entry.points,
-            total_study_time=entry.total_study_time,
-            total_cards_studied=entry.total_cards_studied,
-            streak_days=entry.streak_days
-        ))
-    
-    return result
+    # Pre-serialized JSON from the cache: no ORM or Pydantic work on a hit
+    return Response(content=await leaderboard_cache.get(limit), media_type="application/json")
 
 @router.get("/my-rank")
-def get_my_rank(
+@query_budget(3)
+async def get_my_rank(
+    neighbors: int = 0,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get current user's rank and stats"""
-    leaderboard = db.query(models.Leaderboard).filter(
+    """Get current user's rank and stats, optionally with the users ranked around them"""
+    leaderboard = await db.scalar(select(models.Leaderboard).where(
         models.Leaderboard.user_id == current_user.id
-    ).first()
+    ))
     
     if not leaderboard:
         return {
@@ -49,17 +42,34 @@ def get_my_rank(
             "streak_days": 0
         }
     
-    # Calculate rank
-    users_above = db.query(models.Leaderboard).filter(
-        models.Leaderboard.points > leaderboard.points
-    ).count()
-    rank = users_above + 1
+    # Rank comes from the in-process index (O(log n)). Syncing the user's own
+    # points first is a no-op unless another worker changed them.
+    rank_index.update(current_user.id, leaderboard.points)
+    rank = rank_index.rank(current_user.id)
     
-    return {
+    result = {
         "rank": rank,
         "points": leaderboard.points,
         "total_study_time": leaderboard.total_study_time,
         "total_cards_studied": leaderboard.total_cards_studied,
         "streak_days": leaderboard.streak_days
     }
-
+    
+    if neighbors > 0:
+        window = rank_index.neighbors(current_user.id, min(neighbors, MAX_NEIGHBORS))
+        usernames = dict((await db.execute(
+            select(models.User.id, models.User.username).where(
+                models.User.id.in_([entry["user_id"] for entry in window])
+            )
+        )).all())
+        result["neighbors"] = [
+            {
+                "rank": entry["rank"],
+                "username": usernames.get(entry["user_id"]),
+                "points": entry["points"],
+                "is_me": entry["user_id"] == current_user.id
+            }
+            for entry in window
+        ]
+    
+    return result
@@ -1,25 +1,38 @@
 from typing import List
 from datetime import datetime, timedelta, date, timezone
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, distinct
-from app.database import get_db
-from app import models, schemas, auth, spaced_repetition
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, and_, distinct, select, update
+import numpy as np
+from app.database import get_async_db
+from app import models, schemas, auth, spaced_repetition, progress_summary, daily_activity
+from app.query_budget import query_budget
+from app.rank_index import rank_index
+from app.leaderboard_cache import leaderboard_cache
 from app.schemas import (
     FlashcardWithProgress, StudyAnswer, StudySessionCreate, StudySessionResponse,
-    StudySessionComplete, StudyProgress, StudySessionDataPoint, StudyActivityDataPoint
+    StudySessionComplete, StudyProgress, StudySessionDataPoint, StudyActivityDataPoint,
+    ReviewForecastDataPoint
 )
 
 router = APIRouter()
 
+# Số câu trả lời tối đa trong một lần gửi POST /answers
+MAX_ANSWER_BATCH = 500
+
+# Giới hạn số ngày cho GET /forecast
+MAX_FORECAST_DAYS = 90
+
 @router.get("/sets/{set_id}/due", response_model=List[FlashcardWithProgress])
-def get_cards_due_for_review(
+@query_budget(6)
+async def get_cards_due_for_review(
     set_id: int,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get flashcards that are due for review"""
-    db_set = db.query(models.FlashcardSet).filter(models.FlashcardSet.id == set_id).first()
+    db_set = await db.get(models.FlashcardSet, set_id)
     if not db_set:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
     
@@ -28,91 +41,88 @@ def get_cards_due_for_review(
         if db_set.owner_id != current_user.id and not db_set.is_public:
             raise HTTPException(status_code=403, detail="Not authorized")
     
-    due_cards = spaced_repetition.get_cards_due_for_review(db, current_user.id, set_id)
-    
-    # If no cards are due, return all cards in the set (for new users or first-time study)
-    if not due_cards:
-        all_cards = db.query(models.Flashcard).filter(models.Flashcard.set_id == set_id).all()
-        due_cards = all_cards
-    
-    result = []
-    for card in due_cards:
-        # Get or create study record
-        study_record = db.query(models.StudyRecord).filter(
-            models.StudyRecord.flashcard_id == card.id,
-            models.StudyRecord.user_id == current_user.id
-        ).first()
-        
-        if not study_record:
-            study_record = models.StudyRecord(
-                flashcard_id=card.id,
-                user_id=current_user.id
-            )
-            db.add(study_record)
-            db.commit()
-            db.refresh(study_record)
-        
-        card_data = FlashcardWithProgress(
-            id=card.id,
-            set_id=card.set_id,
-            front=card.front,
-            back=card.back,
-            created_at=card.created_at,
-            ease_factor=study_record.ease_factor,
-            interval=study_record.interval,
-            next_review_date=study_record.next_review_date,
-            total_reviews=study_record.total_reviews,
-            correct_count=study_record.correct_count,
-            incorrect_count=study_record.incorrect_count
-        )
-        result.append(card_data)
-    
-    return result
+    # One joined query for the due cards (falls back to the whole set when nothing is due),
+    # plus one bulk upsert for cards the user has never seen
+    return await db.run_sync(spaced_repetition.get_due_queue, current_user.id, set_id)
 
 @router.post("/answer")
-def submit_answer(
+async def submit_answer(
     answer: StudyAnswer,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Submit answer for a flashcard and update spaced repetition data"""
-    flashcard = db.query(models.Flashcard).filter(models.Flashcard.id == answer.flashcard_id).first()
+    flashcard = await db.scalar(select(models.Flashcard.id).where(models.Flashcard.id == answer.flashcard_id))
     if not flashcard:
         raise HTTPException(status_code=404, detail="Flashcard not found")
     
-    # Get or create study record
-    study_record = db.query(models.StudyRecord).filter(
-        models.StudyRecord.flashcard_id == answer.flashcard_id,
-        models.StudyRecord.user_id == current_user.id
-    ).first()
+    # Update with spaced repetition algorithm (creates the study record if needed)
+    states = await db.run_sync(
+        spaced_repetition.apply_answers, current_user.id, [(answer.flashcard_id, answer.quality)]
+    )
+    study_record = states[answer.flashcard_id]
+    
+    return {
+        "message": "Answer recorded",
+        "ease_factor": study_record["ease_factor"],
+        "interval": study_record["interval"],
+        "next_review_date": study_record["next_review_date"]
+    }
+
+@router.post("/answers")
+async def submit_answers(
+    answers: List[StudyAnswer],
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Submit a batch of answers (applied in order) in a single transaction"""
+    if not answers:
+        raise HTTPException(status_code=400, detail="No answers submitted")
+    if len(answers) > MAX_ANSWER_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many answers in one batch (max {MAX_ANSWER_BATCH})"
+        )
     
-    if not study_record:
-        study_record = models.StudyRecord(
-            flashcard_id=answer.flashcard_id,
-            user_id=current_user.id
+    flashcard_ids = {answer.flashcard_id for answer in answers}
+    found_ids = set(
+        await db.scalars(select(models.Flashcard.id).where(models.Flashcard.id.in_(flashcard_ids)))
+    )
+    missing_ids = flashcard_ids - found_ids
+    if missing_ids:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Flashcards not found: {sorted(missing_ids)}"
         )
-        db.add(study_record)
-        db.commit()
-        db.refresh(study_record)
     
-    # Update with spaced repetition algorithm
-    spaced_repetition.update_study_record(db, study_record, answer.quality)
+    states = await db.run_sync(
+        spaced_repetition.apply_answers,
+        current_user.id,
+        [(answer.flashcard_id, answer.quality) for answer in answers]
+    )
     
     return {
-        "message": "Answer recorded",
-        "ease_factor": study_record.ease_factor,
-        "interval": study_record.interval,
-        "next_review_date": study_record.next_review_date
+        "message": "Answers recorded",
+        "count": len(answers),
+        "results": [
+            {
+                "flashcard_id": flashcard_id,
+                "ease_factor": state["ease_factor"],
+                "interval": state["interval"],
+                "next_review_date": state["next_review_date"]
+            }
+            for flashcard_id, state in states.items()
+        ]
     }
 
 @router.post("/sessions", response_model=StudySessionResponse)
-def create_study_session(
+async def create_study_session(
     session_data: StudySessionCreate,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new study session"""
-    db_set = db.query(models.FlashcardSet).filter(models.FlashcardSet.id == session_data.set_id).first()
+    db_set = await db.get(models.FlashcardSet, session_data.set_id)
     if not db_set:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
     
@@ -121,36 +131,46 @@ def create_study_session(
         set_id=session_data.set_id
     )
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
+    await db.execute(
+        update(models.User).where(models.User.id == current_user.id).values(last_active_at=func.now())
+    )
+    await db.commit()
+    await db.refresh(db_session)
     return db_session
 
 @router.put("/sessions/{session_id}", response_model=StudySessionResponse)
-def complete_study_session(
+async def complete_study_session(
     session_id: int,
     session_data: StudySessionComplete,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Complete a study session"""
-    db_session = db.query(models.StudySession).filter(
+    db_session = await db.scalar(select(models.StudySession).where(
         models.StudySession.id == session_id,
         models.StudySession.user_id == current_user.id
-    ).first()
+    ))
     
     if not db_session:
         raise HTTPException(status_code=404, detail="Study session not found")
     
+    cards_studied_delta = (session_data.cards_studied or 0) - (db_session.cards_studied or 0)
+    cards_correct_delta = (session_data.cards_correct or 0) - (db_session.cards_correct or 0)
+    # Hoàn thành lại một session: chỉ cộng phần chênh lệch, không tính thêm session
+    sessions_delta = 0 if db_session.completed_at else 1
     db_session.cards_studied = session_data.cards_studied
     db_session.cards_correct = session_data.cards_correct
     db_session.cards_incorrect = session_data.cards_incorrect
     db_session.duration_minutes = session_data.duration_minutes
     db_session.completed_at = datetime.now(timezone.utc)
+    await db.execute(
+        update(models.User).where(models.User.id == current_user.id).values(last_active_at=db_session.completed_at)
+    )
     
     # Update leaderboard
-    leaderboard = db.query(models.Leaderboard).filter(
+    leaderboard = await db.scalar(select(models.Leaderboard).where(
         models.Leaderboard.user_id == current_user.id
-    ).first()
+    ))
     
     if leaderboard:
         # Ensure values are not None
@@ -182,89 +202,61 @@ def complete_study_session(
         
         leaderboard.last_study_date = datetime.now(timezone.utc)
     
-    db.commit()
-    db.refresh(db_session)
+    await db.run_sync(
+        progress_summary.on_session_completed,
+        current_user.id,
+        db_session.set_id,
+        cards_studied_delta,
+        leaderboard.streak_days if leaderboard else 0
+    )
+    await db.run_sync(
+        daily_activity.on_session_completed,
+        current_user.id,
+        daily_activity.activity_day(db_session.started_at),
+        cards_studied_delta,
+        cards_correct_delta,
+        sessions_delta
+    )
+    await db.commit()
+    if leaderboard:
+        rank_index.update(current_user.id, leaderboard.points)
+        leaderboard_cache.invalidate()
     return db_session
 
 @router.get("/progress/{set_id}", response_model=StudyProgress)
-def get_study_progress(
+@query_budget(8)
+async def get_study_progress(
     set_id: int,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get study progress for a flashcard set"""
-    db_set = db.query(models.FlashcardSet).filter(models.FlashcardSet.id == set_id).first()
-    if not db_set:
+    # Materialized per-(user, set) row: a single primary-key lookup in the common case
+    progress = await db.run_sync(progress_summary.get_progress, current_user.id, set_id)
+    if progress is None:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
     
-    total_cards = len(db_set.flashcards)
-    due_cards = spaced_repetition.get_cards_due_for_review(db, current_user.id, set_id)
-    cards_to_review = len(due_cards)
-    
-    # Count mastered cards (interval > 30 days and correct_count > 5)
-    mastered = db.query(models.StudyRecord).filter(
-        models.StudyRecord.user_id == current_user.id,
-        models.StudyRecord.flashcard.has(models.Flashcard.set_id == set_id),
-        models.StudyRecord.interval > 30,
-        models.StudyRecord.correct_count > 5
-    ).count()
-    
-    # Count total unique cards studied by this user
-    # A card is considered "studied" if it has a study record with total_reviews > 0
-    # This means the user has reviewed it at least once
-    # Use distinct on flashcard_id to count unique cards, not study records
-    from sqlalchemy import distinct
-    cards_studied_count = db.query(func.count(distinct(models.StudyRecord.flashcard_id))).filter(
-        models.StudyRecord.user_id == current_user.id,
-        models.StudyRecord.flashcard.has(models.Flashcard.set_id == set_id),
-        models.StudyRecord.total_reviews > 0
-    ).scalar() or 0
-    
-    # Get daily progress
-    today = datetime.utcnow().date()
-    today_sessions = db.query(models.StudySession).filter(
-        models.StudySession.user_id == current_user.id,
-        models.StudySession.set_id == set_id,
-        models.StudySession.started_at >= datetime.combine(today, datetime.min.time())
-    ).all()
-    
-    daily_progress = sum(session.cards_studied for session in today_sessions)
-    daily_goal = 20  # Default daily goal
-    
-    # Get streak from leaderboard
-    leaderboard = db.query(models.Leaderboard).filter(
-        models.Leaderboard.user_id == current_user.id
-    ).first()
-    streak_days = leaderboard.streak_days if leaderboard else 0
-    
-    return StudyProgress(
-        total_cards=total_cards,
-        cards_to_review=cards_to_review,
-        cards_mastered=mastered,
-        cards_studied=cards_studied_count,
-        daily_goal=daily_goal,
-        daily_progress=daily_progress,
-        streak_days=streak_days
-    )
+    return StudyProgress(**progress)
 
 @router.get("/sets/last-studied")
-def get_last_studied_dates(
+@query_budget(2)
+async def get_last_studied_dates(
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get last studied date for all sets that the user has studied"""
     # Get the most recent completed session for each set
-    sessions = db.query(
+    sessions = (await db.execute(select(
         models.StudySession.set_id,
         func.max(models.StudySession.completed_at).label('last_studied')
-    ).filter(
+    ).where(
         and_(
             models.StudySession.user_id == current_user.id,
             models.StudySession.completed_at.isnot(None)
         )
     ).group_by(
         models.StudySession.set_id
-    ).all()
+    ))).all()
     
     # Convert to dictionary
     result = {}
@@ -275,120 +267,138 @@ def get_last_studied_dates(
     return result
 
 @router.get("/sessions/history", response_model=List[StudySessionDataPoint])
-def get_study_sessions_history(
+async def get_study_sessions_history(
     days: int = 30,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get study sessions history for chart visualization"""
     end_date = datetime.utcnow().date()
     start_date = end_date - timedelta(days=days)
     
-    # Query sessions grouped by date
-    sessions = db.query(
-        func.date(models.StudySession.started_at).label('date'),
-        func.sum(models.StudySession.cards_studied).label('cards_studied'),
-        func.sum(models.StudySession.cards_correct).label('cards_correct'),
-        func.count(models.StudySession.id).label('sessions_count')
-    ).filter(
-        and_(
-            models.StudySession.user_id == current_user.id,
-            models.StudySession.completed_at.isnot(None),
-            func.date(models.StudySession.started_at) >= start_date,
-            func.date(models.StudySession.started_at) <= end_date
-        )
-    ).group_by(
-        func.date(models.StudySession.started_at)
-    ).order_by(
-        func.date(models.StudySession.started_at)
-    ).all()
-    
-    # Create a dictionary for quick lookup
-    sessions_dict = {}
-    for session in sessions:
-        date_str = session.date.strftime('%Y-%m-%d')
-        cards_studied = int(session.cards_studied or 0)
-        cards_correct = int(session.cards_correct or 0)
-        accuracy = (cards_correct / cards_studied * 100) if cards_studied > 0 else 0
-        
-        sessions_dict[date_str] = StudySessionDataPoint(
-            date=date_str,
-            cards_studied=cards_studied,
-            cards_correct=cards_correct,
-            accuracy=round(accuracy, 2),
-            sessions_count=int(session.sessions_count or 0)
-        )
+    # Đọc bảng tổng hợp daily_activity (một range scan theo khóa chính)
+    rows = await db.run_sync(daily_activity.get_range, current_user.id, start_date, end_date)
+    rows_by_day = {row.day: row for row in rows}
     
     # Fill in missing dates with zero values
     result = []
     current_date = start_date
     while current_date <= end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        if date_str in sessions_dict:
-            result.append(sessions_dict[date_str])
-        else:
-            result.append(StudySessionDataPoint(
-                date=date_str,
-                cards_studied=0,
-                cards_correct=0,
-                accuracy=0.0,
-                sessions_count=0
-            ))
+        row = rows_by_day.get(current_date)
+        cards_studied = row.cards_studied if row else 0
+        cards_correct = row.cards_correct if row else 0
+        accuracy = (cards_correct / cards_studied * 100) if cards_studied > 0 else 0
+        result.append({
+            "date": current_date.isoformat(),
+            "cards_studied": cards_studied,
+            "cards_correct": cards_correct,
+            "accuracy": round(accuracy, 2),
+            "sessions_count": row.sessions_count if row else 0
+        })
         current_date += timedelta(days=1)
     
     return result
 
 @router.get("/activity", response_model=List[StudyActivityDataPoint])
-def get_study_activity(
+async def get_study_activity(
     days: int = 365,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get study activity data for heatmap calendar"""
     end_date = datetime.utcnow().date()
     start_date = end_date - timedelta(days=days)
     
-    # Query sessions grouped by date
-    sessions = db.query(
-        func.date(models.StudySession.started_at).label('date'),
-        func.sum(models.StudySession.cards_studied).label('cards_studied')
-    ).filter(
-        and_(
-            models.StudySession.user_id == current_user.id,
-            models.StudySession.completed_at.isnot(None),
-            func.date(models.StudySession.started_at) >= start_date,
-            func.date(models.StudySession.started_at) <= end_date
-        )
-    ).group_by(
-        func.date(models.StudySession.started_at)
-    ).all()
+    rows = await db.run_sync(daily_activity.get_range, current_user.id, start_date, end_date)
+    cards_by_day = {row.day: row.cards_studied for row in rows}
     
     # Find max cards studied for intensity calculation
-    max_cards = max([int(s.cards_studied or 0) for s in sessions], default=1)
+    max_cards = max(cards_by_day.values(), default=1)
     
-    # Create result
     result = []
-    sessions_dict = {s.date.strftime('%Y-%m-%d'): int(s.cards_studied or 0) for s in sessions}
-    
     current_date = start_date
     while current_date <= end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        cards_studied = sessions_dict.get(date_str, 0)
+        cards_studied = cards_by_day.get(current_date, 0)
         
         # Calculate intensity (0-4) based on cards studied
-        if cards_studied == 0:
+        if cards_studied <= 0:
             intensity = 0
         elif max_cards > 0:
             intensity = min(4, int((cards_studied / max_cards) * 4) + 1)
         else:
             intensity = 0
         
-        result.append(StudyActivityDataPoint(
-            date=date_str,
-            cards_studied=cards_studied,
-            intensity=intensity
-        ))
+        result.append({
+            "date": current_date.isoformat(),
+            "cards_studied": cards_studied,
+            "intensity": intensity
+        })
         current_date += timedelta(days=1)
     
     return result
 
+@router.get("/forecast", response_model=List[ReviewForecastDataPoint])
+@query_budget(2)
+async def get_review_forecast(
+    days: int = 7,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Forecast how many reviews the user will have on each of the next N days"""
+    if days < 1 or days > MAX_FORECAST_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"days must be between 1 and {MAX_FORECAST_DAYS}"
+        )
+    
+    # All of the user's records in one query, only the columns the model needs
+    records = (await db.execute(
+        select(
+            models.StudyRecord.ease_factor,
+            models.StudyRecord.interval,
+            models.StudyRecord.repetitions,
+            models.StudyRecord.next_review_date,
+            models.StudyRecord.total_reviews,
+            models.StudyRecord.correct_count
+        ).where(models.StudyRecord.user_id == current_user.id)
+    )).all()
+    
+    today = datetime.now(timezone.utc).date()
+    due_days = []
+    for record in records:
+        review_date = record.next_review_date
+        if review_date is None:
+            due_days.append(0)
+            continue
+        if review_date.tzinfo is not None:
+            review_date = review_date.astimezone(timezone.utc)
+        # Overdue cards are counted today
+        due_days.append(max(0, (review_date.date() - today).days))
+    due_days = np.asarray(due_days, dtype=np.int64)
+    
+    # Per-card success rate with a small prior so unseen cards are not 0% or 100%
+    total_reviews = np.asarray([r.total_reviews or 0 for r in records], dtype=np.float64)
+    correct_count = np.asarray([r.correct_count or 0 for r in records], dtype=np.float64)
+    success_rates = (correct_count + 1.7) / (total_reviews + 2.0)
+    
+    scheduled = np.bincount(due_days[due_days < days], minlength=days)
+    # CPU-bound simulation runs off the event loop
+    expected = await run_in_threadpool(
+        spaced_repetition.simulate_review_forecast,
+        [r.ease_factor if r.ease_factor is not None else 2.5 for r in records],
+        [r.interval if r.interval is not None else 1 for r in records],
+        [r.repetitions or 0 for r in records],
+        due_days,
+        success_rates,
+        days,
+        seed=current_user.id
+    )
+    
+    return [
+        ReviewForecastDataPoint(
+            date=(today + timedelta(days=day)).strftime('%Y-%m-%d'),
+            scheduled=int(scheduled[day]),
+            expected_reviews=round(float(expected[day]), 2)
+        )
+        for day in range(days)
+    ]
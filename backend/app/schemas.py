@@ -97,6 +97,20 @@ class FlashcardSetResponse(FlashcardSetBase):
 class FlashcardSetWithCards(FlashcardSetResponse):
     flashcards: List[FlashcardResponse]
 
+class FlashcardSearchResult(BaseModel):
+    id: int
+    set_id: int
+    set_title: str
+    front: str
+    back: str
+    front_snippet: Optional[str] = None  # HTML-escaped, matches wrapped in <mark>
+    back_snippet: Optional[str] = None
+    score: float
+
+class FlashcardSearchResponse(BaseModel):
+    results: List[FlashcardSearchResult]
+    next_cursor: Optional[str] = None
+
 # Study schemas
 class StudyAnswer(BaseModel):
     flashcard_id: int
@@ -152,6 +166,11 @@ class StudyActivityDataPoint(BaseModel):
     cards_studied: int
     intensity: int  # 0-4 for heatmap visualization
 
+class ReviewForecastDataPoint(BaseModel):
+    date: str
+    scheduled: int  # Cards already scheduled for this day
+    expected_reviews: float  # Monte-Carlo estimate including re-reviews
+
 # Leaderboard schemas
 class LeaderboardEntry(BaseModel):
     username: str
@@ -168,10 +187,13 @@ class AIGenerateRequest(BaseModel):
     topic: str
     number_of_cards: int = 10
     difficulty: str = "medium"  # easy, medium, hard
+    set_id: Optional[int] = None  # Flag generated cards that duplicate this set
 
 class ImportRequest(BaseModel):
     set_id: int
     file_content: str  # CSV or JSON content
+    # skip, flag, allow; mặc định allow giữ hành vi cũ của /import (thêm tất cả thẻ)
+    duplicates: str = "allow"
 
 # Auth schemas
 class LoginRequest(BaseModel):
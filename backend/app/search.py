@@ -0,0 +1,251 @@
+"""
+Full-text search over flashcard front/back
+
+SQLite: an external-content FTS5 table (flashcards_fts) kept in sync with
+flashcards by triggers, ranked with bm25(). Postgres: a generated tsvector
+column with a GIN index, ranked with ts_rank_cd(). Either way inserts,
+updates, deletes and bulk imports through any code path keep the index
+current without application hooks.
+
+Both dialects take the same query syntax: every term must match, a trailing
+* on a term (3+ characters) matches it as a prefix. Other dialects fall back
+to an unindexed LIKE scan without ranking or snippets.
+
+Results are ordered by (rank, id) and paginated with a cursor on that key;
+snippets mark matches with <mark> around HTML-escaped card text.
+"""
+import html
+from typing import Optional
+from fastapi import HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from app import pagination
+
+# Ký tự đánh dấu tạm (Private Use Area) trong snippet, thay bằng <mark> sau khi escape HTML
+_MARK_START = "\ue000"
+_MARK_END = "\ue001"
+
+# Trọng số của mặt trước/mặt sau khi xếp hạng
+FRONT_WEIGHT = 2.0
+BACK_WEIGHT = 1.0
+
+# Các object này không nằm trong metadata của ORM; alembic/env.py bỏ qua chúng khi autogenerate
+FTS_TABLE = "flashcards_fts"  # cùng các bảng phụ flashcards_fts_* do FTS5 tạo
+SEARCH_VECTOR_COLUMN = "search_vector"
+SEARCH_VECTOR_INDEX = "ix_flashcards_search_vector"
+
+def is_search_object(name: str, type_: str) -> bool:
+    """True for the search index objects created by the DDL below"""
+    if type_ == "table":
+        return name == FTS_TABLE or name.startswith(f"{FTS_TABLE}_")
+    if type_ == "column":
+        return name == SEARCH_VECTOR_COLUMN
+    if type_ == "index":
+        return name == SEARCH_VECTOR_INDEX
+    return False
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS flashcards_fts USING fts5(
+        front, back, content='flashcards', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS flashcards_fts_insert AFTER INSERT ON flashcards BEGIN
+        INSERT INTO flashcards_fts(rowid, front, back) VALUES (new.id, new.front, new.back);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS flashcards_fts_delete AFTER DELETE ON flashcards BEGIN
+        INSERT INTO flashcards_fts(flashcards_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS flashcards_fts_update AFTER UPDATE OF front, back ON flashcards BEGIN
+        INSERT INTO flashcards_fts(flashcards_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back);
+        INSERT INTO flashcards_fts(rowid, front, back) VALUES (new.id, new.front, new.back);
+    END""",
+]
+
+POSTGRES_DDL = [
+    """ALTER TABLE flashcards ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(front, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(back, '')), 'B')
+        ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_flashcards_search_vector ON flashcards USING GIN (search_vector)",
+]
+
+SQLITE_REBUILD = "INSERT INTO flashcards_fts(flashcards_fts) VALUES ('rebuild')"
+
+def ensure_search_index(engine: Engine):
+    """Create the search index if it does not exist yet (idempotent, run after create_all)"""
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            created = conn.execute(text(
+                "SELECT count(*) FROM sqlite_master WHERE name = 'flashcards_fts'"
+            )).scalar() == 0
+            for statement in SQLITE_DDL:
+                conn.execute(text(statement))
+            if created:
+                # Đánh index các thẻ đã có trước khi bật FTS
+                conn.execute(text(SQLITE_REBUILD))
+        elif engine.dialect.name == "postgresql":
+            for statement in POSTGRES_DDL:
+                conn.execute(text(statement))
+
+# Tìm theo tiền tố ("photo*") chỉ khi tiền tố đủ dài, tránh khớp hàng chục nghìn thẻ
+MIN_PREFIX_LENGTH = 3
+
+def _terms(query: str) -> list:
+    """[(term, prefix)]: whitespace-separated terms, prefix when it ends in * and is long enough"""
+    terms = []
+    for term in query.split():
+        prefix = term.endswith("*") and len(term.rstrip("*")) >= MIN_PREFIX_LENGTH
+        term = term.rstrip("*")
+        if term:
+            terms.append((term, prefix))
+    return terms
+
+def fts5_query(query: str) -> Optional[str]:
+    """Quote every term so user input cannot use FTS5 syntax; a trailing * keeps prefix matching"""
+    terms = []
+    for term, prefix in _terms(query):
+        term = term.replace('"', '""')
+        terms.append(f'"{term}"*' if prefix else f'"{term}"')
+    return " ".join(terms) or None
+
+def tsquery(query: str) -> Optional[str]:
+    """Same syntax for PostgreSQL to_tsquery: quoted lexemes joined with &, term* becomes 'term':*"""
+    terms = []
+    for term, prefix in _terms(query):
+        term = term.replace("\\", "\\\\").replace("'", "''")
+        terms.append(f"'{term}':*" if prefix else f"'{term}'")
+    return " & ".join(terms) or None
+
+def _like_pattern(term: str) -> str:
+    escaped = term.lower().replace("!", "!!").replace("%", "!%").replace("_", "!_")
+    return f"%{escaped}%"
+
+def highlight(snippet: Optional[str]) -> Optional[str]:
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+def _acl_filter(user_id: int, is_admin: bool, set_id: Optional[int]) -> str:
+    clauses = []
+    if not is_admin:
+        clauses.append("(s.owner_id = :user_id OR s.is_public)")
+    if set_id is not None:
+        clauses.append("f.set_id = :set_id")
+    return "".join(f" AND {clause}" for clause in clauses)
+
+def _sqlite_search(acl: str, after: bool) -> str:
+    rank = f"bm25(flashcards_fts, {FRONT_WEIGHT}, {BACK_WEIGHT})"
+    return f"""
+        SELECT f.id, f.set_id, s.title AS set_title, f.front, f.back,
+               snippet(flashcards_fts, 0, :mark_start, :mark_end, '…', 16) AS front_snippet,
+               snippet(flashcards_fts, 1, :mark_start, :mark_end, '…', 16) AS back_snippet,
+               {rank} AS rank
+        FROM flashcards_fts
+        JOIN flashcards f ON f.id = flashcards_fts.rowid
+        JOIN flashcard_sets s ON s.id = f.set_id
+        WHERE flashcards_fts MATCH :query{acl}
+        {f"AND ({rank}, f.id) > (:after_rank, :after_id)" if after else ""}
+        ORDER BY {rank}, f.id
+        LIMIT :limit
+    """
+
+def _postgres_search(acl: str, after: bool) -> str:
+    # Xếp hạng + phân trang ở truy vấn trong; ts_headline chỉ chạy cho các dòng của trang
+    rank = "-ts_rank_cd(f.search_vector, q.query)"
+    options = f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=24, MinWords=8, MaxFragments=1"
+    return f"""
+        SELECT page.id, page.set_id, page.set_title, page.front, page.back,
+               ts_headline('simple', page.front, page.query, '{options}') AS front_snippet,
+               ts_headline('simple', page.back, page.query, '{options}') AS back_snippet,
+               page.rank
+        FROM (
+            SELECT f.id, f.set_id, s.title AS set_title, f.front, f.back, q.query, {rank} AS rank
+            FROM flashcards f
+            JOIN flashcard_sets s ON s.id = f.set_id
+            CROSS JOIN to_tsquery('simple', :query) AS q(query)
+            WHERE f.search_vector @@ q.query{acl}
+            {f"AND ({rank}, f.id) > (:after_rank, :after_id)" if after else ""}
+            ORDER BY {rank}, f.id
+            LIMIT :limit
+        ) AS page
+        ORDER BY page.rank, page.id
+    """
+
+def _like_search(acl: str, after: bool, term_count: int) -> str:
+    # Dialect khác: không có index toàn văn, mọi từ phải xuất hiện (không phân biệt hoa thường), xếp theo id
+    matches = "".join(
+        f" AND (lower(f.front) LIKE :term{i} ESCAPE '!' OR lower(f.back) LIKE :term{i} ESCAPE '!')"
+        for i in range(term_count)
+    )
+    return f"""
+        SELECT f.id, f.set_id, s.title AS set_title, f.front, f.back,
+               NULL AS front_snippet, NULL AS back_snippet, 0.0 AS rank
+        FROM flashcards f
+        JOIN flashcard_sets s ON s.id = f.set_id
+        WHERE 1 = 1{matches}{acl}
+        {"AND f.id > :after_id" if after else ""}
+        ORDER BY f.id
+        LIMIT :limit
+    """
+
+async def search_cards(
+    db,
+    query: str,
+    user_id: int,
+    is_admin: bool = False,
+    set_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20
+) -> dict:
+    """Search cards visible to the user; returns {"results": [...], "next_cursor": ...}"""
+    dialect = db.get_bind().dialect.name
+    params = {
+        "user_id": user_id,
+        "set_id": set_id,
+        "limit": limit + 1,
+        "mark_start": _MARK_START,
+        "mark_end": _MARK_END,
+    }
+    if cursor:
+        try:
+            after_rank, after_id = pagination.decode_values(cursor)
+            params.update(after_rank=float(after_rank), after_id=int(after_id))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    acl = _acl_filter(user_id, is_admin, set_id)
+    if dialect == "sqlite":
+        params["query"] = fts5_query(query)
+        sql = _sqlite_search(acl, bool(cursor))
+    elif dialect == "postgresql":
+        params["query"] = tsquery(query)
+        sql = _postgres_search(acl, bool(cursor))
+    else:
+        terms = _terms(query)
+        params["query"] = terms or None
+        params.update({f"term{i}": _like_pattern(term) for i, (term, _) in enumerate(terms)})
+        sql = _like_search(acl, bool(cursor), len(terms))
+    if not params["query"]:
+        return {"results": [], "next_cursor": None}
+
+    rows = (await db.execute(text(sql), params)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.encode_values(rows[-1].rank, rows[-1].id)
+    return {
+        "results": [
+            {
+                "id": row.id,
+                "set_id": row.set_id,
+                "set_title": row.set_title,
+                "front": row.front,
+                "back": row.back,
+                "front_snippet": highlight(row.front_snippet),
+                "back_snippet": highlight(row.back_snippet),
+                "score": -row.rank,
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor,
+    }
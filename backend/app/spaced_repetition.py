@@ -3,9 +3,11 @@ Spaced Repetition Algorithm (SM-2)
 Based on SuperMemo 2 algorithm
 """
 from datetime import datetime, timedelta, timezone
-from typing import Tuple
+from typing import Optional, Tuple
+import numpy as np
+from sqlalchemy import and_, or_, update
 from sqlalchemy.orm import Session
-from app import models
+from app import models, schemas, progress_summary
 
 def calculate_next_review(
     ease_factor: float,
@@ -43,6 +45,102 @@ def calculate_next_review(
     
     return ease_factor, interval, repetitions, next_review_date
 
+def calculate_next_review_batch(
+    ease_factors,
+    intervals,
+    repetitions,
+    qualities,
+    now: Optional[datetime] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized calculate_next_review over NumPy arrays (one element per record).
+
+    Performs the same float64 operations in the same order as the scalar
+    version, so the results are identical element by element.
+
+    Returns: (new_ease_factors, new_intervals, new_repetitions, next_review_dates)
+    where next_review_dates is a datetime64[us] array in UTC.
+    """
+    ease_factors = np.asarray(ease_factors, dtype=np.float64)
+    intervals = np.asarray(intervals, dtype=np.int64)
+    repetitions = np.asarray(repetitions, dtype=np.int64)
+    qualities = np.asarray(qualities, dtype=np.int64)
+
+    correct = qualities >= 3
+    correct_intervals = np.where(
+        repetitions == 0,
+        1,
+        np.where(repetitions == 1, 6, np.trunc(intervals * ease_factors).astype(np.int64))
+    )
+    new_intervals = np.where(correct, correct_intervals, 1)
+    new_repetitions = np.where(correct, repetitions + 1, 0)
+
+    # Adjust ease factor
+    penalty = 5 - qualities
+    new_ease_factors = ease_factors + (0.1 - penalty * (0.08 + penalty * 0.02))
+    new_ease_factors = np.maximum(1.3, new_ease_factors)  # Minimum ease factor
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+    base = np.datetime64(now.astimezone(timezone.utc).replace(tzinfo=None), "us")
+    next_review_dates = base + new_intervals.astype("timedelta64[D]")
+
+    return new_ease_factors, new_intervals, new_repetitions, next_review_dates
+
+def simulate_review_forecast(
+    ease_factors,
+    intervals,
+    repetitions,
+    due_days,
+    success_rates,
+    days: int,
+    simulations: int = 16,
+    seed: int = 0,
+    max_samples: int = 200_000
+) -> np.ndarray:
+    """
+    Monte-Carlo estimate of the number of reviews on each of the next `days` days.
+
+    due_days is the day offset (0 = today) each card is next due. Every run
+    reviews the cards due on a given day, draws pass (quality 4) or fail
+    (quality 2) from the card's success rate, reschedules them with
+    calculate_next_review_batch and keeps going until the horizon.
+    Returns the expected review count per day, averaged over all runs.
+
+    Cards due after the horizon never contribute and are dropped up front;
+    the number of runs is reduced so that runs * cards stays under
+    max_samples, which keeps large collections fast.
+    """
+    due_days = np.asarray(due_days, dtype=np.int64)
+    active = due_days < days
+    n_active = int(active.sum())
+    simulations = max(1, min(simulations, max_samples // max(1, n_active)))
+
+    rng = np.random.default_rng(seed)
+    ease_factors = np.tile(np.asarray(ease_factors, dtype=np.float64)[active], simulations)
+    intervals = np.tile(np.asarray(intervals, dtype=np.int64)[active], simulations)
+    repetitions = np.tile(np.asarray(repetitions, dtype=np.int64)[active], simulations)
+    due_days = np.tile(due_days[active], simulations)
+    success_rates = np.tile(np.asarray(success_rates, dtype=np.float64)[active], simulations)
+
+    expected = np.zeros(days, dtype=np.float64)
+    now = datetime.now(timezone.utc)
+    for day in range(days):
+        idx = np.flatnonzero(due_days == day)
+        if idx.size == 0:
+            continue
+        expected[day] = idx.size / simulations
+        qualities = np.where(rng.random(idx.size) < success_rates[idx], 4, 2)
+        new_ease_factors, new_intervals, new_repetitions, _ = calculate_next_review_batch(
+            ease_factors[idx], intervals[idx], repetitions[idx], qualities, now=now
+        )
+        ease_factors[idx] = new_ease_factors
+        intervals[idx] = new_intervals
+        repetitions[idx] = new_repetitions
+        due_days[idx] = day + new_intervals
+
+    return expected
+
 def update_study_record(
     db: Session,
     study_record: models.StudyRecord,
@@ -73,6 +171,26 @@ def update_study_record(
     
     return study_record
 
+def _due_filter(now: datetime):
+    """SQL condition matching cards that are new or whose review date has passed"""
+    return or_(
+        models.StudyRecord.id.is_(None),
+        models.StudyRecord.next_review_date.is_(None),
+        models.StudyRecord.next_review_date <= now
+    )
+
+def _cards_with_records(db: Session, user_id: int, set_id: int):
+    """Flashcards of a set LEFT OUTER JOINed with the user's study records"""
+    return db.query(models.Flashcard, models.StudyRecord).outerjoin(
+        models.StudyRecord,
+        and_(
+            models.StudyRecord.flashcard_id == models.Flashcard.id,
+            models.StudyRecord.user_id == user_id
+        )
+    ).filter(
+        models.Flashcard.set_id == set_id
+    )
+
 def get_cards_due_for_review(
     db: Session,
     user_id: int,
@@ -80,30 +198,192 @@ def get_cards_due_for_review(
 ) -> list[models.Flashcard]:
     """Get flashcards that are due for review"""
     now = datetime.now(timezone.utc)
-    
-    # Get all flashcards in the set
-    all_flashcards = db.query(models.Flashcard).filter(
-        models.Flashcard.set_id == set_id
-    ).all()
-    
-    # Get study records for this user and set
-    all_study_records = db.query(models.StudyRecord).filter(
-        models.StudyRecord.user_id == user_id,
-        models.StudyRecord.flashcard_id.in_([card.id for card in all_flashcards])
+    rows = _cards_with_records(db, user_id, set_id).filter(_due_filter(now)).all()
+    return [card for card, _ in rows]
+
+# Giá trị mặc định của một StudyRecord mới (khớp với default trong models.StudyRecord)
+NEW_RECORD_DEFAULTS = {
+    "ease_factor": 2.5,
+    "interval": 1,
+    "repetitions": 0,
+    "total_reviews": 0,
+    "correct_count": 0,
+    "incorrect_count": 0,
+}
+
+def _insert_ignore_conflicts(db: Session, table):
+    """INSERT ... ON CONFLICT DO NOTHING for the current dialect"""
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(table).on_conflict_do_nothing()
+
+def create_missing_study_records(db: Session, user_id: int, flashcard_ids: list[int]):
+    """Create study records for the given cards in one upsert (existing rows are left untouched)"""
+    if not flashcard_ids:
+        return
+    db.execute(
+        _insert_ignore_conflicts(db, models.StudyRecord.__table__),
+        [
+            {"flashcard_id": flashcard_id, "user_id": user_id, **NEW_RECORD_DEFAULTS}
+            for flashcard_id in flashcard_ids
+        ]
+    )
+
+def apply_answers(
+    db: Session,
+    user_id: int,
+    answers: list[tuple[int, int]]
+) -> dict[int, dict]:
+    """
+    Apply a batch of (flashcard_id, quality) answers in one transaction.
+
+    All affected study records are loaded with one query, SM-2 is applied in
+    answer order (a card may appear several times) and the results are written
+    back with a single bulk UPDATE. Returns the final state keyed by flashcard_id.
+    """
+    flashcard_ids = list(dict.fromkeys(flashcard_id for flashcard_id, _ in answers))
+    columns = (
+        models.StudyRecord.id,
+        models.StudyRecord.flashcard_id,
+        models.StudyRecord.ease_factor,
+        models.StudyRecord.interval,
+        models.StudyRecord.repetitions,
+        models.StudyRecord.next_review_date,
+        models.StudyRecord.total_reviews,
+        models.StudyRecord.correct_count,
+        models.StudyRecord.incorrect_count,
+        models.Flashcard.set_id,
+    )
+
+    def load(ids):
+        return {
+            row.flashcard_id: dict(row._mapping)
+            for row in db.query(*columns).join(
+                models.Flashcard, models.Flashcard.id == models.StudyRecord.flashcard_id
+            ).filter(
+                models.StudyRecord.user_id == user_id,
+                models.StudyRecord.flashcard_id.in_(ids)
+            )
+        }
+
+    states = load(flashcard_ids)
+    missing = [flashcard_id for flashcard_id in flashcard_ids if flashcard_id not in states]
+    if missing:
+        create_missing_study_records(db, user_id, missing)
+        states.update(load(missing))
+    before = {flashcard_id: dict(state) for flashcard_id, state in states.items()}
+
+    # Vòng k gồm lần trả lời thứ k của mỗi card, để mỗi vòng được tính vectorized
+    # mà vẫn giữ đúng thứ tự khi một card được trả lời nhiều lần
+    rounds: list[list[tuple[int, int]]] = []
+    answer_counts: dict[int, int] = {}
+    for flashcard_id, quality in answers:
+        k = answer_counts.get(flashcard_id, 0)
+        answer_counts[flashcard_id] = k + 1
+        if k == len(rounds):
+            rounds.append([])
+        rounds[k].append((flashcard_id, quality))
+
+    now = datetime.now(timezone.utc)
+    for batch in rounds:
+        batch_states = [states[flashcard_id] for flashcard_id, _ in batch]
+        ease_factors, intervals, repetitions, next_review_dates = calculate_next_review_batch(
+            [
+                state["ease_factor"] if state["ease_factor"] is not None else NEW_RECORD_DEFAULTS["ease_factor"]
+                for state in batch_states
+            ],
+            [
+                state["interval"] if state["interval"] is not None else NEW_RECORD_DEFAULTS["interval"]
+                for state in batch_states
+            ],
+            [state["repetitions"] or 0 for state in batch_states],
+            [quality for _, quality in batch],
+            now=now
+        )
+        for i, (state, (_, quality)) in enumerate(zip(batch_states, batch)):
+            state.update(
+                ease_factor=float(ease_factors[i]),
+                interval=int(intervals[i]),
+                repetitions=int(repetitions[i]),
+                next_review_date=next_review_dates[i].item().replace(tzinfo=timezone.utc),
+                last_reviewed=now,
+                total_reviews=(state["total_reviews"] or 0) + 1,
+            )
+            if quality >= 3:
+                state["correct_count"] = (state["correct_count"] or 0) + 1
+            else:
+                state["incorrect_count"] = (state["incorrect_count"] or 0) + 1
+
+    db.execute(
+        update(models.StudyRecord),
+        [
+            {key: value for key, value in state.items() if key not in ("flashcard_id", "set_id")}
+            for state in states.values()
+        ]
+    )
+    progress_summary.apply_record_changes(db, user_id, [
+        progress_summary.record_changed(state["set_id"], before[flashcard_id], state, now)
+        for flashcard_id, state in states.items()
+    ])
+    db.commit()
+    return states
+
+def get_due_queue(
+    db: Session,
+    user_id: int,
+    set_id: int
+) -> list[schemas.FlashcardWithProgress]:
+    """
+    Build the review queue for a set in a constant number of queries.
+
+    Due cards are selected with one LEFT OUTER JOIN; if nothing is due the whole
+    set is returned (first-time study). Cards without a study record get one
+    through a single bulk upsert, committed in one transaction after the
+    response objects are built (so a session with expire_on_commit does not
+    reload every card).
+    """
+    now = datetime.now(timezone.utc)
+    rows = _cards_with_records(db, user_id, set_id).filter(_due_filter(now)).order_by(
+        models.Flashcard.id
     ).all()
-    
-    record_dict = {record.flashcard_id: record for record in all_study_records}
-    
-    # Separate cards into due and new
-    due_cards = []
-    for card in all_flashcards:
-        record = record_dict.get(card.id)
-        if record is None:
-            # New card, no study record yet
-            due_cards.append(card)
-        elif record.next_review_date is None or record.next_review_date <= now:
-            # Card is due for review
-            due_cards.append(card)
-    
-    return due_cards
+    if not rows:
+        rows = _cards_with_records(db, user_id, set_id).order_by(models.Flashcard.id).all()
+
+    result = []
+    for card, record in rows:
+        if record is not None:
+            progress = {
+                "ease_factor": record.ease_factor,
+                "interval": record.interval,
+                "next_review_date": record.next_review_date,
+                "total_reviews": record.total_reviews,
+                "correct_count": record.correct_count,
+                "incorrect_count": record.incorrect_count,
+            }
+        else:
+            progress = {
+                "ease_factor": NEW_RECORD_DEFAULTS["ease_factor"],
+                "interval": NEW_RECORD_DEFAULTS["interval"],
+                "next_review_date": None,
+                "total_reviews": NEW_RECORD_DEFAULTS["total_reviews"],
+                "correct_count": NEW_RECORD_DEFAULTS["correct_count"],
+                "incorrect_count": NEW_RECORD_DEFAULTS["incorrect_count"],
+            }
+        result.append(schemas.FlashcardWithProgress(
+            id=card.id,
+            set_id=card.set_id,
+            front=card.front,
+            back=card.back,
+            created_at=card.created_at,
+            **progress
+        ))
 
+    # Commit sau khi đã đọc xong card/record: với expire_on_commit=True (SessionLocal)
+    # commit trước sẽ làm mỗi lần đọc thuộc tính phát sinh một SELECT
+    missing = [card.id for card, record in rows if record is None]
+    if missing:
+        create_missing_study_records(db, user_id, missing)
+        db.commit()
+    return result
@@ -0,0 +1,50 @@
+"""
+Static file serving for /uploads
+
+Files whose name carries a content hash (avatars are stored as
+<sha256>-<size>.webp, see app/avatars.py) never change, so they are served
+with a one-year immutable Cache-Control: browsers and CDNs reuse them
+without revalidating and repeat page views send no avatar requests at all.
+Their ETag is derived from the name, so it is the same on every server
+regardless of file mtime. Other files (legacy avatars) must be revalidated.
+
+Conditional requests (If-None-Match / If-Modified-Since -> 304), Range and
+If-Range come from Starlette's StaticFiles/FileResponse; the file body is
+handed to the server with the ASGI pathsend extension (zero-copy) when the
+server supports it.
+"""
+import os
+import re
+from starlette.responses import FileResponse, Response
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# Tên file chứa hash nội dung (ít nhất 32 ký tự hex đứng riêng)
+HASHED_NAME = re.compile(r"(?:^|[-_.])[0-9a-f]{32,}(?:[-_.]|$)")
+
+def is_hashed_name(path) -> bool:
+    return HASHED_NAME.search(os.path.basename(path)) is not None
+
+class CachedStaticFiles(StaticFiles):
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        headers = {"X-Content-Type-Options": "nosniff"}
+        if is_hashed_name(full_path):
+            headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+            headers["ETag"] = f'"{os.path.splitext(os.path.basename(full_path))[0]}"'
+        else:
+            headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+
+        response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,69 @@
+"""
+Bounded LRU/TTL cache of authenticated users
+
+get_current_user runs on every authenticated request; caching the user by
+token subject removes the SELECT on users from the hot path. Cached users
+are detached from any session, so they are read-only snapshots: routers
+that modify the user must load it in their own session and then call
+invalidate(). Entries expire after USER_CACHE_TTL seconds, which also
+bounds staleness across workers.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from app import models
+
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+class UserCache:
+    def __init__(self, max_size: int = USER_CACHE_MAX_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple[models.User, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username: str) -> Optional[models.User]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[username]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, username: str, user: models.User):
+        with self._lock:
+            self._entries[username] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """Drop every entry for this user (the username may have changed)"""
+        with self._lock:
+            for username in [name for name, (user, _) in self._entries.items() if user.id == user_id]:
+                del self._entries[username]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+user_cache = UserCache()
@@ -0,0 +1,182 @@
+"""
+Benchmark các index của migration 0001 trên dữ liệu seed
+
+Chạy: cd backend && python bench_indexes.py [số study record, mặc định 1000000] [--compare]
+Mặc định dùng một database SQLite tạm; đặt BENCH_DATABASE_URL để chạy trên
+PostgreSQL (một database trống dành riêng cho benchmark, script tạo bảng và seed).
+
+Với mỗi truy vấn nóng: in query plan (EXPLAIN QUERY PLAN / EXPLAIN) và báo lỗi
+nếu plan quét toàn bảng, rồi in latency p50/p99. --compare chạy lại sau khi xóa
+các index của 0001 để thấy chênh lệch. Exit code 1 nếu có plan quét toàn bảng.
+"""
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+os.environ["DATABASE_URL"] = os.getenv(
+    "BENCH_DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_indexes.db")
+)
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+from sqlalchemy import func, insert, select, text
+from app.database import Base, engine
+from app import models
+
+CHUNK_SIZE = 50_000
+RUNS_PER_QUERY = 200
+NOW = datetime.now(timezone.utc)
+
+def load_migration_indexes() -> list:
+    path = Path(__file__).parent / "alembic" / "versions" / "0001_hot_path_indexes.py"
+    spec = importlib.util.spec_from_file_location("migration_0001", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.INDEXES
+
+def insert_chunks(conn, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            conn.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(insert(table), chunk)
+
+def seed(records: int) -> dict:
+    users = max(100, records // 1000)
+    sets = users * 4
+    cards = sets * 50
+    sessions = records // 10
+    with engine.begin() as conn:
+        insert_chunks(conn, models.User.__table__, (
+            {"id": i, "username": f"bench{i}", "email": f"bench{i}@example.com", "hashed_password": "x",
+             "created_at": NOW - timedelta(minutes=i)}
+            for i in range(1, users + 1)
+        ))
+        insert_chunks(conn, models.FlashcardSet.__table__, (
+            {"id": i, "title": f"Set {i}", "owner_id": (i - 1) % users + 1, "is_public": i % 50 == 0,
+             "created_at": NOW - timedelta(minutes=i)}
+            for i in range(1, sets + 1)
+        ))
+        insert_chunks(conn, models.Flashcard.__table__, (
+            {"id": i, "set_id": (i - 1) // 50 + 1, "front": f"front {i}", "back": f"back {i}"}
+            for i in range(1, cards + 1)
+        ))
+        # (user, flashcard) khác nhau cho mọi i < users * cards
+        insert_chunks(conn, models.StudyRecord.__table__, (
+            {"user_id": i % users + 1, "flashcard_id": (i // users) % cards + 1, "ease_factor": 2.5,
+             "interval": 1 + i % 30, "repetitions": i % 5, "total_reviews": 1 + i % 5,
+             "next_review_date": NOW + timedelta(days=i % 60 - 30)}
+            for i in range(records)
+        ))
+        insert_chunks(conn, models.StudySession.__table__, (
+            {"user_id": i % users + 1, "set_id": i % sets + 1, "cards_studied": 10,
+             "started_at": NOW - timedelta(hours=i % 2000),
+             "completed_at": NOW - timedelta(hours=i % 2000) + timedelta(minutes=10)}
+            for i in range(sessions)
+        ))
+        insert_chunks(conn, models.Leaderboard.__table__, (
+            {"user_id": i, "points": (i * 7919) % 100_000} for i in range(1, users + 1)
+        ))
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    return {"users": users, "sets": sets, "cards": cards}
+
+# (tên, bảng, SQL, sinh tham số)
+QUERIES = [
+    ("record by user+card", "study_records",
+     "SELECT * FROM study_records WHERE user_id = :user_id AND flashcard_id = :flashcard_id",
+     lambda n, rng: {"user_id": rng.randint(1, n["users"]), "flashcard_id": rng.randint(1, n["cards"])}),
+    ("due records of user", "study_records",
+     "SELECT flashcard_id FROM study_records WHERE user_id = :user_id AND next_review_date <= :now",
+     lambda n, rng: {"user_id": rng.randint(1, n["users"]), "now": NOW}),
+    ("sessions since", "study_sessions",
+     "SELECT count(*) FROM study_sessions WHERE user_id = :user_id AND started_at >= :since",
+     lambda n, rng: {"user_id": rng.randint(1, n["users"]), "since": NOW - timedelta(days=30)}),
+    ("last studied per set", "study_sessions",
+     "SELECT set_id, max(completed_at) FROM study_sessions "
+     "WHERE user_id = :user_id AND completed_at IS NOT NULL GROUP BY set_id",
+     lambda n, rng: {"user_id": rng.randint(1, n["users"])}),
+    ("cards of set", "flashcards",
+     "SELECT id, front, back FROM flashcards WHERE set_id = :set_id",
+     lambda n, rng: {"set_id": rng.randint(1, n["sets"])}),
+    ("sets of owner", "flashcard_sets",
+     "SELECT id FROM flashcard_sets WHERE owner_id = :owner_id",
+     lambda n, rng: {"owner_id": rng.randint(1, n["users"])}),
+    ("public sets", "flashcard_sets",
+     "SELECT id FROM flashcard_sets WHERE is_public = :public ORDER BY created_at DESC, id DESC LIMIT 20",
+     lambda n, rng: {"public": True}),
+    ("leaderboard top", "leaderboard",
+     "SELECT user_id, points FROM leaderboard ORDER BY points DESC LIMIT 10",
+     lambda n, rng: {}),
+]
+
+def explain(conn, sql: str, params: dict) -> list:
+    if engine.dialect.name == "sqlite":
+        return [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql), params)]
+    return [row[0] for row in conn.execute(text("EXPLAIN " + sql), params)]
+
+def is_full_scan(plan: list, table: str) -> bool:
+    if engine.dialect.name == "sqlite":
+        return any(line.startswith(f"SCAN {table}") and "INDEX" not in line for line in plan)
+    return any(f"Seq Scan on {table}" in line for line in plan)
+
+def percentile(timings: list, fraction: float) -> float:
+    return sorted(timings)[min(len(timings) - 1, int(len(timings) * fraction))]
+
+def run(sizes: dict, check_plans: bool) -> int:
+    rng = random.Random(0)
+    full_scans = 0
+    with engine.connect() as conn:
+        for name, table, sql, make_params in QUERIES:
+            plan = explain(conn, sql, make_params(sizes, rng))
+            scan = is_full_scan(plan, table)
+            timings = []
+            for _ in range(RUNS_PER_QUERY):
+                params = make_params(sizes, rng)
+                start = time.perf_counter()
+                conn.execute(text(sql), params).all()
+                timings.append(time.perf_counter() - start)
+            flag = "FULL SCAN" if scan else "index"
+            print(f"{name:24} p50 {percentile(timings, 0.5) * 1000:8.3f} ms  p99 {percentile(timings, 0.99) * 1000:8.3f} ms  {flag}")
+            for line in plan:
+                print(f"    {line}")
+            if scan and check_plans:
+                full_scans += 1
+    return full_scans
+
+def main() -> int:
+    records = int(next((arg for arg in sys.argv[1:] if arg.isdigit()), 1_000_000))
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        if conn.scalar(select(func.count()).select_from(models.User.__table__)):
+            print("BENCH_DATABASE_URL must point to an empty database")
+            return 2
+
+    start = time.perf_counter()
+    sizes = seed(records)
+    print(f"{engine.dialect.name}: seeded {records:,} study records, {sizes['cards']:,} cards, "
+          f"{sizes['users']:,} users in {time.perf_counter() - start:.1f}s\n")
+    full_scans = run(sizes, check_plans=True)
+
+    if "--compare" in sys.argv:
+        with engine.begin() as conn:
+            for index_name, table, _, _ in load_migration_indexes():
+                conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+            conn.execute(text("ANALYZE"))
+        print("\nwithout the 0001 indexes:")
+        run(sizes, check_plans=False)
+
+    if full_scans:
+        print(f"\n{full_scans} hot queries scan a whole table")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Benchmark đăng nhập đồng thời (bcrypt trong process pool, xem app/auth.py)
+
+Chạy: cd backend && python bench_login.py [số lần login, mặc định 200] [số request đồng thời, mặc định 50]
+Mặc định gọi app trong process (SQLite tạm); đặt BENCH_URL=http://host:port để
+đo một server uvicorn đang chạy (script đăng ký benchuser0..19 với mật khẩu
+BENCH_PASSWORD; user đã có thì giữ nguyên).
+
+Trong lúc login, một vòng lặp gọi /api/health liên tục: p99 của nó cho thấy
+login có làm nghẽn các endpoint rẻ hay không. In throughput, p50/p99 của
+login và health, cùng số request bị từ chối 503 vì hàng đợi bcrypt đầy.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BENCH_URL = os.getenv("BENCH_URL")
+if not BENCH_URL:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_login.db")
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+
+import httpx
+
+PASSWORD = os.getenv("BENCH_PASSWORD", "bench-password")
+USERS = 20
+HEALTH_INTERVAL = 0.01
+
+def percentile(timings: list, fraction: float) -> float:
+    if not timings:
+        return 0.0
+    return sorted(timings)[min(len(timings) - 1, int(len(timings) * fraction))]
+
+def seed_users():
+    from app.database import Base, SessionLocal, engine
+    from app import auth, models
+    Base.metadata.create_all(bind=engine)
+    hashed = auth.get_password_hash(PASSWORD)
+    db = SessionLocal()
+    try:
+        db.add_all(
+            models.User(username=f"benchuser{i}", email=f"benchuser{i}@example.com", hashed_password=hashed)
+            for i in range(USERS)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+async def run(client: httpx.AsyncClient, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    login_timings, health_timings = [], []
+    statuses: dict = {}
+    done = asyncio.Event()
+
+    async def login(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/auth/login", json={
+                "username": f"benchuser{i % USERS}", "password": PASSWORD
+            })
+            login_timings.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    async def poll_health():
+        while not done.is_set():
+            start = time.perf_counter()
+            await client.get("/api/health")
+            health_timings.append(time.perf_counter() - start)
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    health_task = asyncio.create_task(poll_health())
+    start = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await health_task
+
+    ok = statuses.get(200, 0)
+    print(f"{logins} logins, concurrency {concurrency}: {elapsed:.2f}s, {ok / elapsed:.1f} successful logins/s")
+    print(f"status codes: {dict(sorted(statuses.items()))}")
+    print(f"login   p50 {percentile(login_timings, 0.5) * 1000:8.1f} ms  p99 {percentile(login_timings, 0.99) * 1000:8.1f} ms")
+    print(f"health  p50 {percentile(health_timings, 0.5) * 1000:8.1f} ms  p99 {percentile(health_timings, 0.99) * 1000:8.1f} ms"
+          f"  ({len(health_timings)} requests)")
+
+async def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    if BENCH_URL:
+        async with httpx.AsyncClient(base_url=BENCH_URL, timeout=60) as client:
+            for i in range(USERS):
+                await client.post("/api/auth/register", json={
+                    "username": f"benchuser{i}", "email": f"benchuser{i}@example.com", "password": PASSWORD
+                })
+            await run(client, logins, concurrency)
+        return
+
+    seed_users()
+    from app.main import app
+    from app.auth import password_pool
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            # Khởi động worker của pool trước khi đo
+            await client.post("/api/auth/login", json={"username": "benchuser0", "password": PASSWORD})
+            await run(client, logins, concurrency)
+    finally:
+        password_pool.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+"""
+Microbenchmark: calculate_next_review (scalar) vs calculate_next_review_batch (NumPy)
+
+Chạy: cd backend && python bench_scheduler.py [số record, mặc định 200000]
+In số record xử lý mỗi giây của từng cách (lấy lần chạy nhanh nhất).
+"""
+import sys
+import time
+import numpy as np
+from app.spaced_repetition import calculate_next_review, calculate_next_review_batch
+
+REPEAT = 5
+
+def best_of(func, repeat: int = REPEAT) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    rng = np.random.default_rng(0)
+    ease_factors = rng.uniform(1.3, 3.0, n)
+    intervals = rng.integers(1, 365, n)
+    repetitions = rng.integers(0, 10, n)
+    qualities = rng.integers(0, 6, n)
+    rows = list(zip(ease_factors.tolist(), intervals.tolist(), repetitions.tolist(), qualities.tolist()))
+
+    scalar = best_of(lambda: [calculate_next_review(*row) for row in rows], repeat=1)
+    batch = best_of(lambda: calculate_next_review_batch(ease_factors, intervals, repetitions, qualities))
+
+    print(f"{n} records")
+    print(f"scalar: {scalar * 1000:8.1f} ms  {n / scalar:14,.0f} records/s")
+    print(f"batch:  {batch * 1000:8.1f} ms  {n / batch:14,.0f} records/s  ({scalar / batch:.0f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Kiểm tra query budget (@query_budget, xem app/query_budget.py) trên dữ liệu mẫu
+
+Chạy trước khi deploy: cd backend && python check_query_budgets.py
+Tạo database SQLite tạm, seed SEED_ROWS user / set / thẻ / lượt học (lớn hơn
+mọi budget, nên một truy vấn cho mỗi dòng kết quả chắc chắn vượt budget),
+rồi gọi các route có budget với QUERY_BUDGET_MODE=raise.
+Exit code 1 nếu một route vượt budget, lỗi, hoặc có budget mà chưa được gọi ở đây.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "query_budget.db")
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["QUERY_BUDGET_MODE"] = "raise"
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.main import app
+from app.database import SessionLocal, engine, async_engine
+from app import models, auth, query_budget
+from app.routers import auth as auth_router, flashcards, study, leaderboard, ai, admin
+
+SEED_ROWS = 40
+PASSWORD = "budget123"
+
+def seed():
+    """Returns the id of the student's large set"""
+    now = datetime.now(timezone.utc)
+    hashed = auth.get_password_hash(PASSWORD)
+    db = SessionLocal()
+    try:
+        student = models.User(username="student", email="student@example.com", hashed_password=hashed)
+        db.add_all([
+            student,
+            models.User(username="admin", email="admin@example.com", hashed_password=hashed, is_admin=True),
+        ])
+        others = [
+            models.User(
+                username=f"user{i}", email=f"user{i}@example.com", hashed_password=hashed,
+                last_active_at=now - timedelta(hours=i)
+            )
+            for i in range(SEED_ROWS)
+        ]
+        db.add_all(others)
+        db.flush()
+
+        big_set = models.FlashcardSet(title="Budget set", owner_id=student.id, is_public=True)
+        db.add(big_set)
+        db.add_all(models.FlashcardSet(title=f"Own {i}", owner_id=student.id) for i in range(SEED_ROWS))
+        db.add_all(models.FlashcardSet(title=f"Public {i}", owner_id=user.id, is_public=True) for i, user in enumerate(others))
+        db.flush()
+
+        cards = [models.Flashcard(set_id=big_set.id, front=f"front {i}", back=f"back {i}") for i in range(SEED_ROWS * 2)]
+        db.add_all(cards)
+        db.flush()
+        # Nửa số thẻ đã học (một phần đến hạn), nửa còn lại chưa từng học
+        db.add_all(
+            models.StudyRecord(
+                flashcard_id=card.id, user_id=student.id, repetitions=1, interval=1,
+                next_review_date=now + timedelta(days=i % 3 - 1), last_reviewed=now - timedelta(days=1),
+                total_reviews=1, correct_count=1
+            )
+            for i, card in enumerate(cards[:SEED_ROWS])
+        )
+        db.add_all(
+            models.StudySession(
+                user_id=user.id, set_id=big_set.id, cards_studied=5, cards_correct=4,
+                started_at=now - timedelta(days=1), completed_at=now - timedelta(days=1)
+            )
+            for user in [student, *others]
+        )
+        db.add_all(
+            models.Leaderboard(user_id=user.id, points=100 * i, total_cards_studied=i)
+            for i, user in enumerate([student, *others])
+        )
+        db.commit()
+        return big_set.id
+    finally:
+        db.close()
+
+def budgeted_endpoints():
+    return {
+        route.endpoint
+        for module in (auth_router, flashcards, study, leaderboard, ai, admin)
+        for route in module.router.routes
+        if query_budget.budget_for(getattr(route, "endpoint", None)) is not None
+    }
+
+def main() -> int:
+    set_id = seed()
+    queries = [0]
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "after_cursor_execute", lambda *args: queries.__setitem__(0, queries[0] + 1))
+
+    called = set()
+    async def recording_app(scope, receive, send):
+        await app(scope, receive, send)
+        route = scope.get("route")
+        if route is not None:
+            called.add(route.endpoint)
+
+    checks = [
+        ("student", f"/api/study/sets/{set_id}/due"),  # lần đầu: tạo record cho thẻ chưa học
+        ("student", f"/api/study/sets/{set_id}/due"),
+        ("student", f"/api/study/progress/{set_id}"),
+        ("student", "/api/study/sets/last-studied"),
+        ("student", "/api/study/forecast?days=30"),
+        ("student", "/api/leaderboard/?limit=50"),  # cache miss
+        ("student", "/api/leaderboard/?limit=50"),  # cache hit
+        ("student", "/api/leaderboard/my-rank?neighbors=20"),
+        ("student", "/api/flashcards/sets"),
+        ("student", "/api/flashcards/sets/my"),
+        ("student", f"/api/flashcards/sets/{set_id}"),
+        ("student", f"/api/flashcards/sets/{set_id}/cards"),
+        ("admin", "/api/admin/users"),
+        ("admin", "/api/admin/sets"),
+    ]
+
+    failures = []
+    with TestClient(recording_app) as client:
+        headers = {}
+        for username in ("student", "admin"):
+            token = client.post("/api/auth/login", json={"username": username, "password": PASSWORD}).json()["access_token"]
+            headers[username] = {"Authorization": f"Bearer {token}"}
+        for username, path in checks:
+            queries[0] = 0
+            try:
+                response = client.get(path, headers=headers[username])
+            except query_budget.QueryBudgetExceeded as e:
+                failures.append(str(e))
+                print(f"FAIL {path}")
+                continue
+            if response.status_code != 200:
+                failures.append(f"GET {path} returned {response.status_code}: {response.text[:200]}")
+                print(f"FAIL {path}")
+                continue
+            print(f"ok   {path} ({queries[0]} queries)")
+
+    for endpoint in budgeted_endpoints() - called:
+        failures.append(f"{endpoint.__module__}.{endpoint.__name__} has a query budget but is not checked here")
+
+    if failures:
+        print()
+        print("\n".join(failures))
+        return 1
+    print("All query budgets respected")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
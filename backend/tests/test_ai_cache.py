@@ -0,0 +1,54 @@
+"""
+AICache.get_or_compute must only cache well-formed generation results
+
+Chạy: cd backend && python -m pytest
+"""
+import asyncio
+import pytest
+from app.ai_cache import AICache
+
+KEY = "ab" * 32
+CARDS = [{"front": "Q", "back": "A"}]
+
+def compute_count(cache: AICache, results: list) -> list:
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        result = results[len(calls) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def scenario():
+        outcomes = []
+        for _ in results:
+            try:
+                outcomes.append(await cache.get_or_compute(KEY, compute))
+            except ValueError as e:
+                outcomes.append(e)
+        return outcomes
+
+    outcomes = asyncio.run(scenario())
+    assert len(calls) == len(results)
+    return outcomes
+
+@pytest.mark.parametrize("bad", [[], {"error": "rate limited"}, [{"front": "Q"}], [{"front": "", "back": "A"}], "[]"])
+def test_malformed_results_are_not_cached(tmp_path, bad):
+    cache = AICache(directory=tmp_path)
+    # Lần gọi thứ hai phải gọi lại backend, không trả kết quả lỗi từ cache
+    assert compute_count(cache, [bad, CARDS]) == [bad, CARDS]
+    assert cache.get(KEY) == CARDS
+
+def test_exceptions_are_not_cached(tmp_path):
+    cache = AICache(directory=tmp_path)
+    error, value = compute_count(cache, [ValueError("bad reply"), CARDS])
+    assert isinstance(error, ValueError) and value == CARDS
+
+def test_malformed_file_on_disk_is_a_miss(tmp_path):
+    cache = AICache(directory=tmp_path)
+    cache.put(KEY, CARDS)
+    path = tmp_path / KEY[:2] / f"{KEY}.json"
+    path.write_text("[]")
+    assert cache.get(KEY) is None
+    assert not path.exists()
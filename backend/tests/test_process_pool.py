@@ -0,0 +1,40 @@
+"""
+BoundedProcessPool must recover after a worker process dies
+
+Chạy: cd backend && python -m pytest
+"""
+import asyncio
+import os
+import signal
+import pytest
+from fastapi import HTTPException
+from app.process_pool import BoundedProcessPool
+
+def crash():
+    os._exit(1)
+
+@pytest.fixture
+def pool():
+    pool = BoundedProcessPool(max_workers=1, max_pending=4)
+    yield pool
+    pool.shutdown()
+
+def test_recovers_after_worker_is_killed(pool):
+    async def scenario():
+        pid = await pool.run(os.getpid)
+        os.kill(pid, signal.SIGKILL)
+        # Chờ executor nhận ra worker đã chết
+        await asyncio.sleep(0.5)
+        return pid, await pool.run(os.getpid)
+    old_pid, new_pid = asyncio.run(scenario())
+    assert new_pid != old_pid
+
+def test_job_that_always_kills_its_worker_gets_503(pool):
+    async def scenario():
+        with pytest.raises(HTTPException) as error:
+            await pool.run(crash)
+        assert error.value.status_code == 503
+        assert pool.pending == 0
+        # Pool dùng lại được sau đó
+        return await pool.run(os.getpid)
+    assert asyncio.run(scenario()) != os.getpid()
@@ -0,0 +1,88 @@
+"""
+RankIndex must agree with a plain sorted list of (-points, user_id)
+
+Chạy: cd backend && python -m pytest
+"""
+import bisect
+import random
+import pytest
+from app import rank_index as rank_index_module
+from app.rank_index import RankIndex
+
+@pytest.fixture(autouse=True)
+def small_buckets(monkeypatch):
+    # Bucket nhỏ để test đi qua cả tách bucket và xóa bucket rỗng
+    monkeypatch.setattr(rank_index_module, "LOAD", 4)
+
+def check(index: RankIndex, points: dict):
+    keys = sorted((-p, user_id) for user_id, p in points.items())
+    assert len(index) == len(keys)
+    for user_id, p in points.items():
+        assert index.rank(user_id) == bisect.bisect_left(keys, (-p,)) + 1
+        i = keys.index((-p, user_id))
+        for k in (0, 1, 3):
+            window = keys[max(0, i - k):i + k + 1]
+            assert [(entry["user_id"], entry["points"]) for entry in index.neighbors(user_id, k)] == \
+                [(uid, -neg_points) for neg_points, uid in window]
+
+@pytest.mark.parametrize("seed", range(3))
+def test_random_updates(seed):
+    rng = random.Random(seed)
+    index = RankIndex()
+    points = {}
+    for step in range(1500):
+        user_id = rng.randint(1, 120)
+        if rng.random() < 0.15:
+            index.remove(user_id)
+            points.pop(user_id, None)
+        else:
+            # Ít giá trị điểm khác nhau: nhiều user đồng hạng
+            points[user_id] = rng.randint(0, 20) * 5
+            index.update(user_id, points[user_id])
+        if step % 100 == 0:
+            check(index, points)
+    check(index, points)
+    assert index.rank(999) is None and index.neighbors(999, 2) == []
+
+def test_remove_everyone_then_reuse():
+    index = RankIndex()
+    for user_id in range(1, 30):
+        index.update(user_id, user_id % 7)
+    for user_id in range(1, 30):
+        index.remove(user_id)
+    assert len(index) == 0
+    index.update(5, 10)
+    index.update(6, 10)
+    index.update(7, 30)
+    check(index, {5: 10, 6: 10, 7: 30})
+    assert index.rank(5) == index.rank(6) == 2
+
+class FakeQuery:
+    """Stands in for db.query(...): applies index updates while the 'query' runs"""
+
+    def __init__(self, rows, during):
+        self.rows = rows
+        self.during = during
+
+    def query(self, *columns):
+        return self
+
+    def all(self):
+        self.during()
+        return self.rows
+
+def test_rebuild_keeps_changes_made_while_it_queries():
+    index = RankIndex()
+    index.update(1, 10)
+    index.update(2, 20)
+
+    def concurrent_updates():
+        index.update(1, 50)
+        index.remove(2)
+        index.update(3, 5)
+
+    # Snapshot đọc trước các thay đổi trên: 1 -> 10, 2 -> 20, 4 -> 40 (do worker khác ghi)
+    index.rebuild(FakeQuery([(1, 10), (2, 20), (4, 40)], concurrent_updates))
+    check(index, {1: 50, 3: 5, 4: 40})
+    index.update(2, 1)
+    check(index, {1: 50, 2: 1, 3: 5, 4: 40})
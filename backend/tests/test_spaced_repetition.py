@@ -0,0 +1,80 @@
+"""
+calculate_next_review_batch must match calculate_next_review element for element
+
+Chạy: cd backend && python -m pytest
+"""
+import random
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pytest
+from app.spaced_repetition import calculate_next_review, calculate_next_review_batch
+
+NOW = datetime(2026, 10, 17, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+def assert_equivalent(ease_factors, intervals, repetitions, qualities):
+    new_ease, new_intervals, new_repetitions, next_dates = calculate_next_review_batch(
+        ease_factors, intervals, repetitions, qualities, now=NOW
+    )
+    for i, args in enumerate(zip(ease_factors, intervals, repetitions, qualities)):
+        before = datetime.now(timezone.utc)
+        ease, interval, reps, next_date = calculate_next_review(*args)
+        after = datetime.now(timezone.utc)
+        # So sánh bit-for-bit, không dùng tolerance
+        assert new_ease[i] == ease and type(ease) is float, (args, new_ease[i], ease)
+        assert new_intervals[i] == interval, (args, new_intervals[i], interval)
+        assert new_repetitions[i] == reps, (args, new_repetitions[i], reps)
+        assert before + timedelta(days=interval) <= next_date <= after + timedelta(days=interval)
+        assert next_dates[i] == np.datetime64((NOW + timedelta(days=interval)).replace(tzinfo=None), "us")
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_inputs(seed):
+    rng = random.Random(seed)
+    n = 2000
+    assert_equivalent(
+        # Một phần ease dưới 1.3 (dữ liệu cũ) để đi qua cả nhánh floor
+        [rng.uniform(1.0, 3.5) for _ in range(n)],
+        [rng.randint(0, 400) for _ in range(n)],
+        [rng.randint(0, 12) for _ in range(n)],
+        [rng.randint(0, 5) for _ in range(n)],
+    )
+
+def test_interval_truncation_edges():
+    # interval * ease sát một số nguyên (trên hoặc dưới do làm tròn float64)
+    cases = [
+        (2.5, 6), (2.36, 25), (1.3, 7), (1.1, 3), (2.3, 10), (1.7000000000000002, 10),
+        (2.9999999999999996, 100), (1.4, 5), (2.05, 20), (1.3000000000000003, 10),
+    ]
+    ease_factors = [ease for ease, _ in cases]
+    intervals = [interval for _, interval in cases]
+    for quality in range(6):
+        assert_equivalent(ease_factors, intervals, [2] * len(cases), [quality] * len(cases))
+
+def test_first_and_second_repetition_steps():
+    assert_equivalent([2.5] * 4, [40, 40, 40, 40], [0, 1, 0, 1], [4, 4, 5, 3])
+    _, intervals, repetitions, _ = calculate_next_review_batch([2.5, 2.5], [40, 40], [0, 1], [4, 4], now=NOW)
+    assert intervals.tolist() == [1, 6]
+    assert repetitions.tolist() == [1, 2]
+
+def test_ease_floor():
+    ease_factors = [1.3, 1.3, 1.35, 1.45, 1.2, 1.3000000000000003]
+    qualities = [0, 2, 3, 3, 5, 1]
+    assert_equivalent(ease_factors, [10] * 6, [3] * 6, qualities)
+    new_ease, _, _, _ = calculate_next_review_batch(ease_factors, [10] * 6, [3] * 6, qualities, now=NOW)
+    assert (new_ease >= 1.3).all()
+    assert new_ease[0] == 1.3
+
+def test_review_chains_stay_identical():
+    # Áp dụng nhiều lần liên tiếp: sai lệch nhỏ nhất cũng sẽ tích lũy
+    rng = random.Random(42)
+    n = 500
+    scalar = [(2.5, 1, 0)] * n
+    ease_factors, intervals, repetitions = np.full(n, 2.5), np.ones(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    for _ in range(10):
+        qualities = [rng.choice((2, 3, 4, 5, 5)) for _ in range(n)]
+        ease_factors, intervals, repetitions, _ = calculate_next_review_batch(
+            ease_factors, intervals, repetitions, qualities, now=NOW
+        )
+        scalar = [calculate_next_review(ease, interval, reps, quality)[:3] for (ease, interval, reps), quality in zip(scalar, qualities)]
+    assert ease_factors.tolist() == [ease for ease, _, _ in scalar]
+    assert intervals.tolist() == [interval for _, interval, _ in scalar]
+    assert repetitions.tolist() == [reps for _, _, reps in scalar]